@@ -0,0 +1,112 @@
+"""
+Compares reading the index fields of large mmCIF files with a full gemmi parse
+against the header-only reader, which skips the coordinates. Every reader runs
+in a fresh process to measure its peak RSS.
+
+By default a model with --atoms atoms is synthesised from the sample CIF file
+(~90 bytes per atom, 3M atoms make a ~270 MB file), pass --cif to use a real
+ModelCIF file.
+
+Usage:
+    python benchmarks/bench_ciftojson.py --atoms 3000000
+    python benchmarks/bench_ciftojson.py --cif model.cif
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from bio3dbeacons.cli import utils  # noqa
+
+SAMPLE_CIF = (
+    Path(__file__).parent.parent
+    / "tests"
+    / "data"
+    / "cif"
+    / "P38398_1jm7.1.A_1_103.cif"
+)
+
+ATOM = "ATOM {0} C CA . ALA A 1 {1} ? 10.123 -4.567 21.890 1.00 85.20 ? {1} A 1\n"
+TRAILER = """#
+loop_
+_ma_qa_metric_local.ordinal_id
+_ma_qa_metric_local.model_id
+_ma_qa_metric_local.label_seq_id
+_ma_qa_metric_local.metric_value
+1 1 1 85.20
+"""
+
+
+def make_cif(path: Path, atoms: int):
+    """Writes the header of the sample CIF file followed by many atoms"""
+    header = SAMPLE_CIF.read_text().split("loop_\n_atom_site.", 1)[0]
+    atom_site_tags = (
+        "group_PDB id type_symbol label_atom_id label_alt_id label_comp_id "
+        "label_asym_id label_entity_id label_seq_id pdbx_PDB_ins_code Cartn_x "
+        "Cartn_y Cartn_z occupancy B_iso_or_equiv pdbx_formal_charge auth_seq_id "
+        "auth_asym_id pdbx_PDB_model_num"
+    ).split()
+    with open(path, "w") as fh:
+        fh.write(header)
+        fh.write("loop_\n")
+        fh.writelines(f"_atom_site.{x}\n" for x in atom_site_tags)
+        for i in range(1, atoms + 1):
+            fh.write(ATOM.format(i, i // 5 + 1))
+        fh.write(TRAILER)
+
+
+def read(cif_path: str, header_only: bool):
+    from gemmi import cif
+
+    start = time.perf_counter()
+    if header_only:
+        text = utils.read_cif_categories(cif_path, utils.get_index_cif_categories())
+        doc = cif.read_string(text)
+    else:
+        doc = cif.read_file(cif_path)
+    data = utils.prepare_data_dictionary_from_cif(doc.sole_block())
+    seconds = time.perf_counter() - start
+
+    # kilobytes on Linux
+    return data, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(cif_path: str, header_only: bool):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(read, cif_path, header_only).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--atoms", type=int, default=1000000, help="Atoms to write")
+    parser.add_argument("--cif", default=None, help="CIF file to read instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cif_path = args.cif
+        if cif_path is None:
+            cif_path = os.path.join(temp_dir, "model.cif")
+            make_cif(Path(cif_path), args.atoms)
+
+        print(f"file size: {os.path.getsize(cif_path) / 2**20:.0f} MiB")
+        results = {}
+        for name, header_only in (("full", False), ("header", True)):
+            data, seconds, rss = bench(cif_path, header_only)
+            results[name] = data
+            print(f"{name:>8}: {seconds:8.2f} s {rss:10.0f} MiB peak RSS")
+
+    if results["full"] != results["header"]:
+        raise RuntimeError("The readers extracted different fields")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares computing the average confidence score of large PDB files with the
+former per-line loop against the vectorized engine, which reads the columns of
+the memory mapped file in bulk.
+
+By default a model with --atoms atoms is synthesised (~80 bytes per atom,
+1M atoms make a ~80 MB file), pass --pdb to use a real PDB file.
+
+Usage:
+    python benchmarks/bench_confidence.py --atoms 1000000
+    python benchmarks/bench_confidence.py --pdb model.pdb
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from bio3dbeacons.cli import confidence  # noqa
+from bio3dbeacons.cli.fileio import open_file  # noqa
+
+ATOM = (
+    "ATOM  {0:5d}  CA  ALA A{1:4d}    {2:8.3f}{3:8.3f}{4:8.3f}  1.00{5:6.2f}"
+    "           C\n"
+)
+
+
+def make_pdb(path: Path, atoms: int):
+    with open(path, "w") as fh:
+        for i in range(1, atoms + 1):
+            residue = i // 8 % 10000
+            fh.write(ATOM.format(i % 100000, residue, 1.0, 2.0, 3.0, residue % 100))
+        fh.write("END\n")
+
+
+def legacy(pdb_path: str) -> float:
+    """The per-line loop of get_avg_plddt_from_pdb() before the engine"""
+    plddt_total = 0
+    residue_count = 0
+    current_res_seq_num = None
+    with open_file(pdb_path, "rt") as fh:
+        for line in fh:
+            if not line.startswith("ATOM"):
+                continue
+            res_seq_num = int(line[22:26].strip())
+            temperature_factor = float(line[60:66].strip())
+
+            if current_res_seq_num != res_seq_num:
+                current_res_seq_num = res_seq_num
+                plddt_total += temperature_factor
+                residue_count += 1
+
+    return plddt_total / residue_count
+
+
+def vectorized(pdb_path: str) -> float:
+    return confidence.read_pdb_confidence(pdb_path).average
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--atoms", type=int, default=1000000, help="Atoms to write")
+    parser.add_argument("--pdb", default=None, help="PDB file to read instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdb_path = args.pdb
+        if pdb_path is None:
+            pdb_path = os.path.join(temp_dir, "model.pdb")
+            make_pdb(Path(pdb_path), args.atoms)
+
+        print(f"file size: {os.path.getsize(pdb_path) / 2**20:.0f} MiB")
+        results = {}
+        for name, func in (("legacy", legacy), ("numpy", vectorized)):
+            start = time.perf_counter()
+            results[name] = func(pdb_path)
+            seconds = time.perf_counter() - start
+            print(f"{name:>8}: {seconds:8.3f} s")
+
+    if abs(results["legacy"] - results["numpy"]) > 1e-6:
+        raise RuntimeError("The methods computed different averages")
+
+
+if __name__ == "__main__":
+    main()
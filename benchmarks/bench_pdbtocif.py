@@ -0,0 +1,67 @@
+"""
+Compares the PDB to CIF conversion throughput of the in-process gemmi engine
+against the external gemmi program.
+
+Usage:
+    python benchmarks/bench_pdbtocif.py --models 200
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from bio3dbeacons.cli import constants  # noqa
+from bio3dbeacons.cli.pdbtocif import pdbtocif  # noqa
+
+SAMPLE_PDB = Path(__file__).parent.parent / "tests/data/pdb/P38398_1jm7.1.A_1_103.pdb"
+
+
+def bench(engine: str, pdb_files, output_dir: Path) -> float:
+    start = time.perf_counter()
+    for pdb_file in pdb_files:
+        status = pdbtocif.process(
+            pdb_file.as_posix(),
+            (output_dir / f"{pdb_file.stem}.cif").as_posix(),
+            engine,
+        )
+        if status:
+            raise RuntimeError(f"{engine} engine failed on {pdb_file}")
+
+    return len(pdb_files) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", type=int, default=200, help="Number of models")
+    parser.add_argument("--pdb", default=SAMPLE_PDB.as_posix(), help="Sample PDB file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        (temp_dir / "pdb").mkdir()
+        pdb_files = []
+        for i in range(args.models):
+            pdb_file = temp_dir / "pdb" / f"model_{i}.pdb"
+            shutil.copy(args.pdb, pdb_file)
+            pdb_files.append(pdb_file)
+
+        engines = [constants.ENGINE_PYTHON]
+        if shutil.which(pdbtocif.GEMMI_BIN):
+            engines.append(constants.ENGINE_BINARY)
+        else:
+            print(f"{pdbtocif.GEMMI_BIN} not found, skipping the binary engine")
+
+        for engine in engines:
+            output_dir = temp_dir / engine
+            output_dir.mkdir()
+            rate = bench(engine, pdb_files, output_dir)
+            print(f"{engine:>8}: {rate:10.1f} models/s")
+
+
+if __name__ == "__main__":
+    main()
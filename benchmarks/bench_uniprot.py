@@ -0,0 +1,106 @@
+"""
+Compares extracting the index document fields from UniProt XML entries with a
+full ElementTree parse against the streaming extractor, which stops parsing
+after the <organism> element.
+
+By default a large entry is synthesised (titin has ~35k residues and
+thousands of features and references), pass --xml to use a downloaded entry,
+e.g. https://rest.uniprot.org/uniprotkb/Q8WZ42.xml
+
+Usage:
+    python benchmarks/bench_uniprot.py --repeat 50
+    python benchmarks/bench_uniprot.py --xml Q8WZ42.xml
+"""
+
+import argparse
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from bio3dbeacons.cli import uniprot  # noqa
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<uniprot xmlns="http://uniprot.org/uniprot">
+<entry dataset="Swiss-Prot">
+  <accession>Q8WZ42</accession>
+  <name>TITIN_HUMAN</name>
+  <protein>
+    <recommendedName><fullName>Titin</fullName></recommendedName>
+  </protein>
+  <gene><name type="primary">TTN</name></gene>
+  <organism>
+    <name type="scientific">Homo sapiens</name>
+    <dbReference type="NCBI Taxonomy" id="9606"/>
+  </organism>
+"""
+
+REFERENCE = """  <reference key="{0}">
+    <citation type="journal article" date="2001" name="Nature" volume="409">
+      <title>Reference {0}</title>
+      <authorList><person name="Author A."/><person name="Author B."/></authorList>
+      <dbReference type="PubMed" id="{0}"/>
+    </citation>
+    <scope>NUCLEOTIDE SEQUENCE</scope>
+  </reference>
+"""
+
+FEATURE = """  <feature type="domain" description="Ig-like {0}" evidence="1">
+    <location><begin position="{0}"/><end position="{1}"/></location>
+  </feature>
+"""
+
+
+def make_entry(references: int, features: int, length: int) -> bytes:
+    parts = [HEADER]
+    parts.extend(REFERENCE.format(i) for i in range(references))
+    parts.extend(FEATURE.format(i, i + 90) for i in range(features))
+    parts.append(f'  <sequence length="{length}">{"M" * length}</sequence>\n')
+    parts.append("</entry>\n</uniprot>\n")
+
+    return "".join(parts).encode()
+
+
+def full_parse(content: bytes):
+    return uniprot.parse_uniprot_entry(ET.fromstring(content))
+
+
+def streaming(content: bytes):
+    return uniprot.extract_uniprot_fields(uniprot.iter_chunks(content))
+
+
+def bench(func, content: bytes, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(content)
+
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20, help="Parses per method")
+    parser.add_argument("--xml", default=None, help="UniProt XML of an entry")
+    parser.add_argument("--references", type=int, default=500)
+    parser.add_argument("--features", type=int, default=3000)
+    parser.add_argument("--length", type=int, default=35000)
+    args = parser.parse_args()
+
+    if args.xml:
+        content = Path(args.xml).read_bytes()
+    else:
+        content = make_entry(args.references, args.features, args.length)
+
+    if full_parse(content) != streaming(content):
+        raise RuntimeError("The parsers extracted different fields")
+
+    print(f"entry size: {len(content) / 1024:.0f} KiB")
+    for name, func in (("full", full_parse), ("stream", streaming)):
+        seconds = bench(func, content, args.repeat)
+        print(f"{name:>8}: {seconds * 1000:10.3f} ms/entry")
+
+
+if __name__ == "__main__":
+    main()
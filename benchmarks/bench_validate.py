@@ -0,0 +1,96 @@
+"""
+Compares validating index documents against the schema with a call to
+jsonschema.validate() per document, as the former validate-index did, against
+the validator compiled once and reused by ValidateJSON.
+
+--documents documents are validated, one in ten of them invalid.
+
+Usage:
+    python benchmarks/bench_validate.py --documents 2000
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import jsonschema
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+
+from bio3dbeacons.cli.validatejson.validatejson import (  # noqa
+    ValidateJSON,
+    ValidationReport,
+)
+
+
+def make_document(i: int) -> dict:
+    return {
+        "_id": f"model_{i}",
+        "entryId": f"model_{i}",
+        "experimentalMethod": "THEORETICAL MODEL",
+        "mappingAccession": "P38398",
+        "mappingAccessionType": "uniprot",
+        "start": 1,
+        # one document in ten breaks the schema
+        "end": "103" if i % 10 == 0 else 103,
+        "modelCategory": "TEMPLATE-BASED",
+        "modelType": "single",
+        "mappingId": "BRCA1_HUMAN",
+        "mappingDescription": "Breast cancer type 1 susceptibility protein",
+        "confidenceType": "pLDDT",
+        "confidenceAvgLocalScore": 84.5,
+        "gene": "BRCA1",
+        "organismScientificName": "Homo sapiens",
+        "taxId": 9606,
+        "createdDate": "2023-03-01",
+        "sequenceIdentity": 1.0,
+        "coverage": 0.05,
+    }
+
+
+def legacy(documents) -> int:
+    """The validation of a document before the validator was compiled"""
+    schema = ValidateJSON.get_schema()
+    valid = 0
+    for document in documents:
+        try:
+            jsonschema.validate(document, schema=schema)
+            valid += 1
+        except jsonschema.ValidationError:
+            pass
+
+    return valid
+
+
+def compiled(documents) -> int:
+    report = ValidationReport()
+    for i, document in enumerate(documents):
+        ValidateJSON.validate_document(document, str(i), report)
+
+    return report.valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=2000, help="Documents")
+    args = parser.parse_args()
+
+    # invalid documents are logged as errors
+    logging.disable(logging.CRITICAL)
+    documents = [make_document(i) for i in range(args.documents)]
+
+    results = {}
+    for name, func in (("legacy", legacy), ("compiled", compiled)):
+        start = time.perf_counter()
+        results[name] = func(documents)
+        seconds = time.perf_counter() - start
+        print(f"{name:>8}: {seconds:8.3f} s, {len(documents) / seconds:10.0f} docs/s")
+
+    if results["legacy"] != results["compiled"]:
+        raise RuntimeError("The validators found different valid documents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Compares the PDB to CIF stage of the workflow run with one CLI process per
+model, as the former Snakefile did, against one CLI process per chunk of
+models reading a file list, as it does now.
+
+--models synthetic models are written. The chunked stage is run in full, the
+per-model one on --sample models and extrapolated, as it would take hours.
+The number of jobs of both workflows is reported too: three per model before,
+two per chunk and a final load now.
+
+Usage:
+    python benchmarks/bench_workflow.py --models 100000 --chunk-size 1000
+"""
+
+import argparse
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ATOM = (
+    "ATOM  {0:5d}  CA  ALA A{0:4d}    {1:8.3f}   0.000   0.000  1.00 90.00"
+    "           C\n"
+)
+# the CLI reads its settings from the environment
+ENVIRONMENT = {
+    "MONGO_USERNAME": "bench",
+    "MONGO_PASSWORD": "bench",
+    "MONGO_DB_HOST": "localhost:27017",
+    "ASSETS_URL": "localhost/static",
+    "PROVIDER": "bench",
+}
+CLI = [sys.executable, "-m", "bio3dbeacons.cli"]
+
+
+def make_models(pdb_dir: Path, models: int, residues: int):
+    model = "".join(ATOM.format(i, 3.8 * i) for i in range(1, residues + 1)) + "END\n"
+    for i in range(models):
+        (pdb_dir / f"model_{i:06d}.pdb").write_text(model)
+
+
+def cli(*args: str, env: dict):
+    subprocess.run(CLI + list(args), env=env, check=True, capture_output=True)
+
+
+def per_model(pdb_dir: Path, cif_dir: Path, names, env: dict) -> float:
+    start = time.perf_counter()
+    for name in names:
+        cli(
+            "convert-pdb2cif",
+            "-i",
+            (pdb_dir / name).as_posix(),
+            "-o",
+            (cif_dir / name.replace(".pdb", ".cif")).as_posix(),
+            env=env,
+        )
+
+    return time.perf_counter() - start
+
+
+def chunked(
+    pdb_dir: Path, cif_dir: Path, work_dir: Path, names, chunk_size: int, env: dict
+) -> float:
+    start = time.perf_counter()
+    for number in range(math.ceil(len(names) / chunk_size)):
+        file_list = work_dir / f"chunk-{number:05d}.pdb.txt"
+        chunk = names[number * chunk_size : (number + 1) * chunk_size]
+        file_list.write_text("".join(f"{x}\n" for x in chunk))
+        cli(
+            "convert-pdb2cif",
+            "-i",
+            pdb_dir.as_posix(),
+            "-o",
+            cif_dir.as_posix(),
+            "--file-list",
+            file_list.as_posix(),
+            "--manifest",
+            (work_dir / f"chunk-{number:05d}.sqlite").as_posix(),
+            "--jobs",
+            "1",
+            env=env,
+        )
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--models", type=int, default=100000, help="Number of models")
+    parser.add_argument("--residues", type=int, default=50, help="Residues per model")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Models per chunk")
+    parser.add_argument(
+        "--sample", type=int, default=20, help="Models converted one process each"
+    )
+    args = parser.parse_args()
+
+    env = {**ENVIRONMENT, **os.environ}
+    env["PYTHONPATH"] = Path(__file__).parent.parent.as_posix()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        for name in ("pdb", "cif-model", "cif-chunk", "work"):
+            (temp_dir / name).mkdir()
+        make_models(temp_dir / "pdb", args.models, args.residues)
+        names = sorted(os.listdir(temp_dir / "pdb"))
+
+        sample = names[: args.sample]
+        seconds = per_model(temp_dir / "pdb", temp_dir / "cif-model", sample, env)
+        per_model_seconds = seconds / len(sample) * len(names)
+
+        chunked_seconds = chunked(
+            temp_dir / "pdb",
+            temp_dir / "cif-chunk",
+            temp_dir / "work",
+            names,
+            args.chunk_size,
+            env,
+        )
+        # a second run only checks the per-chunk manifests
+        rerun_seconds = chunked(
+            temp_dir / "pdb",
+            temp_dir / "cif-chunk",
+            temp_dir / "work",
+            names,
+            args.chunk_size,
+            env,
+        )
+
+    chunks = math.ceil(len(names) / args.chunk_size)
+    print(f"models: {len(names)}, chunks of {args.chunk_size}: {chunks}")
+    print(f"workflow jobs: per model {3 * len(names)}, chunked {2 * chunks + 2}")
+    print(f"pdb2cif per model: {per_model_seconds:10.1f} s (extrapolated)")
+    print(f"pdb2cif chunked:   {chunked_seconds:10.1f} s")
+    print(f"pdb2cif rerun:     {rerun_seconds:10.1f} s")
+
+
+if __name__ == "__main__":
+    main()
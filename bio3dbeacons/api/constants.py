@@ -2,6 +2,10 @@
 UNIPROT_AC_DESC = "UniProt accession, e.g. P00520"
 UNIPROT_NAME_DESC = "UniProt identifier, e.g. ABL1_MOUSE"
 UNIPROT_RANGE_DESC = "Specify a UniProt sequence residue range; separated by hyphen(-)."
+UNIPROT_SORT_DESC = (
+    "Order of the models: coverage (highest first) or created (newest first)."
+)
+UNIPROT_LIMIT_DESC = "Maximum number of models to return."
 UNIPROT_RESIDUE_START_DESC = "UniProt starting residue number"
 UNIPROT_RESIDUE_END_DESC = "UniProt ending residue number"
 UNIPROT_LENGTH_DESC = "Length of the UniProt sequence, e.g. 100"
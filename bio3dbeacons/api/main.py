@@ -1,5 +1,6 @@
 import os
-from typing import Any, Dict, List
+import re
+from typing import Any, Dict, List, Optional
 
 from fastapi import FastAPI, HTTPException
 from fastapi.params import Path, Query
@@ -7,9 +8,15 @@ from starlette import status
 from starlette.responses import HTMLResponse, JSONResponse
 
 from bio3dbeacons.api import SingletonMongoDB
-from bio3dbeacons.api.constants import UNIPROT_QUAL_DESC, UNIPROT_RANGE_DESC
+from bio3dbeacons.api.constants import (
+    UNIPROT_LIMIT_DESC,
+    UNIPROT_QUAL_DESC,
+    UNIPROT_RANGE_DESC,
+    UNIPROT_SORT_DESC,
+)
 from bio3dbeacons.api.models.uniprot_model import UniprotSummary, UniprotEntry, SummaryItems, Entity, Overview
 from bio3dbeacons.api.utils import get_model_asset_url
+from bio3dbeacons.mongo.queries import SORTS, get_uniprot_summary_query
 
 app = FastAPI(version="2.0.0")
 
@@ -25,12 +32,16 @@ app = FastAPI(version="2.0.0")
 async def get_uniprot_summary_api(
     qualifier: Any = Path(..., description=UNIPROT_QUAL_DESC),
     res_range: Any = Query(None, alias="range", description=UNIPROT_RANGE_DESC),
+    sort: Optional[str] = Query(None, description=UNIPROT_SORT_DESC),
+    limit: Optional[int] = Query(None, ge=1, description=UNIPROT_LIMIT_DESC),
 ):
     f"""Returns summary details details for a UniProt accession
 
     Args:
         qualifier (Any): {UNIPROT_QUAL_DESC}
         range (Any, optional): {UNIPROT_RANGE_DESC} Defaults to None.
+        sort (str, optional): {UNIPROT_SORT_DESC} Defaults to None.
+        limit (int, optional): {UNIPROT_LIMIT_DESC} Defaults to None.
 
     Raises:
         HTTPException: Raised when there are validation issues with parameters
@@ -51,27 +62,39 @@ async def get_uniprot_summary_api(
                 " end separated by -",
             )
         if res_range is not None:
-            [residue_start, residue_end] = res_range.split("-")
-
-            if not (residue_start.isnumeric() and residue_end.isnumeric()):
+            # anything after a second - is not a number either, e.g. 1-2-3
+            [residue_start, residue_end] = res_range.split("-", 1)
+
+            # ASCII digits only, int() fails on other numeric characters, e.g. "²"
+            if not (
+                re.fullmatch(r"\d+", residue_start, re.ASCII)
+                and re.fullmatch(r"\d+", residue_end, re.ASCII)
+            ):
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="residue ranges should be numbers",
                 )
+            residue_start, residue_end = int(residue_start), int(residue_end)
+            if residue_start > residue_end:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="residue start should not be greater than residue end",
+                )
+
+    if sort and sort not in SORTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"sort parameter should be one of {', '.join(SORTS)}",
+        )
 
     models_db = SingletonMongoDB.get_models_db()
     model_collection = models_db.modelCollection
 
+    # only the models overlapping the range are read, in the requested order
     results = model_collection.find(
-        {
-            "$or": [
-                {"mappingAccession": {"$eq": qualifier}},
-                {"mappingId": {"$eq": qualifier}},
-            ],
-            "$and": [
-                {"mappingAccessionType": {"$eq": "uniprot"}},
-            ],
-        }
+        **get_uniprot_summary_query(
+            qualifier, residue_start, residue_end, sort=sort, limit=limit
+        )
     )
 
     overview_items: List[Overview]  = []
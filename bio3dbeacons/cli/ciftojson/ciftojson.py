@@ -1,23 +1,45 @@
 import json
 import logging
-import multiprocessing
 import os
-from concurrent.futures import ProcessPoolExecutor
-from typing import Dict
-
-from fastapi.encoders import jsonable_encoder
-
+from typing import Dict, List, Optional, Set
+
+from bio3dbeacons.cli import fileio, layout
+from bio3dbeacons.cli.confidence import (
+    get_cif_b_factor_confidence,
+    get_cif_qa_confidence,
+    read_cif_confidence,
+    read_cif_qa_confidence,
+)
+from bio3dbeacons.cli.jsonl import (
+    ShardWriter,
+    compact_shards,
+    dumps_document,
+    to_jsonable,
+)
+from bio3dbeacons.cli.manifest import Manifest, find_orphans, report_orphans
 from bio3dbeacons.cli.models import ModelEntry
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.uniprot import get_uniprot_info
 from bio3dbeacons.cli.utils import (
-    get_uniprot_xml,
+    get_index_cif_categories,
     prepare_data_dictionary,
     prepare_data_dictionary_from_json,
     prepare_data_dictionary_from_cif,
+    read_cif_categories,
+)
+from bio3dbeacons.cli.validatejson.validatejson import (
+    Rejected,
+    RejectWriter,
+    ValidateJSON,
 )
 from gemmi import cif
 
 LOG = logging.getLogger(__name__)
 
+MANIFEST_STAGE = "cif2index"
+# the confidence type whose scores are stored in the B-factor column
+PLDDT = "plddt"
+
 
 class Cif2Json:
     cif_path: str
@@ -25,30 +47,55 @@ class Cif2Json:
     entry: ModelEntry
 
     def __init__(
-        self, cif_path: str, metadata_json_path: str, output_index_json_path: str
+        self,
+        cif_path: str,
+        metadata_json_path: str,
+        output_index_json_path: str,
+        full_cif: bool = False,
     ) -> None:
         self.cif_path = cif_path
         self.metadata_json_path = metadata_json_path
         self.output_index_json_path = output_index_json_path
+        self.full_cif = full_cif
         self.entry: ModelEntry
         self.interim_entry: Dict = {}
+        self.block = None
+        # the block only holds the index categories, see read_cif()
+        self.header_only = False
 
     def read_cif(self):
-        """Reads the mmcif file and populates them in entry"""
+        """Reads the mmcif file and populates them in entry
+
+        Only the categories needed for the index are parsed, unless full_cif
+        is set, the coordinates are skipped.
+        """
         LOG.info(f"Reading {self.cif_path}")
         try:
-            # copy all the data from mmCIF file
-            doc = cif.read_file(self.cif_path)
-            block = doc.sole_block()  # mmCIF has exactly one block
-
-            # run the mapping from CIF
-            entry = prepare_data_dictionary_from_cif(block)
-            self.interim_entry.update(entry)
+            self.header_only = not self.full_cif
+            if self.header_only:
+                doc = cif.read_string(
+                    read_cif_categories(self.cif_path, get_index_cif_categories())
+                )
+            # copy all the data from mmCIF file, gemmi reads gzipped files
+            elif fileio.get_compression(self.cif_path) == fileio.ZSTD:
+                doc = cif.read_string(fileio.read_text(self.cif_path))
+            else:
+                doc = cif.read_file(self.cif_path)
+            self.read_cif_document(doc)
 
         except Exception as e:
             LOG.error("Error in parsing the cif file!", e)
             LOG.debug(e)
 
+    def read_cif_document(self, doc):
+        """Populates entry from an mmCIF document already in memory"""
+        block = doc.sole_block()  # mmCIF has exactly one block
+        self.block = block
+
+        # run the mapping from CIF
+        entry = prepare_data_dictionary_from_cif(block)
+        self.interim_entry.update(entry)
+
     def read_json(self):
         """Reads the json file and populates them in entry"""
         LOG.info(f"Reading {self.metadata_json_path}")
@@ -58,50 +105,55 @@ class Cif2Json:
 
         self.interim_entry.update(entry)
 
+    def add_confidence(self):
+        """Computes the average confidence score from the model if the
+        metadata does not provide it
+
+        The local QA metric of ModelCIF files is used whatever the confidence
+        type. The B-factors are only used for pLDDT models, where they hold
+        the pLDDT. For other models, e.g. experimental structures or
+        QMEANDisCo scores, the score is left unset and validation reports it.
+        """
+        if self.interim_entry.get("confidenceAvgLocalScore") is not None:
+            return
+
+        # the block read without the coordinates has none of the confidence
+        # categories, the QA metric is read without parsing the atoms
+        from_file = self.header_only or self.block is None
+        if from_file:
+            confidence = read_cif_qa_confidence(self.cif_path)
+        else:
+            confidence = get_cif_qa_confidence(self.block)
+
+        if confidence.average is None:
+            confidence_type = self.interim_entry.get("confidenceType") or ""
+            if confidence_type.lower() != PLDDT:
+                LOG.warning(
+                    f"No confidence score in the metadata of {self.cif_path}, "
+                    f"not derived from the B-factors of a {confidence_type or 'no'} "
+                    "confidence type"
+                )
+                return
+            if from_file:
+                confidence = read_cif_confidence(self.cif_path)
+            else:
+                confidence = get_cif_b_factor_confidence(self.block)
+
+        if confidence.average is None:
+            LOG.warning(f"No confidence scores in {self.cif_path}")
+            return
+
+        LOG.info(f"Confidence bands of {self.cif_path}: {confidence.bands()}")
+        self.interim_entry["confidenceAvgLocalScore"] = round(confidence.average, 2)
+
     def add_extra_uniprot_info(self):
-        """Adds extra info from UniProt XML"""
-
-        entry = {}
-        # parse UniProt xml
-        xml_root = get_uniprot_xml(self.interim_entry["mappingAccession"])
-
-        LOG.info(
-            f"Parsing XML for {self.interim_entry['mappingAccession']}")
-        if xml_root:
-            namespace = "{http://uniprot.org/uniprot}"
-            # fetch accession related data
-            ac_id = xml_root.find(f"./{namespace}entry/{namespace}name").text
-            try:
-                description = xml_root.find(
-                    f"./{namespace}entry/{namespace}protein/{namespace}recommendedName"
-                    f"/{namespace}fullName"
-                ).text
-            except:
-                description = xml_root.find(
-                    f"./{namespace}entry/{namespace}protein/{namespace}submittedName"
-                    f"/{namespace}fullName"
-                ).text
-
-            # fetch gene related data
-            gene = xml_root.find(
-                f"./{namespace}entry/{namespace}gene/{namespace}name"
-            ).text
-
-            # fetch organism related data
-            scientific_name = xml_root.find(
-                f"./{namespace}entry/{namespace}organism/{namespace}name"
-            ).text
-            tax_id = xml_root.find(
-                f"./{namespace}entry/{namespace}organism/{namespace}dbReference"
-            ).attrib.get("id")
-
-            entry["mappingId"] = ac_id
-            entry["mappingDescription"] = description
-            entry["gene"] = gene
-            entry["organismScientificName"] = scientific_name
-            entry["taxId"] = int(tax_id)
+        """Adds extra info from UniProt, served from the UniProt cache"""
+        accession = self.interim_entry["mappingAccession"]
+        entry = get_uniprot_info(accession)
 
-        self.interim_entry.update(entry)
+        LOG.info(f"Adding UniProt info for {accession}")
+        if entry:
+            self.interim_entry.update(entry)
 
     def transform(self):
         """Performs transformation on the fields"""
@@ -116,10 +168,25 @@ class Cif2Json:
         # add unique ID
         self.interim_entry["_id"] = self.interim_entry["entryId"]
 
+    def build(self):
+        """Merges the metadata and UniProt info into the CIF data and sets entry
+
+        read_cif() or read_cif_document() must be called first.
+        """
+        self.read_json()
+        self.add_confidence()
+
+        # add extra uniprot info for uniprot accessions
+        if self.interim_entry.get("mappingAccessionType") == "uniprot":
+            self.add_extra_uniprot_info()
+
+        self.transform()
+        self.entry = to_jsonable(self.interim_entry)
+
     def write(self):
         """Writes the data in entry to the output json"""
         try:
-            with open(self.output_index_json_path, "w+") as f:
+            with fileio.open_file(self.output_index_json_path, "wt") as f:
                 json.dump(self.entry, f)
         except Exception as e:
             LOG.error("Error in writing to output JSON file! (err:%s)", e)
@@ -131,32 +198,110 @@ class Cif2Json:
         return 0
 
 
-def process(cif_path: str, metadata_json_path: str, output_index_json_path: str):
+def process(
+    cif_path: str,
+    metadata_json_path: str,
+    output_index_json_path: str,
+    full_cif: bool = False,
+    validate: bool = False,
+):
+    """Writes the index JSON of a model
+
+    Returns:
+        Union[int, Rejected]: 0 if the file was written, 1 otherwise, the
+            rejected document if validate is set and it is not valid
+    """
     cif2json = Cif2Json(
         cif_path=cif_path,
         metadata_json_path=metadata_json_path,
         output_index_json_path=output_index_json_path,
+        full_cif=full_cif,
     )
     cif2json.read_cif()
-    cif2json.read_json()
-
-    # add extra uniprot info for uniprot accessions
-    if cif2json.interim_entry.get("mappingAccessionType") == "uniprot":
-        cif2json.add_extra_uniprot_info()
-
-    cif2json.transform()
-    cif2json.entry = jsonable_encoder(cif2json.interim_entry)
-    cif2json.write()
-
-
-def run(cif_path: str, metadata_json_path: str, output_index_json_path: str):
+    cif2json.build()
+    if validate:
+        rejected = ValidateJSON.reject(cif2json.entry, cif_path)
+        if rejected:
+            return rejected
+
+    layout.ensure_parent(output_index_json_path)
+    return cif2json.write()
+
+
+def process_document(
+    cif_path: str,
+    metadata_json_path: str,
+    full_cif: bool = False,
+    validate: bool = False,
+):
+    """Returns the _id and the index document of a model as a line of JSON,
+    the rejected document if validate is set and it is not valid"""
+    cif2json = Cif2Json(
+        cif_path=cif_path,
+        metadata_json_path=metadata_json_path,
+        output_index_json_path=None,
+        full_cif=full_cif,
+    )
+    cif2json.read_cif()
+    cif2json.build()
+    if validate:
+        rejected = ValidateJSON.reject(cif2json.entry, cif_path)
+        if rejected:
+            return rejected
+
+    return cif2json.entry["_id"], dumps_document(cif2json.entry)
+
+
+def run(
+    cif_path: str,
+    metadata_json_path: str,
+    output_index_json_path: str,
+    scheduler: Optional[Scheduler] = None,
+    manifest_path: Optional[str] = None,
+    shard_depth: Optional[int] = None,
+    file_list: Optional[str] = None,
+    full_cif: bool = False,
+    jsonl_records: Optional[int] = None,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    validate: bool = False,
+    reject_path: Optional[str] = None,
+):
     """Generates JSON from mmcif file
 
     Args:
         cif_path (str): Path to the cif file, if a directory is passed,
-            process all .cif files inside it
+            process all .cif files inside it and its subdirectories
+        metadata_json_path (str): Path to the metadata json file, a directory if
+            cif_path is a directory. The metadata of a model is looked up at the
+            same relative path as its CIF file, then in the top directory.
         output_index_json_path (str): Path to output json file,
             if cif_path is a directory, this must be a directory too.
+        scheduler (Scheduler, optional): Runs the conversions in directory mode,
+            defaults to one worker per available CPU.
+        manifest_path (str, optional): Build manifest, models whose CIF and
+            metadata JSON have not changed since their index JSON was built
+            are skipped.
+        shard_depth (int, optional): Write the index JSON files into this many
+            levels of hash shard directories, by default the layout of cif_path
+            is mirrored.
+        file_list (str, optional): File listing the CIF files to convert
+            instead of walking cif_path, "-" for stdin.
+        full_cif (bool): Parse the whole CIF files, by default only the
+            categories needed for the index are parsed.
+        jsonl_records (int, optional): Write the index documents to JSON Lines
+            shards of this many records in output_index_json_path, instead of
+            one JSON file per model. Directory mode only.
+        compression (str, optional): Compression of the JSON Lines shards,
+            "gzip" or "zstd"
+        compression_level (int, optional): Compression level of the shards
+        validate (bool): Validate the index documents against the schema before
+            writing them, invalid documents are not written.
+        reject_path (str, optional): Write the invalid documents, with the
+            reason, to this JSON Lines file
+
+    Returns:
+        int: 0 if all the files were converted, 1 otherwise
     """
 
     # if a directory is provided, convert all .cif files in it
@@ -174,42 +319,225 @@ def run(cif_path: str, metadata_json_path: str, output_index_json_path: str):
         os.makedirs(output_index_json_path, exist_ok=True)
         LOG.info(f"Created directory {output_index_json_path}")
 
-        with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count() + 1) as p:
-            for _, _, filenames in os.walk(cif_path):
-                for cif_file in list(filter(lambda x: x.endswith(".cif"), filenames)):
-                    index_json_file = cif_file.replace(".cif", ".json")
-                    cif_file_path = f"{cif_path}/{cif_file}"
-                    output_index_json_file_path = (
-                        f"{output_index_json_path}/{index_json_file}"
-                    )
-                    metadata_json_file_path = f"{metadata_json_path}/{index_json_file}"
-                    p.submit(
-                        process,
-                        cif_file_path,
-                        metadata_json_file_path,
-                        output_index_json_file_path,
-                    )
+        # report models which can not be converted before starting any work,
+        # a file list is not rescanned, missing metadata is reported at the end
+        if not file_list:
+            report_orphans(
+                *find_orphans(
+                    (
+                        layout.model_id_from_path(x, ".cif")
+                        for x in layout.iter_files(cif_path, ".cif")
+                    ),
+                    (
+                        layout.model_id_from_path(x, ".json")
+                        for x in layout.iter_files(metadata_json_path, ".json")
+                    ),
+                )
+            )
+        missing_metadata: List[str] = []
+
+        manifest = Manifest(manifest_path) if manifest_path else None
+        if jsonl_records:
+            return run_jsonl(
+                cif_path,
+                metadata_json_path,
+                output_index_json_path,
+                jsonl_records,
+                scheduler=scheduler,
+                manifest=manifest,
+                file_list=file_list,
+                full_cif=full_cif,
+                compression=compression,
+                compression_level=compression_level,
+                validate=validate,
+                reject_path=reject_path,
+            )
+
+        def tasks():
+            for cif_file_path in layout.iter_files(cif_path, ".cif", file_list):
+                key = layout.relative_key(cif_path, cif_file_path, ".cif")
+                metadata_json_file_path = layout.companion_path(
+                    metadata_json_path, key, ".json"
+                )
+                if metadata_json_file_path is None:
+                    if file_list:
+                        missing_metadata.append(os.path.basename(key))
+                    continue
+                output_index_json_file_path = layout.output_path(
+                    output_index_json_path, key, ".json", shard_depth
+                )
+                if manifest and manifest.is_up_to_date(
+                    MANIFEST_STAGE,
+                    output_index_json_file_path,
+                    [cif_file_path, metadata_json_file_path],
+                ):
+                    continue
+                yield (
+                    cif_file_path,
+                    metadata_json_file_path,
+                    output_index_json_file_path,
+                    full_cif,
+                    validate,
+                )
+
+        rejects = RejectWriter(reject_path)
+
+        def on_result(task, result):
+            if isinstance(result, Rejected):
+                rejects.write(result)
+            elif manifest:
+                manifest.record(MANIFEST_STAGE, task[2])
+
+        try:
+            with rejects:
+                summary = (scheduler or Scheduler()).run(process, tasks(), on_result)
+        finally:
+            if manifest:
+                manifest.close()
+
+        if file_list:
+            report_orphans(missing_metadata, [])
+
+        return summary.exit_status or int(rejects.rejected > 0)
 
     else:
         if not os.path.isfile(cif_path):
             LOG.error("CIF file not found!")
             return 1
+        if jsonl_records:
+            LOG.error("JSON Lines output requires a directory of CIF files")
+            return 1
+
+        manifest = Manifest(manifest_path) if manifest_path else None
+        if manifest and manifest.is_up_to_date(
+            MANIFEST_STAGE, output_index_json_path, [cif_path, metadata_json_path]
+        ):
+            manifest.close()
+            return 0
 
         cif2json = Cif2Json(
             cif_path=cif_path,
             metadata_json_path=metadata_json_path,
             output_index_json_path=output_index_json_path,
+            full_cif=full_cif,
         )
 
         cif2json.read_cif()
-        cif2json.read_json()
+        cif2json.build()
+        rejected = validate and ValidateJSON.reject(cif2json.entry, cif_path)
+        if rejected:
+            with RejectWriter(reject_path) as rejects:
+                rejects.write(rejected)
+            status = 1
+        else:
+            status = cif2json.write()
+
+        if manifest:
+            if status == 0:
+                manifest.record(MANIFEST_STAGE, output_index_json_path)
+            manifest.close()
+
+        return status
+
+
+def run_jsonl(
+    cif_path: str,
+    metadata_json_path: str,
+    output_dir: str,
+    records_per_shard: int,
+    scheduler: Optional[Scheduler] = None,
+    manifest: Optional[Manifest] = None,
+    file_list: Optional[str] = None,
+    full_cif: bool = False,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    validate: bool = False,
+    reject_path: Optional[str] = None,
+) -> int:
+    """Generates the index documents of a directory of CIF files into JSON
+    Lines shards
+
+    The workers send the documents back as JSON, this process appends them to
+    the shards. Models are recorded in the manifest once their shard is
+    complete, so an interrupted run only adds the missing models to new shards.
+    Invalid documents, if validate is set, go to the reject file instead.
+
+    When shards of former runs exist, the former documents of the models
+    written again are removed from them (see compact_shards), and the models
+    are only recorded once that is done. An interrupted rerun therefore
+    rebuilds its models, and never leaves two documents of a model behind.
+
+    Returns:
+        int: 0 if all the files were converted, 1 otherwise
+    """
+    missing_metadata: List[str] = []
 
-        # add extra uniprot info for uniprot accessions
-        if cif2json.interim_entry.get("mappingAccessionType") == "uniprot":
-            cif2json.add_extra_uniprot_info()
+    def manifest_key(key: str) -> str:
+        return f"jsonl:{os.path.abspath(output_dir)}:{key}"
+
+    def tasks():
+        for cif_file_path in layout.iter_files(cif_path, ".cif", file_list):
+            key = layout.relative_key(cif_path, cif_file_path, ".cif")
+            metadata_json_file_path = layout.companion_path(
+                metadata_json_path, key, ".json"
+            )
+            if metadata_json_file_path is None:
+                if file_list:
+                    missing_metadata.append(os.path.basename(key))
+                continue
+            if manifest and manifest.is_up_to_date(
+                MANIFEST_STAGE,
+                manifest_key(key),
+                [cif_file_path, metadata_json_file_path],
+                output_is_file=False,
+            ):
+                continue
+            yield cif_file_path, metadata_json_file_path, full_cif, validate
+
+    written_ids: Set[str] = set()
+    pending: List[str] = []
+
+    def record(keys):
+        if manifest:
+            for key in keys:
+                manifest.record(MANIFEST_STAGE, key, output_is_file=False)
+
+    def on_shard(path, keys):
+        if writer.first_number:
+            pending.extend(keys)
+        else:
+            record(keys)
+
+    writer = ShardWriter(
+        output_dir, records_per_shard, compression, compression_level, on_shard
+    )
+
+    rejects = RejectWriter(reject_path)
+
+    def on_result(task, result):
+        if isinstance(result, Rejected):
+            rejects.write(result)
+            return
+
+        doc_id, line = result
+        key = layout.relative_key(cif_path, task[0], ".cif")
+        writer.write_line(line, manifest_key(key))
+        if writer.first_number:
+            written_ids.add(doc_id)
+
+    try:
+        with writer, rejects:
+            summary = (scheduler or Scheduler()).run(
+                process_document, tasks(), on_result
+            )
+        if written_ids:
+            compact_shards(output_dir, written_ids, writer.first_number)
+        record(pending)
+    finally:
+        if manifest:
+            manifest.close()
 
-        cif2json.transform()
-        cif2json.entry = jsonable_encoder(cif2json.interim_entry)
-        cif2json.write()
+    if file_list:
+        report_orphans(missing_metadata, [])
 
-    return 0
+    return summary.exit_status or int(rejects.rejected > 0)
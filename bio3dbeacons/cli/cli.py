@@ -1,3 +1,5 @@
+import sys
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
 from urllib.parse import quote
 
 import click
@@ -5,10 +7,13 @@ from exitstatus import ExitStatus
 from prettyconf import config
 from prettyconf.loaders import EnvFile, Environment
 
-from bio3dbeacons.cli.ciftojson import ciftojson
-from bio3dbeacons.cli.mongoload import mongoload
-from bio3dbeacons.cli.pdbtocif import pdbtocif
-from bio3dbeacons.cli.validatejson import validatejson
+from bio3dbeacons.cli import constants, fileio
+from bio3dbeacons.cli.constants import DEFAULT_CHUNK_SIZE, ModelCategory
+
+# the modules running the commands, and their dependencies (gemmi, pymongo,
+# numpy, jsonschema, HTTP clients), are imported by the commands using them
+if TYPE_CHECKING:  # pragma: no cover
+    from bio3dbeacons.cli.scheduler import Scheduler
 
 config.loaders = [
     Environment(var_format=str.upper),
@@ -33,6 +38,227 @@ class Config:
         )
 
 
+def scheduler_options(func):
+    """Adds the options controlling parallel processing in directory mode"""
+    func = click.option(
+        "--timeout",
+        help="Seconds after which processing a single file is aborted, default "
+        "no timeout",
+        required=False,
+        default=None,
+        type=float,
+    )(func)
+    func = click.option(
+        "--chunk-size",
+        help=f"Number of files sent to a worker at once, default {DEFAULT_CHUNK_SIZE}",
+        required=False,
+        default=DEFAULT_CHUNK_SIZE,
+        type=int,
+    )(func)
+    func = click.option(
+        "-j",
+        "--jobs",
+        help="Number of worker processes in directory mode, defaults to the number "
+        "of CPUs available to the process (honours cgroup limits)",
+        required=False,
+        default=None,
+        type=int,
+    )(func)
+    return func
+
+
+def compression_options(func):
+    """Adds the options controlling the compression of CIF output files"""
+    func = click.option(
+        "--compression-level",
+        help="Compression level of the CIF files, default 6 for gzip and 3 for zstd",
+        type=int,
+        default=None,
+        required=False,
+    )(func)
+    func = click.option(
+        "--compress",
+        help="Write compressed CIF files (.cif.gz or .cif.zst) in directory mode. For "
+        "a single file, the compression follows the extension of the output path.",
+        type=click.Choice(fileio.COMPRESSIONS),
+        default=None,
+        required=False,
+    )(func)
+    return func
+
+
+def jsonl_options(func):
+    """Adds the options controlling the JSON Lines output of index documents"""
+    func = click.option(
+        "--compression-level",
+        help="Compression level of the shards, default 6 for gzip and 3 for zstd",
+        type=int,
+        default=None,
+        required=False,
+    )(func)
+    func = click.option(
+        "--compress",
+        help="Write compressed shards (.jsonl.gz or .jsonl.zst)",
+        type=click.Choice(fileio.COMPRESSIONS),
+        default=None,
+        required=False,
+    )(func)
+    func = click.option(
+        "--jsonl-records",
+        help="Write the index documents to JSON Lines shards of this many records "
+        "(index-000000.jsonl, ...) in the output directory instead of one JSON "
+        "file per model. Directory mode only.",
+        type=click.IntRange(min=1),
+        default=None,
+        required=False,
+    )(func)
+    return func
+
+
+def mongo_write_options(func):
+    """Adds the options controlling the writes of index documents to Mongo"""
+    func = click.option(
+        "--skip-unchanged/--no-skip-unchanged",
+        help="Only write the documents which are new or whose content changed "
+        "since they were loaded, compared by fingerprint. Default on",
+        default=True,
+    )(func)
+    func = click.option(
+        "--writers",
+        help="Number of batches written to Mongo DB concurrently, default "
+        f"{constants.DEFAULT_WRITERS}",
+        required=False,
+        default=constants.DEFAULT_WRITERS,
+        type=click.IntRange(min=1),
+    )(func)
+    return func
+
+
+def manifest_option(func):
+    return click.option(
+        "--manifest",
+        help="Path to a build manifest (SQLite), e.g. data/manifest.sqlite. Files "
+        "whose inputs have not changed since the last run are skipped.",
+        required=False,
+        default=None,
+    )(func)
+
+
+def reject_file_option(func):
+    return click.option(
+        "--reject-file",
+        help="Write the documents failing validation, with the reason, to this "
+        "JSON Lines file, e.g. data/rejected.jsonl. Keep it out of the index "
+        "directory.",
+        required=False,
+        default=None,
+    )(func)
+
+
+def file_list_option(func):
+    return click.option(
+        "--file-list",
+        help="File listing the input files, one path per line (absolute or relative "
+        "to the input directory), '-' reads the list from stdin. Used instead of "
+        "scanning the input directory.",
+        required=False,
+        default=None,
+    )(func)
+
+
+def shard_depth_option(func):
+    return click.option(
+        "--shard-depth",
+        help="Write outputs into this many levels of hash shard directories, e.g. "
+        "2 for ab/cd/<model>.cif. By default the input directory layout is "
+        "mirrored.",
+        required=False,
+        default=None,
+        type=click.IntRange(0, 8),
+    )(func)
+
+
+def uniprot_cache_options(func):
+    """Adds the options controlling the UniProt cache"""
+    func = click.option(
+        "--uniprot-index",
+        help="Path to a UniProt index built with build-uniprot-index. Accessions "
+        "are resolved against it instead of UniProt, e.g. on nodes without "
+        "internet access.",
+        required=False,
+        default=None,
+        type=click.Path(exists=True, dir_okay=False),
+    )(func)
+    func = click.option(
+        "--prefetch-uniprot/--no-prefetch-uniprot",
+        help="Fetch the UniProt entries of all the accessions in the metadata "
+        "directory concurrently before starting the workers, default on",
+        default=True,
+    )(func)
+    func = click.option(
+        "--uniprot-refresh",
+        help="Revalidate all the entries of the UniProt cache with UniProt",
+        is_flag=True,
+        default=False,
+    )(func)
+    func = click.option(
+        "--uniprot-cache-ttl",
+        help="Days after which cached UniProt entries are revalidated, default "
+        "UNIPROT_CACHE_TTL_DAYS in conf.ini",
+        required=False,
+        default=None,
+        type=float,
+    )(func)
+    func = click.option(
+        "--uniprot-cache",
+        help="Path to a UniProt cache (SQLite), e.g. data/uniprot.sqlite, shared "
+        "by the workers and kept across runs. By default UniProt entries are "
+        "cached in memory by every worker.",
+        required=False,
+        default=None,
+    )(func)
+    return func
+
+
+def setup_uniprot_cache(
+    uniprot_cache: Optional[str],
+    uniprot_cache_ttl: Optional[float],
+    refresh: bool,
+    prefetch_from: Optional[str] = None,
+    uniprot_index: Optional[str] = None,
+) -> Tuple:
+    """Configures the UniProt cache of this process
+
+    Returns:
+        Tuple: Arguments to configure the cache of the workers
+    """
+    from bio3dbeacons.cli import uniprot
+
+    ttl = uniprot_cache_ttl * 24 * 3600 if uniprot_cache_ttl is not None else None
+
+    return uniprot.prepare_cache(
+        uniprot_cache, ttl, refresh, prefetch_from, uniprot_index
+    )
+
+
+def get_scheduler(
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    initializer: Optional[Callable] = None,
+    initargs: Tuple = (),
+) -> "Scheduler":
+    from bio3dbeacons.cli.scheduler import Scheduler
+
+    return Scheduler(
+        jobs=jobs,
+        chunk_size=chunk_size,
+        timeout=timeout,
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
 @click.group("CLI", help="CLI application for 3D Beacons utilities")
 def main() -> ExitStatus:  # pragma: no cover
     """The main CLI application
@@ -65,13 +291,76 @@ def main() -> ExitStatus:  # pragma: no cover
     "directory.",
     required=True,
 )
+@click.option(
+    "--full-cif",
+    help="Parse the whole CIF files. By default only the categories needed for "
+    "the index are parsed and the coordinates are skipped.",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--validate/--no-validate",
+    help="Validate the index documents against the schema before writing them, "
+    "invalid documents are not written. Default off.",
+    default=False,
+)
+@reject_file_option
+@jsonl_options
+@scheduler_options
+@manifest_option
+@shard_depth_option
+@file_list_option
+@uniprot_cache_options
 def cif_to_json(
-    input_mmcif: str, input_metadata_json: str, output_index_json: str
+    input_mmcif: str,
+    input_metadata_json: str,
+    output_index_json: str,
+    full_cif: bool,
+    validate: bool,
+    reject_file: str,
+    jsonl_records: int,
+    compress: str,
+    compression_level: int,
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    manifest: str,
+    shard_depth: int,
+    file_list: str,
+    uniprot_cache: str,
+    uniprot_cache_ttl: float,
+    uniprot_refresh: bool,
+    prefetch_uniprot: bool,
+    uniprot_index: str,
 ):  # pragma: no cover
-    ciftojson.run(
-        cif_path=input_mmcif,
-        metadata_json_path=input_metadata_json,
-        output_index_json_path=output_index_json,
+    from bio3dbeacons.cli import uniprot
+    from bio3dbeacons.cli.ciftojson import ciftojson
+
+    initargs = setup_uniprot_cache(
+        uniprot_cache,
+        uniprot_cache_ttl,
+        uniprot_refresh,
+        input_metadata_json if prefetch_uniprot else None,
+        uniprot_index,
+    )
+    sys.exit(
+        ciftojson.run(
+            cif_path=input_mmcif,
+            metadata_json_path=input_metadata_json,
+            output_index_json_path=output_index_json,
+            scheduler=get_scheduler(
+                jobs, chunk_size, timeout, uniprot.configure_cache, initargs
+            ),
+            manifest_path=manifest,
+            shard_depth=shard_depth,
+            file_list=file_list,
+            full_cif=full_cif,
+            jsonl_records=jsonl_records,
+            compression=compress,
+            compression_level=compression_level,
+            validate=validate,
+            reject_path=reject_file,
+        )
     )
 
 
@@ -89,16 +378,57 @@ def cif_to_json(
     help="Output CIF file, a directory in case a directory is passed for --input-pdb",
     required=True,
 )
-def pdb_to_cif(input_pdb: str, output_cif: str):  # pragma: no cover
-    pdbtocif.run(pdb_path=input_pdb, output_cif_path=output_cif)
+@click.option(
+    "-e",
+    "--engine",
+    help="Conversion engine, 'python' converts in-process using the gemmi Python "
+    "bindings (falls back to the gemmi program on failure), 'binary' always runs "
+    "the gemmi program. Default python",
+    type=click.Choice(constants.ENGINES),
+    default=constants.ENGINE_PYTHON,
+    required=False,
+)
+@compression_options
+@scheduler_options
+@manifest_option
+@shard_depth_option
+@file_list_option
+def pdb_to_cif(
+    input_pdb: str,
+    output_cif: str,
+    engine: str,
+    compress: str,
+    compression_level: int,
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    manifest: str,
+    shard_depth: int,
+    file_list: str,
+):  # pragma: no cover
+    from bio3dbeacons.cli.pdbtocif import pdbtocif
+
+    sys.exit(
+        pdbtocif.run(
+            pdb_path=input_pdb,
+            output_cif_path=output_cif,
+            engine=engine,
+            scheduler=get_scheduler(jobs, chunk_size, timeout),
+            manifest_path=manifest,
+            shard_depth=shard_depth,
+            file_list=file_list,
+            compression=compress,
+            compression_level=compression_level,
+        )
+    )
 
 
 @main.command("load-index")
 @click.option(
     "-i",
     "--index-path",
-    help="Path to index file, can be a directory as well. In case of directory, "
-    "will index all json files in it.",
+    help="Path to index file or JSON Lines shard, can be a directory as well. In "
+    "case of directory, will index all .json files and .jsonl shards in it.",
     required=True,
 )
 @click.option(
@@ -115,24 +445,410 @@ def pdb_to_cif(input_pdb: str, output_cif: str):  # pragma: no cover
     default=1000,
     type=int,
 )
-def load_mongo(mongo_db_url: str, index_path: str, batch_size: int):  # pragma: no cover
+@click.option(
+    "--parsers",
+    help="Number of threads reading the index files, default "
+    f"{constants.DEFAULT_PARSERS}",
+    required=False,
+    default=constants.DEFAULT_PARSERS,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--fresh",
+    help="Load a new generation into a staging collection and swap it with "
+    "the live one once loaded and indexed, the live collection is kept for "
+    "rollback-index",
+    is_flag=True,
+    default=False,
+)
+@mongo_write_options
+@manifest_option
+@file_list_option
+def load_mongo(
+    mongo_db_url: str,
+    index_path: str,
+    batch_size: int,
+    parsers: int,
+    fresh: bool,
+    writers: int,
+    skip_unchanged: bool,
+    manifest: str,
+    file_list: str,
+):  # pragma: no cover
+    from bio3dbeacons.cli.mongoload import mongoload
+
+    if not mongo_db_url:
+        mongo_db_url = Config().MONGO_DB_URL
+
+    sys.exit(
+        mongoload.run(
+            index_path,
+            mongo_db_url,
+            batch_size,
+            manifest_path=manifest,
+            file_list=file_list,
+            parsers=parsers,
+            writers=writers,
+            skip_unchanged=skip_unchanged,
+            fresh=fresh,
+        )
+    )
+
+
+@main.command("rollback-index")
+@click.option(
+    "-h",
+    "--mongo-db-url",
+    help="Mongo DB URL",
+    required=False,
+)
+def rollback_mongo(mongo_db_url: str):  # pragma: no cover
+    """Restores the models replaced by the last load-index --fresh"""
+    from bio3dbeacons.cli.mongoload import mongoload
+
+    if not mongo_db_url:
+        mongo_db_url = Config().MONGO_DB_URL
+
+    sys.exit(mongoload.rollback(mongo_db_url))
+
+
+@main.command("create-indexes")
+@click.option(
+    "-h",
+    "--mongo-db-url",
+    help="Mongo DB URL",
+    required=False,
+)
+@click.option(
+    "--drop-unknown",
+    help="Drop the indexes of the model collection which are not declared, "
+    "e.g. the text index of former versions",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--check",
+    help="Explain the API queries and exit with an error if one of them scans "
+    "the whole collection",
+    is_flag=True,
+    default=False,
+)
+def create_indexes(
+    mongo_db_url: str, drop_unknown: bool, check: bool
+):  # pragma: no cover
+    """Creates the indexes the API queries need"""
+    from bio3dbeacons.mongo import indexes
 
     if not mongo_db_url:
         mongo_db_url = Config().MONGO_DB_URL
 
-    mongoload.run(index_path, mongo_db_url, batch_size)
+    sys.exit(indexes.run(mongo_db_url, drop_unknown=drop_unknown, check=check))
+
+
+@main.command("ingest")
+@click.option(
+    "-i",
+    "--input-pdb",
+    help="Input PDB file, a directory in which case all .pdb files inside it will be "
+    "loaded.",
+    required=True,
+)
+@click.option(
+    "-im",
+    "--input-metadata-json",
+    help="Input metadata JSON, a directory if --input-pdb is passed as a directory.",
+    required=True,
+)
+@click.option(
+    "-oc",
+    "--output-cif",
+    help="Also write the CIF files, a directory if --input-pdb is a directory",
+    required=False,
+    default=None,
+)
+@click.option(
+    "-o",
+    "--output-index-json",
+    help="Also write the index JSON files, a directory if --input-pdb is a "
+    "directory",
+    required=False,
+    default=None,
+)
+@click.option(
+    "-h",
+    "--mongo-db-url",
+    help="Mongo DB URL",
+    required=False,
+)
+@click.option(
+    "-b",
+    "--batch-size",
+    help="Number of documents to load in a batch, default 1000",
+    required=False,
+    default=1000,
+    type=int,
+)
+@click.option(
+    "--validate/--no-validate",
+    help="Validate the index documents against the schema before loading, "
+    "default on",
+    default=True,
+)
+@reject_file_option
+@mongo_write_options
+@compression_options
+@scheduler_options
+@manifest_option
+@shard_depth_option
+@file_list_option
+@uniprot_cache_options
+def ingest_pdb(
+    input_pdb: str,
+    input_metadata_json: str,
+    output_cif: str,
+    output_index_json: str,
+    mongo_db_url: str,
+    batch_size: int,
+    validate: bool,
+    reject_file: str,
+    writers: int,
+    skip_unchanged: bool,
+    compress: str,
+    compression_level: int,
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    manifest: str,
+    shard_depth: int,
+    file_list: str,
+    uniprot_cache: str,
+    uniprot_cache_ttl: float,
+    uniprot_refresh: bool,
+    prefetch_uniprot: bool,
+    uniprot_index: str,
+):  # pragma: no cover
+    from bio3dbeacons.cli import uniprot
+    from bio3dbeacons.cli.ingest import ingest
+
+    if not mongo_db_url:
+        mongo_db_url = Config().MONGO_DB_URL
+
+    initargs = setup_uniprot_cache(
+        uniprot_cache,
+        uniprot_cache_ttl,
+        uniprot_refresh,
+        input_metadata_json if prefetch_uniprot else None,
+        uniprot_index,
+    )
+    sys.exit(
+        ingest.run(
+            pdb_path=input_pdb,
+            metadata_json_path=input_metadata_json,
+            mongo_db_url=mongo_db_url,
+            batch_size=batch_size,
+            output_cif_path=output_cif,
+            output_index_json_path=output_index_json,
+            validate=validate,
+            scheduler=get_scheduler(
+                jobs, chunk_size, timeout, uniprot.configure_cache, initargs
+            ),
+            manifest_path=manifest,
+            shard_depth=shard_depth,
+            file_list=file_list,
+            compression=compress,
+            compression_level=compression_level,
+            writers=writers,
+            skip_unchanged=skip_unchanged,
+            reject_path=reject_file,
+        )
+    )
+
+
+@main.command("generate-metadata")
+@click.option(
+    "-i",
+    "--input-pdb",
+    help="Input PDB of a PFAM/Baker model, can be a directory in which case the "
+    "metadata of all the .pdb files will be generated",
+    required=True,
+)
+@click.option(
+    "-a",
+    "--input-a3m",
+    help="A3M alignment of the model, a directory in case a directory is passed "
+    "for --input-pdb",
+    required=True,
+)
+@click.option(
+    "-o",
+    "--output-metadata",
+    help="Output metadata JSON, a directory in case a directory is passed for "
+    "--input-pdb",
+    required=True,
+)
+@click.option(
+    "-c",
+    "--model-category",
+    help="Category of the models, default TEMPLATE-BASED",
+    type=click.Choice([x.value for x in ModelCategory]),
+    default=ModelCategory.TEMPLATE_BASED.value,
+    required=False,
+)
+@click.option(
+    "--overwrite",
+    help="Regenerate the metadata JSONs which already exist, by default they are "
+    "skipped so that an interrupted run resumes where it stopped",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--sparql-memo",
+    help="Path to a memo (SQLite) of the UniProt mnemonics resolved with the "
+    "UniProt SPARQL endpoint, e.g. data/sparql.sqlite, kept across runs. By "
+    "default they are memoized in memory.",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--sparql-miss-ttl",
+    help="Days after which the mnemonics UniProt did not know are queried again, "
+    "default SPARQL_MISS_TTL_DAYS in conf.ini",
+    required=False,
+    default=None,
+    type=float,
+)
+@click.option(
+    "--mnemonic-index",
+    help="Path to a mnemonic index built with build-mnemonic-index. Entry names "
+    "are resolved against it instead of the UniProt SPARQL endpoint, e.g. on "
+    "nodes without internet access.",
+    required=False,
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+)
+@scheduler_options
+@file_list_option
+def generate_metadata(
+    input_pdb: str,
+    input_a3m: str,
+    output_metadata: str,
+    model_category: str,
+    overwrite: bool,
+    sparql_memo: str,
+    sparql_miss_ttl: Optional[float],
+    mnemonic_index: str,
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    file_list: str,
+):  # pragma: no cover
+    from bio3dbeacons.cli.metadata_generators import pfam_baker
+    from bio3dbeacons.cli.mnemonicindex import mnemonicindex
+    from bio3dbeacons.cli.sparql import UniprotSparql
+
+    if mnemonic_index:
+        resolver = mnemonicindex.MnemonicIndex(mnemonic_index)
+    else:
+        miss_ttl = sparql_miss_ttl * 24 * 3600 if sparql_miss_ttl is not None else None
+        resolver = UniprotSparql(memo_path=sparql_memo, miss_ttl=miss_ttl)
+
+    sys.exit(
+        pfam_baker.run(
+            input_pdb,
+            input_a3m,
+            output_metadata,
+            model_category,
+            scheduler=get_scheduler(jobs, chunk_size, timeout),
+            overwrite=overwrite,
+            file_list=file_list,
+            resolver=resolver,
+        )
+    )
+
+
+@main.command("build-mnemonic-index")
+@click.option(
+    "-i",
+    "--input-dump",
+    help="UniProt ID mapping dump, idmapping.dat or idmapping_selected.tab, "
+    "optionally gzip or zstd compressed",
+    required=True,
+)
+@click.option(
+    "-o",
+    "--output-index",
+    help="Output mnemonic index (SQLite), e.g. data/mnemonic-index.sqlite",
+    required=True,
+)
+def build_mnemonic_index(input_dump: str, output_index: str):  # pragma: no cover
+    from bio3dbeacons.cli.mnemonicindex import mnemonicindex
+
+    sys.exit(mnemonicindex.run(input_dump, output_index))
+
+
+@main.command("build-uniprot-index")
+@click.option(
+    "-i",
+    "--input-dump",
+    help="UniProtKB dump, XML (.xml) or flat file (.dat), optionally gzip or zstd "
+    "compressed, e.g. uniprot_sprot.xml.gz",
+    required=True,
+)
+@click.option(
+    "-o",
+    "--output-index",
+    help="Output UniProt index (SQLite), e.g. data/uniprot-index.sqlite",
+    required=True,
+)
+def build_uniprot_index(input_dump: str, output_index: str):  # pragma: no cover
+    from bio3dbeacons.cli.uniprotindex import uniprotindex
+
+    sys.exit(uniprotindex.run(input_dump, output_index))
 
 
 @main.command("validate-index")
 @click.option(
     "-i",
     "--index-path",
-    help="Path to index file, can be a directory as well. In case of directory, "
-    "will index all json files in it.",
+    help="Path to index file or JSON Lines shard, can be a directory as well. In "
+    "case of directory, will index all .json files and .jsonl shards in it.",
     required=True,
 )
-def validate_index_json(index_path):
-    validatejson.run(index_path)
+@click.option(
+    "--max-errors",
+    help="Number of errors reported for every schema rule the documents break, "
+    f"default {constants.DEFAULT_MAX_ERRORS}",
+    default=constants.DEFAULT_MAX_ERRORS,
+    type=int,
+)
+@click.option(
+    "--report",
+    help="Write the report (counts and errors per schema rule) to this JSON file",
+    required=False,
+    default=None,
+)
+@scheduler_options
+@file_list_option
+def validate_index_json(
+    index_path: str,
+    max_errors: int,
+    report: str,
+    jobs: int,
+    chunk_size: int,
+    timeout: float,
+    file_list: str,
+):  # pragma: no cover
+    from bio3dbeacons.cli.validatejson import validatejson
+
+    sys.exit(
+        validatejson.run(
+            index_path,
+            scheduler=get_scheduler(jobs, chunk_size, timeout),
+            file_list=file_list,
+            max_errors=max_errors,
+            report_path=report,
+        )
+    )
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,262 @@
+import logging
+import os
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+from gemmi import cif
+
+from bio3dbeacons.cli import fileio, layout
+from bio3dbeacons.cli.utils import read_cif_categories
+
+LOG = logging.getLogger(__name__)
+
+# pLDDT bands as reported by AlphaFold DB, a score equal to an edge falls into
+# the lower band
+PLDDT_BAND_EDGES = (50.0, 70.0, 90.0)
+PLDDT_BANDS = ("veryLow", "low", "confident", "veryHigh")
+
+# columns (0-based, end excluded) of the PDB ATOM records
+PDB_RECORD = slice(0, 4)
+PDB_RESIDUE = slice(21, 27)  # chain, residue number and insertion code
+PDB_B_FACTOR = slice(60, 66)
+
+# the local QA metric of ModelCIF files
+QA_CIF_CATEGORIES = ("_ma_qa_metric", "_ma_qa_metric_local")
+CONFIDENCE_CIF_CATEGORIES = ("_atom_site", "_entity") + QA_CIF_CATEGORIES
+MISSING_CIF_VALUES = ("?", ".")
+
+
+class Confidence:
+    """Per-residue confidence scores of a model
+
+    Args:
+        per_residue (Sequence[float]): A score per residue, in model order
+    """
+
+    per_residue: np.ndarray
+
+    def __init__(self, per_residue: Sequence[float]) -> None:
+        self.per_residue = np.asarray(per_residue, dtype=float)
+
+    @property
+    def average(self) -> Optional[float]:
+        """Average of the residue scores, None if there are no residues"""
+        if not len(self.per_residue):
+            return None
+
+        return float(self.per_residue.mean())
+
+    def bands(
+        self,
+        edges: Sequence[float] = PLDDT_BAND_EDGES,
+        names: Sequence[str] = PLDDT_BANDS,
+    ) -> Dict[str, float]:
+        """Returns the fraction of the residues in every confidence band
+
+        Args:
+            edges (Sequence[float]): Upper bounds of all the bands but the last
+            names (Sequence[str]): Names of the bands, one more than edges
+
+        Returns:
+            Dict[str, float]: Fraction of the residues by band name
+        """
+        counts = np.bincount(
+            np.searchsorted(edges, self.per_residue, side="left"),
+            minlength=len(names),
+        )
+        total = max(len(self.per_residue), 1)
+
+        return {name: float(count) / total for name, count in zip(names, counts)}
+
+
+def map_file(path: str) -> np.ndarray:
+    """Returns the bytes of a file as an array, memory mapped if it is not
+    compressed"""
+    if fileio.get_compression(path):
+        with fileio.open_file(path, "rb") as fh:
+            return np.frombuffer(fh.read(), dtype=np.uint8)
+
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=np.uint8)
+
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def get_columns(buf: np.ndarray, starts: np.ndarray, columns: slice) -> np.ndarray:
+    """Returns the fixed columns of the lines starting at starts as bytes"""
+    width = columns.stop - columns.start
+    index = starts[:, np.newaxis] + np.arange(columns.start, columns.stop)
+
+    return buf[index].view(f"S{width}").ravel()
+
+
+def get_pdb_residue_scores(buf: np.ndarray) -> np.ndarray:
+    """Returns the B-factor of the first ATOM record of every residue
+
+    The lines are located and their columns read in bulk, no line is parsed
+    in Python.
+
+    Args:
+        buf (np.ndarray): Bytes of a PDB file
+
+    Returns:
+        np.ndarray: A score per residue
+    """
+    ends = np.flatnonzero(buf == ord("\n"))
+    starts = np.concatenate(([0], ends + 1))
+    ends = np.concatenate((ends, [len(buf)]))
+    starts = starts[ends - starts >= PDB_B_FACTOR.stop]
+    if not len(starts):
+        return np.empty(0)
+
+    starts = starts[get_columns(buf, starts, PDB_RECORD) == b"ATOM"]
+    residues = get_columns(buf, starts, PDB_RESIDUE)
+    first_atoms = np.ones(len(residues), dtype=bool)
+    first_atoms[1:] = residues[1:] != residues[:-1]
+
+    return get_columns(buf, starts[first_atoms], PDB_B_FACTOR).astype(float)
+
+
+def read_pdb_confidence(pdb_path: str) -> Confidence:
+    """Reads the per-residue confidence (B-factor column) of a PDB file
+
+    Args:
+        pdb_path (str): Path to the PDB file, may be compressed (.gz, .zst)
+
+    Returns:
+        Confidence: The confidence scores
+    """
+    return Confidence(get_pdb_residue_scores(map_file(pdb_path)))
+
+
+def to_array(values: Any) -> np.ndarray:
+    return np.array(list(values), dtype=str)
+
+
+def get_cif_residues(block: Any) -> np.ndarray:
+    """Returns a key of the residue of every atom of _atom_site"""
+    if len(block.find_values("_atom_site.auth_seq_id")):
+        tags = ("auth_asym_id", "auth_seq_id", "pdbx_PDB_ins_code")
+    else:
+        tags = ("label_asym_id", "label_seq_id")
+
+    columns = [to_array(block.find_values(f"_atom_site.{tag}")) for tag in tags]
+    columns = [column for column in columns if len(column)]
+    if not columns:
+        return np.empty(0, dtype=str)
+
+    residues = columns[0]
+    for column in columns[1:]:
+        residues = np.char.add(np.char.add(residues, "/"), column)
+
+    return residues
+
+
+def get_cif_polymer_atoms(block: Any, count: int) -> np.ndarray:
+    """Returns a mask of the _atom_site rows of polymer residues, like the ATOM
+    records of PDB files"""
+    groups = to_array(block.find_values("_atom_site.group_PDB"))
+    if len(groups) == count:
+        return groups == "ATOM"
+
+    entity_ids = to_array(block.find_values("_atom_site.label_entity_id"))
+    entity_types = to_array(block.find_values("_entity.type"))
+    if len(entity_ids) == count and len(entity_types):
+        polymers = to_array(block.find_values("_entity.id"))[entity_types == "polymer"]
+        return np.isin(entity_ids, polymers)
+
+    return np.ones(count, dtype=bool)
+
+
+def to_confidence(values: np.ndarray) -> Confidence:
+    return Confidence(values[~np.isin(values, MISSING_CIF_VALUES)].astype(float))
+
+
+def get_cif_qa_confidence(block: Any) -> Confidence:
+    """Returns the local QA metric of a ModelCIF block (_ma_qa_metric_local),
+    the pLDDT one if there are several, no residues if there is none"""
+    values = to_array(block.find_values("_ma_qa_metric_local.metric_value"))
+    metric_ids = to_array(block.find_values("_ma_qa_metric_local.metric_id"))
+    if len(values) and len(metric_ids):
+        ids = to_array(block.find_values("_ma_qa_metric.id"))
+        types = np.char.lower(to_array(block.find_values("_ma_qa_metric.type")))
+        plddt_ids = ids[types == "plddt"] if len(ids) == len(types) else ids
+        metric_id = plddt_ids[0] if len(plddt_ids) else metric_ids[0]
+        values = values[metric_ids == metric_id]
+
+    return to_confidence(values)
+
+
+def get_cif_b_factor_confidence(block: Any) -> Confidence:
+    """Returns the B-factor of the first atom of every polymer residue of the
+    _atom_site of an mmCIF block"""
+    values = to_array(block.find_values("_atom_site.B_iso_or_equiv"))
+    residues = get_cif_residues(block)
+    if not len(values) or len(residues) != len(values):
+        return Confidence([])
+
+    first_atoms = np.ones(len(residues), dtype=bool)
+    first_atoms[1:] = residues[1:] != residues[:-1]
+
+    return to_confidence(
+        values[first_atoms & get_cif_polymer_atoms(block, len(values))]
+    )
+
+
+def get_cif_block_confidence(block: Any) -> Confidence:
+    """Returns the per-residue confidence of an mmCIF block (read by GEMMI)
+
+    The local QA metric of ModelCIF files (_ma_qa_metric_local) is used if
+    present, the pLDDT one if there are several. Otherwise the B-factor of
+    the first atom of every polymer residue of _atom_site.
+
+    Args:
+        block (Any): CIF block of the model
+
+    Returns:
+        Confidence: The confidence scores
+    """
+    result = get_cif_qa_confidence(block)
+    if len(result.per_residue):
+        return result
+
+    return get_cif_b_factor_confidence(block)
+
+
+def read_cif_confidence(cif_path: str) -> Confidence:
+    """Reads the per-residue confidence of an mmCIF or ModelCIF file
+
+    Only the confidence and atom categories are parsed.
+
+    Args:
+        cif_path (str): Path to the CIF file, may be compressed (.gz, .zst)
+
+    Returns:
+        Confidence: The confidence scores
+    """
+    text = read_cif_categories(cif_path, CONFIDENCE_CIF_CATEGORIES)
+
+    return get_cif_block_confidence(cif.read_string(text).sole_block())
+
+
+def read_cif_qa_confidence(cif_path: str) -> Confidence:
+    """Reads the local QA metric of a ModelCIF file, the atoms are skipped
+    without being parsed
+
+    Args:
+        cif_path (str): Path to the CIF file, may be compressed (.gz, .zst)
+
+    Returns:
+        Confidence: The confidence scores, no residues if there is no metric
+    """
+    text = read_cif_categories(cif_path, QA_CIF_CATEGORIES)
+
+    return get_cif_qa_confidence(cif.read_string(text).sole_block())
+
+
+def read_confidence(path: str) -> Confidence:
+    """Reads the per-residue confidence of a PDB or mmCIF file, by extension"""
+    if layout.has_ext(path, ".cif"):
+        return read_cif_confidence(path)
+
+    return read_pdb_confidence(path)
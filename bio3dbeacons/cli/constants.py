@@ -0,0 +1,27 @@
+from enum import Enum
+
+# defaults of the CLI options, kept apart from the modules using them so that
+# defining the commands does not import their dependencies
+
+# files sent to a worker of the Scheduler at once
+DEFAULT_CHUNK_SIZE = 16
+
+# threads of load-index reading index files and writing batches to Mongo
+DEFAULT_PARSERS = 2
+DEFAULT_WRITERS = 4
+
+# PDB to CIF conversion engines
+ENGINE_PYTHON = "python"
+ENGINE_BINARY = "binary"
+ENGINES = (ENGINE_PYTHON, ENGINE_BINARY)
+
+# errors kept for every schema rule in the report of validate-index
+DEFAULT_MAX_ERRORS = 5
+
+
+class ModelCategory(Enum):  # pragma: no cover
+    EXPERIMENTALLY_DETERMINED = "EXPERIMENTALLY DETERMINED"
+    TEMPLATE_BASED = "TEMPLATE-BASED"
+    AB_INITIO = "AB-INITIO"
+    CONFORMATIONAL_ENSEMBLE = "CONFORMATIONAL ENSEMBLE"
+    DEEP_LEARNING = "DEEP-LEARNING"
@@ -0,0 +1,18 @@
+from collections import Counter
+from typing import Dict
+
+# counts of the current process, workers send theirs back with every batch
+_counts: Counter = Counter()
+
+
+def increment(name: str, value: int = 1):
+    """Adds value to a named counter of the current process"""
+    _counts[name] += value
+
+
+def drain() -> Dict[str, int]:
+    """Returns the counts since the last call and resets them"""
+    counts = dict(_counts)
+    _counts.clear()
+
+    return counts
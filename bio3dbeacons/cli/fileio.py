@@ -0,0 +1,130 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (GZIP, ZSTD)
+
+GZIP_EXT = ".gz"
+ZSTD_EXT = ".zst"
+EXTENSIONS = {GZIP: GZIP_EXT, ZSTD: ZSTD_EXT}
+COMPRESSED_EXTENSIONS = (GZIP_EXT, ZSTD_EXT)
+
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+
+
+def get_compression(path: str) -> Optional[str]:
+    """Returns the compression of a file detected from its extension"""
+    if path.endswith(GZIP_EXT):
+        return GZIP
+    if path.endswith(ZSTD_EXT):
+        return ZSTD
+
+    return None
+
+
+def split_compression_ext(path: str) -> Tuple[str, str]:
+    """Splits the compression extension off a path
+
+    Returns:
+        Tuple[str, str]: e.g. ("model.cif", ".gz") or ("model.cif", "")
+    """
+    for ext in COMPRESSED_EXTENSIONS:
+        if path.endswith(ext):
+            return path[: -len(ext)], ext
+
+    return path, ""
+
+
+def compressed_path(path: str, compression: Optional[str]) -> str:
+    """Appends the extension of the compression, if any, to a path"""
+    return f"{path}{EXTENSIONS[compression]}" if compression else path
+
+
+def open_file(
+    path: str,
+    mode: str = "rt",
+    level: Optional[int] = None,
+    compression: Optional[str] = None,
+) -> IO:
+    """Opens a plain, gzip or zstd compressed file, detected by extension
+
+    Args:
+        path (str): Path to the file
+        mode (str): Mode as for open(), text mode unless "b" is in the mode
+        level (int, optional): Compression level for writing, defaults to 6
+            for gzip and 3 for zstd
+        compression (str, optional): Compression to use instead of the one
+            detected from the extension, e.g. for temporary files
+
+    Returns:
+        IO: File object
+    """
+    compression = compression or get_compression(path)
+    binary = "b" in mode
+    if level is None and compression:
+        level = DEFAULT_LEVELS[compression]
+
+    if compression == GZIP:
+        kwargs = {"compresslevel": level} if "r" not in mode else {}
+        return gzip.open(path, mode, **kwargs)
+
+    if compression == ZSTD:
+        if zstandard is None:
+            raise RuntimeError(
+                f"Can not open {path}, the zstandard package is not installed"
+            )
+        if "r" in mode:
+            fh = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        else:
+            fh = zstandard.ZstdCompressor(level=level).stream_writer(open(path, "wb"))
+
+        return fh if binary else io.TextIOWrapper(fh, encoding="utf-8")
+
+    return open(path, mode)
+
+
+def read_text(path: str) -> str:
+    with open_file(path, "rt") as fh:
+        return fh.read()
+
+
+def write_text(path: str, text: str, level: Optional[int] = None):
+    with open_file(path, "wt", level) as fh:
+        fh.write(text)
+
+
+@contextmanager
+def plain_file(path: str, natively_supported: Tuple[str, ...] = ()) -> Iterator[str]:
+    """Yields the path of an uncompressed copy of a file
+
+    For tools which can only read plain files. No copy is made if the file is
+    not compressed, or its compression is in natively_supported.
+    """
+    compression = get_compression(path)
+    if not compression or compression in natively_supported:
+        yield path
+        return
+
+    base, _ = split_compression_ext(os.path.basename(path))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        plain_path = os.path.join(temp_dir, base)
+        with open_file(path, "rb") as src, open(plain_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        yield plain_path
+
+
+def compress_file(src: str, dst: str, level: Optional[int] = None):
+    """Writes a compressed copy of src to dst, compression detected from dst"""
+    with open(src, "rb") as fh_src, open_file(dst, "wb", level) as fh_dst:
+        shutil.copyfileobj(fh_src, fh_dst)
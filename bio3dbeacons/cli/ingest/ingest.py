@@ -0,0 +1,261 @@
+import logging
+import os
+from typing import Dict, List, Optional, Union
+
+from bio3dbeacons.cli import fileio, layout
+from bio3dbeacons.cli.ciftojson.ciftojson import Cif2Json
+from bio3dbeacons.cli.constants import DEFAULT_WRITERS
+from bio3dbeacons.cli.manifest import Manifest, report_orphans
+from bio3dbeacons.cli.mongoload.mongoload import BulkWriter, MongoLoad, get_load_target
+from bio3dbeacons.cli.pdbtocif.pdbtocif import Pdb2Cif
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.validatejson.validatejson import (
+    Rejected,
+    RejectWriter,
+    ValidateJSON,
+)
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_STAGE = "ingest"
+
+
+def process(
+    pdb_path: str,
+    metadata_json_path: str,
+    output_cif_path: Optional[str] = None,
+    output_index_json_path: Optional[str] = None,
+    validate: bool = True,
+    compression_level: Optional[int] = None,
+) -> Union[Dict, Rejected, bool]:
+    """Turns a PDB file and its metadata into an index document in memory
+
+    The PDB file is converted to an mmCIF document, merged with the metadata
+    and UniProt info and validated without going through intermediate files.
+
+    Args:
+        pdb_path (str): Path to the PDB file
+        metadata_json_path (str): Path to the metadata JSON file
+        output_cif_path (str, optional): Also write the CIF file here
+        output_index_json_path (str, optional): Also write the index JSON here
+        validate (bool): Validate the index document against the schema
+        compression_level (int, optional): Compression level of the CIF file
+
+    Returns:
+        Union[Dict, Rejected, bool]: The index document, the rejected document
+            if it is not valid or its metadata file is missing, False if the
+            index JSON could not be written
+    """
+    LOG.info(f"Ingesting {pdb_path}")
+    if not os.path.isfile(metadata_json_path):
+        return Rejected(pdb_path, f"metadata file {metadata_json_path} not found", {})
+
+    pdb2cif = Pdb2Cif(
+        pdb_path=pdb_path,
+        output_cif_path=output_cif_path,
+        compression_level=compression_level,
+    )
+    doc = pdb2cif.make_document()
+    if output_cif_path:
+        layout.ensure_parent(output_cif_path)
+        pdb2cif.write_document(doc)
+
+    cif2json = Cif2Json(
+        cif_path=output_cif_path or pdb_path,
+        metadata_json_path=metadata_json_path,
+        output_index_json_path=output_index_json_path,
+    )
+    cif2json.read_cif_document(doc)
+    cif2json.build()
+
+    if validate:
+        rejected = ValidateJSON.reject(cif2json.entry, pdb_path)
+        if rejected:
+            return rejected
+
+    if output_index_json_path:
+        layout.ensure_parent(output_index_json_path)
+        if cif2json.write():
+            return False
+
+    return cif2json.entry
+
+
+def run(
+    pdb_path: str,
+    metadata_json_path: str,
+    mongo_db_url: str,
+    batch_size: int = 1000,
+    output_cif_path: Optional[str] = None,
+    output_index_json_path: Optional[str] = None,
+    validate: bool = True,
+    scheduler: Optional[Scheduler] = None,
+    manifest_path: Optional[str] = None,
+    shard_depth: Optional[int] = None,
+    file_list: Optional[str] = None,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    writers: int = DEFAULT_WRITERS,
+    skip_unchanged: bool = True,
+    reject_path: Optional[str] = None,
+) -> int:
+    """Loads PDB models and their metadata to Mongo in a single pass
+
+    Workers convert, enrich and validate the models, the documents are sent
+    back to this process and upserted in batches by a BulkWriter.
+
+    Args:
+        pdb_path (str): Path to the PDB file, if a directory is passed,
+            process all .pdb files inside it and its subdirectories
+        metadata_json_path (str): Path to the metadata json file, a directory if
+            pdb_path is a directory.
+        mongo_db_url (str): Mongo DB URL
+        batch_size (int): Number of documents to batch in a single commit
+        output_cif_path (str, optional): Also write the CIF files, a directory
+            if pdb_path is a directory.
+        output_index_json_path (str, optional): Also write the index JSON
+            files, a directory if pdb_path is a directory.
+        validate (bool): Validate the documents against the index schema,
+            invalid documents are not loaded.
+        scheduler (Scheduler, optional): Runs the workers in directory mode,
+            defaults to one worker per available CPU.
+        manifest_path (str, optional): Build manifest, models whose PDB and
+            metadata have not changed since they were loaded to the same
+            database are skipped.
+        shard_depth (int, optional): Number of hash shard directories of the
+            optional outputs, by default the layout of pdb_path is mirrored.
+        file_list (str, optional): File listing the PDB files to load instead
+            of walking pdb_path, "-" for stdin.
+        compression (str, optional): Compression of the CIF files written in
+            directory mode, "gzip" or "zstd"
+        compression_level (int, optional): Compression level of the CIF files
+        writers (int): Number of concurrent bulk writes
+        skip_unchanged (bool): Only write the documents which are new or
+            whose content changed since they were loaded
+        reject_path (str, optional): Write the invalid documents, with the
+            reason, to this JSON Lines file
+
+    Returns:
+        int: 0 if all the models were loaded, 1 otherwise
+    """
+    lm = MongoLoad()
+    lm.init_collection(mongo_db_url)
+
+    manifest = Manifest(manifest_path) if manifest_path else None
+    target = get_load_target(mongo_db_url)
+    documents: List[Dict] = []
+    loaded: List[str] = []
+    missing_metadata: List[str] = []
+
+    def manifest_key(pdb_file: str) -> str:
+        return f"{target}:{os.path.abspath(pdb_file)}"
+
+    def is_loaded(pdb_file: str, metadata_file: str) -> bool:
+        # a missing metadata file is rejected by the task
+        if manifest is None or not os.path.isfile(metadata_file):
+            return False
+
+        return manifest.is_up_to_date(
+            MANIFEST_STAGE,
+            manifest_key(pdb_file),
+            [pdb_file, metadata_file],
+            output_is_file=False,
+        )
+
+    def record_completed():
+        if manifest:
+            for pdb_file in writer.pop_completed():
+                manifest.record(
+                    MANIFEST_STAGE, manifest_key(pdb_file), output_is_file=False
+                )
+
+    def load():
+        writer.submit(list(documents), list(loaded))
+        documents.clear()
+        loaded.clear()
+        record_completed()
+
+    rejects = RejectWriter(reject_path)
+
+    def on_result(task, entry):
+        if isinstance(entry, Rejected):
+            rejects.write(entry)
+            return
+
+        documents.append(entry)
+        loaded.append(task[0])
+        if len(documents) >= batch_size:
+            load()
+
+    if os.path.isdir(pdb_path):
+        for path in (output_cif_path, output_index_json_path):
+            if path and os.path.isfile(path):
+                LOG.error(f"{path} is a file, must provide a directory")
+                return 1
+
+        def tasks():
+            for pdb_file in layout.iter_files(pdb_path, ".pdb", file_list):
+                key = layout.relative_key(pdb_path, pdb_file, ".pdb")
+                metadata_file = layout.companion_path(metadata_json_path, key, ".json")
+                if metadata_file is None:
+                    missing_metadata.append(os.path.basename(key))
+                    continue
+                if is_loaded(pdb_file, metadata_file):
+                    continue
+                yield (
+                    pdb_file,
+                    metadata_file,
+                    output_cif_path
+                    and layout.output_path(
+                        output_cif_path,
+                        key,
+                        fileio.compressed_path(".cif", compression),
+                        shard_depth,
+                    ),
+                    output_index_json_path
+                    and layout.output_path(
+                        output_index_json_path, key, ".json", shard_depth
+                    ),
+                    validate,
+                    compression_level,
+                )
+
+        scheduler = scheduler or Scheduler()
+
+    else:
+        if not os.path.isfile(pdb_path):
+            LOG.error("PDB file not found!")
+            return 1
+
+        def tasks():
+            if not is_loaded(pdb_path, metadata_json_path):
+                yield (
+                    pdb_path,
+                    metadata_json_path,
+                    output_cif_path,
+                    output_index_json_path,
+                    validate,
+                    compression_level,
+                )
+
+        scheduler = Scheduler(jobs=1)
+
+    writer = BulkWriter(lm.collection, writers, skip_unchanged=skip_unchanged)
+    try:
+        summary = scheduler.run(process, tasks(), on_result)
+        if documents:
+            load()
+    finally:
+        written = writer.close()
+        record_completed()
+        rejects.close()
+        if manifest:
+            manifest.close()
+
+    report_orphans(missing_metadata, [])
+    if not written or rejects.rejected:
+        return 1
+
+    lm.create_index()
+
+    return summary.exit_status
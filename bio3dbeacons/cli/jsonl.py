@@ -0,0 +1,295 @@
+import datetime
+import json
+import logging
+import os
+import re
+from decimal import Decimal
+from enum import Enum
+from pathlib import PurePath
+from typing import (
+    IO,
+    AbstractSet,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from bio3dbeacons.cli import fileio, layout
+
+LOG = logging.getLogger(__name__)
+
+JSON_EXT = ".json"
+JSONL_EXT = ".jsonl"
+# index documents are read from both plain JSON files and JSON Lines shards
+INDEX_EXTENSIONS = (JSON_EXT, JSONL_EXT)
+
+SHARD_PREFIX = "index-"
+SHARD_NAME = re.compile(rf"^{SHARD_PREFIX}(\d+){re.escape(JSONL_EXT)}(\.gz|\.zst)?$")
+DEFAULT_RECORDS_PER_SHARD = 100000
+# the lines of the shards start with the _id of their document, which is read
+# without parsing the rest of the line
+ID_PREFIX = '{"_id": '
+
+_decoder = json.JSONDecoder()
+
+
+def to_jsonable(value: Any) -> Any:
+    """Converts a value to the types JSON supports, recursively
+
+    Covers the values of index documents: enums, dates, decimals, paths and
+    bytes, tuples and sets become lists.
+
+    Raises:
+        TypeError: For values of any other type
+    """
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, dict):
+        return {to_jsonable(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_jsonable(x) for x in value]
+    if isinstance(value, Enum):
+        return to_jsonable(value.value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, PurePath):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.decode()
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps_document(document: Dict) -> str:
+    """Serializes an index document to a line of a shard, its _id first"""
+    if "_id" in document:
+        document = {"_id": document["_id"], **document}
+
+    return json.dumps(document)
+
+
+def get_document_id(line: str) -> Any:
+    """Returns the _id of the document of a shard line, only the _id is parsed
+    when the line starts with it"""
+    if line.startswith(ID_PREFIX):
+        return _decoder.raw_decode(line, len(ID_PREFIX))[0]
+
+    return json.loads(line).get("_id")
+
+
+def is_jsonl(path: str) -> bool:
+    return layout.has_ext(path, JSONL_EXT)
+
+
+def iter_documents(
+    path: str, on_error: Optional[Callable[[str, ValueError], None]] = None
+) -> Iterator[Tuple[str, Dict]]:
+    """Lazily yields the index documents of a JSON file or JSON Lines shard
+
+    Shards are read line by line, so memory use does not depend on their
+    size.
+
+    Args:
+        path (str): Path to the file, may be compressed (.gz, .zst)
+        on_error (Callable, optional): Called with the name and the error of
+            every document which is not valid JSON, which is then skipped. By
+            default the error is raised.
+
+    Yields:
+        Tuple[str, Dict]: Name of the document in log messages, e.g.
+            index-000000.jsonl:42, and the document
+    """
+
+    def loads(name: str, text: str) -> Iterator[Tuple[str, Dict]]:
+        try:
+            document = json.loads(text)
+        except ValueError as e:
+            if on_error is None:
+                raise
+            on_error(name, e)
+            return
+        yield name, document
+
+    with fileio.open_file(path, "rt") as fh:
+        if not is_jsonl(path):
+            yield from loads(path, fh.read())
+            return
+
+        for line_number, line in enumerate(fh, 1):
+            if line.strip():
+                yield from loads(f"{path}:{line_number}", line)
+
+
+def get_shard_number(name: str) -> Optional[int]:
+    """Returns the number of a shard from its file name, None for other files"""
+    match = SHARD_NAME.match(name)
+
+    return int(match.group(1)) if match else None
+
+
+def compact_shards(directory: str, ids: AbstractSet[str], before: int) -> int:
+    """Removes the documents with the given _ids from the shards numbered below
+    before
+
+    A rebuilt model is appended to a new shard, its former document is
+    removed from the older shards so that only the new one is loaded. Only
+    the _id at the start of every line is parsed (see dumps_document), and
+    only the shards holding such documents are rewritten and moved in place,
+    emptied shards are deleted.
+
+    Args:
+        directory (str): Directory of the shards
+        ids (AbstractSet[str]): _id of the superseded documents
+        before (int): Number of the first shard which is kept as is
+
+    Returns:
+        int: Number of documents removed
+    """
+    removed = 0
+    for name in sorted(os.listdir(directory)):
+        number = get_shard_number(name)
+        if number is None or number >= before:
+            continue
+
+        path = os.path.join(directory, name)
+        with fileio.open_file(path, "rt") as src:
+            if not any(line.strip() and get_document_id(line) in ids for line in src):
+                continue
+
+        kept = dropped = 0
+        with fileio.open_file(path, "rt") as src, fileio.open_file(
+            f"{path}.tmp", "wt", compression=fileio.get_compression(path)
+        ) as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                if get_document_id(line) in ids:
+                    dropped += 1
+                    continue
+                dst.write(line if line.endswith("\n") else f"{line}\n")
+                kept += 1
+
+        if kept:
+            os.replace(f"{path}.tmp", path)
+            LOG.info(f"Removed {dropped} superseded documents from {path}")
+        else:
+            os.remove(f"{path}.tmp")
+            os.remove(path)
+            LOG.info(f"Removed {path}, all its documents were superseded")
+        removed += dropped
+
+    return removed
+
+
+class ShardWriter:
+    """Writes index documents to numbered JSON Lines shards of a directory
+
+    A shard is written to a temporary file and moved in place once it holds
+    records_per_shard records, or when the writer is closed, so readers never
+    see partial shards. Numbering continues after the shards already in the
+    directory.
+
+    Args:
+        directory (str): Output directory
+        records_per_shard (int): Number of documents per shard
+        compression (str, optional): "gzip" or "zstd"
+        compression_level (int, optional): Compression level
+        on_shard (Callable, optional): Called with the path and the keys of the
+            documents of every shard moved in place
+    """
+
+    directory: str
+    records_per_shard: int
+    compression: Optional[str]
+    compression_level: Optional[int]
+
+    def __init__(
+        self,
+        directory: str,
+        records_per_shard: int = DEFAULT_RECORDS_PER_SHARD,
+        compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        on_shard: Optional[Callable[[str, List[str]], None]] = None,
+    ) -> None:
+        self.directory = directory
+        self.records_per_shard = records_per_shard
+        self.compression = compression
+        self.compression_level = compression_level
+        self.on_shard = on_shard
+        os.makedirs(directory, exist_ok=True)
+
+        numbers = [
+            number
+            for number in map(get_shard_number, os.listdir(directory))
+            if number is not None
+        ]
+        self._number = max(numbers) + 1 if numbers else 0
+        # the shards numbered below were written by former runs
+        self.first_number = self._number
+        self._fh: Optional[IO] = None
+        self._keys: List[str] = []
+        self._count = 0
+
+    @property
+    def path(self) -> str:
+        """Path of the current shard"""
+        name = f"{SHARD_PREFIX}{self._number:06d}{JSONL_EXT}"
+
+        return fileio.compressed_path(
+            os.path.join(self.directory, name), self.compression
+        )
+
+    def write(self, document: Dict, key: Optional[str] = None):
+        self.write_line(dumps_document(document), key)
+
+    def write_line(self, line: str, key: Optional[str] = None):
+        """Appends a serialized document to the current shard
+
+        Args:
+            line (str): The document as JSON, without a newline, written by
+                dumps_document
+            key (str, optional): Key of the document passed to on_shard
+        """
+        if self._fh is None:
+            self._fh = fileio.open_file(
+                f"{self.path}.tmp",
+                "wt",
+                self.compression_level,
+                compression=self.compression,
+            )
+        self._fh.write(line)
+        self._fh.write("\n")
+        self._count += 1
+        if key is not None:
+            self._keys.append(key)
+
+        if self._count >= self.records_per_shard:
+            self.close()
+
+    def close(self):
+        """Moves the current shard in place, the next write starts a new one"""
+        if self._fh is None:
+            return
+
+        self._fh.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        LOG.info(f"Written {self._count} documents to {self.path}")
+        if self.on_shard:
+            self.on_shard(self.path, self._keys)
+
+        self._fh = None
+        self._keys = []
+        self._count = 0
+        self._number += 1
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,154 @@
+import hashlib
+import os
+import sys
+from typing import Iterator, List, Optional, Tuple, Union
+
+from bio3dbeacons.cli.fileio import (
+    COMPRESSED_EXTENSIONS,
+    open_file,
+    split_compression_ext,
+)
+
+STDIN = "-"
+
+# every shard level is a directory named after two hex characters of the
+# model ID hash, so 2 levels give 65536 directories
+SHARD_WIDTH = 2
+
+
+def has_ext(path: str, ext: Union[str, Tuple[str, ...]]) -> bool:
+    """Checks the extension of a file, which may also be compressed
+
+    Args:
+        path (str): Path to the file
+        ext (Union[str, Tuple[str, ...]]): An extension or a tuple of them
+    """
+    return split_compression_ext(path)[0].endswith(ext)
+
+
+def strip_ext(path: str, ext: str) -> str:
+    """Removes the extension, and the compression extension, from a path"""
+    path = split_compression_ext(path)[0]
+    return path[: -len(ext)] if path.endswith(ext) else path
+
+
+def model_id_from_path(path: str, ext: str) -> str:
+    """Returns the model ID of a file, i.e. its name without the extension"""
+    return strip_ext(os.path.basename(path), ext)
+
+
+def shard_dirs(model_id: str, depth: int) -> List[str]:
+    """Returns the shard directories of a model ID
+
+    Args:
+        model_id (str): Model ID, e.g. P38398_1jm7.1.A_1_103
+        depth (int): Number of directory levels
+
+    Returns:
+        List[str]: e.g. ["ab", "cd"] for depth 2
+    """
+    digest = hashlib.md5(model_id.encode()).hexdigest()
+
+    return [digest[i * SHARD_WIDTH : (i + 1) * SHARD_WIDTH] for i in range(depth)]
+
+
+def iter_files(
+    root: str, ext: Union[str, Tuple[str, ...]], file_list: Optional[str] = None
+) -> Iterator[str]:
+    """Lazily yields the files with the given extension under root
+
+    Args:
+        root (str): Directory to walk recursively
+        ext (Union[str, Tuple[str, ...]]): File extension, e.g. .cif, or a
+            tuple of them, matching compressed files (.cif.gz, .cif.zst) too
+        file_list (str, optional): File with one path per line (absolute or
+            relative to root) to use instead of walking root, "-" reads the
+            list from stdin.
+
+    Yields:
+        str: Path of every file
+    """
+    if file_list:
+        for path in read_file_list(file_list):
+            if has_ext(path, ext):
+                yield path if os.path.isabs(path) else os.path.join(root, path)
+        return
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if has_ext(filename, ext):
+                yield os.path.join(dirpath, filename)
+
+
+def read_file_list(file_list: str) -> Iterator[str]:
+    fh = sys.stdin if file_list == STDIN else open_file(file_list, "rt")
+    try:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+def relative_key(root: str, path: str, ext: str) -> str:
+    """Returns the path of a file relative to root, without the extension
+
+    Files outside root (e.g. absolute paths from a file list) are keyed by
+    their model ID only.
+    """
+    rel = os.path.relpath(path, root)
+    if rel.startswith(os.pardir):
+        rel = os.path.basename(path)
+
+    return strip_ext(rel, ext)
+
+
+def output_path(
+    root: str, key: str, ext: str, shard_depth: Optional[int] = None
+) -> str:
+    """Returns the output path of a model
+
+    Args:
+        root (str): Output directory
+        key (str): Relative key of the input file, see relative_key()
+        ext (str): Output extension, e.g. .json
+        shard_depth (int, optional): Number of hash shard directories, by
+            default the input layout is mirrored.
+
+    Returns:
+        str: Path of the output file
+    """
+    if shard_depth is None:
+        return os.path.join(root, f"{key}{ext}")
+
+    model_id = os.path.basename(key)
+
+    return os.path.join(root, *shard_dirs(model_id, shard_depth), f"{model_id}{ext}")
+
+
+def companion_path(root: str, key: str, ext: str) -> Optional[str]:
+    """Finds the file of another tree belonging to the same model
+
+    The file is looked up at the same relative path first and in the top
+    directory of root otherwise, plain or compressed.
+
+    Returns:
+        Optional[str]: The path, or None if the model has no such file
+    """
+    for name in (key, os.path.basename(key)):
+        for compression_ext in ("",) + COMPRESSED_EXTENSIONS:
+            candidate = os.path.join(root, f"{name}{ext}{compression_ext}")
+            if os.path.isfile(candidate):
+                return candidate
+
+    return None
+
+
+def ensure_parent(path: str):
+    """Creates the directory a file will be written to"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
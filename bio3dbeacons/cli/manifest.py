@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 1 << 20
+COMMIT_EVERY = 1000
+MAX_REPORTED_ORPHANS = 20
+
+
+def get_tool_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("bio3dbeacons")
+    except Exception:  # pragma: no cover
+        return "unknown"
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 hex digest of the file content"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class Manifest:
+    """Persistent record of what every pipeline stage has built
+
+    For each stage output the manifest keeps a digest over the content of its
+    inputs, the stage parameters and the tool version. A stage can then skip
+    an output whose record still matches. Content digests are cached against
+    the file size and modification time, so unchanged files are not re-read.
+
+    The manifest is only accessed from the main process, workers never touch
+    it.
+    """
+
+    path: str
+    tool_version: str
+
+    def __init__(self, path: str, tool_version: Optional[str] = None) -> None:
+        self.path = path
+        self.tool_version = tool_version or get_tool_version()
+        self.skipped = 0
+        self._pending = 0
+        self._digests: Dict[Tuple[str, str], str] = {}
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS builds ("
+            "stage TEXT, output TEXT, inputs_digest TEXT, tool_version TEXT, "
+            "updated REAL, PRIMARY KEY (stage, output))"
+        )
+        self.conn.commit()
+
+    def digest(self, path: str) -> str:
+        """Returns the content digest of a file, re-hashing only if it changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, digest FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = file_digest(path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest) "
+            "VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, digest),
+        )
+        self._maybe_commit()
+
+        return digest
+
+    def inputs_digest(self, inputs: Iterable[str], params: str = "") -> str:
+        sha = hashlib.sha256(params.encode())
+        for path in inputs:
+            sha.update(self.digest(path).encode())
+
+        return sha.hexdigest()
+
+    def is_up_to_date(
+        self,
+        stage: str,
+        output: str,
+        inputs: Iterable[str],
+        params: str = "",
+        output_is_file: bool = True,
+    ) -> bool:
+        """Checks if the output of a stage was built from the same inputs
+
+        The digest is kept until record() is called for the same output, once
+        the work has been done successfully.
+
+        Args:
+            stage (str): Pipeline stage, e.g. pdb2cif
+            output (str): Output file, or any key identifying the output
+            inputs (Iterable[str]): Input files of the stage
+            params (str): Stage parameters which change the output
+            output_is_file (bool): Whether the output must exist on disk
+
+        Returns:
+            bool: True if the recorded build matches and the work can be skipped
+        """
+        key = self._key(output, output_is_file)
+        inputs_digest = self.inputs_digest(inputs, params)
+
+        row = self.conn.execute(
+            "SELECT inputs_digest, tool_version FROM builds "
+            "WHERE stage = ? AND output = ?",
+            (stage, key),
+        ).fetchone()
+
+        if row == (inputs_digest, self.tool_version) and (
+            not output_is_file or os.path.exists(output)
+        ):
+            self.skipped += 1
+            return True
+
+        self._digests[(stage, key)] = inputs_digest
+        return False
+
+    def rebuild(
+        self,
+        stage: str,
+        output: str,
+        inputs: Iterable[str],
+        params: str = "",
+        output_is_file: bool = True,
+    ):
+        """Notes the inputs of an output rebuilt whatever its record, to be
+        recorded with record()"""
+        key = self._key(output, output_is_file)
+        self._digests[(stage, key)] = self.inputs_digest(inputs, params)
+
+    def record(self, stage: str, output: str, output_is_file: bool = True):
+        """Records a successful build checked earlier with is_up_to_date()"""
+        key = self._key(output, output_is_file)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO builds "
+            "(stage, output, inputs_digest, tool_version, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                stage,
+                key,
+                self._digests.pop((stage, key)),
+                self.tool_version,
+                time.time(),
+            ),
+        )
+        self._maybe_commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+        if self.skipped:
+            LOG.info(f"Skipped {self.skipped} unchanged outputs (manifest {self.path})")
+
+    @staticmethod
+    def _key(output: str, output_is_file: bool) -> str:
+        return os.path.abspath(output) if output_is_file else output
+
+    def _maybe_commit(self):
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.conn.commit()
+            self._pending = 0
+
+
+def find_orphans(
+    cif_stems: Iterable[str], metadata_stems: Iterable[str]
+) -> Tuple[List[str], List[str]]:
+    """Returns CIF files without metadata and metadata files without CIF
+
+    Args:
+        cif_stems (Iterable[str]): Model IDs of the CIF files
+        metadata_stems (Iterable[str]): Model IDs of the metadata JSON files
+
+    Returns:
+        Tuple[List[str], List[str]]: sorted model IDs of CIF files without
+            metadata, and of metadata files without CIF
+    """
+    cif_stems = set(cif_stems)
+    metadata_stems = set(metadata_stems)
+
+    return (
+        sorted(cif_stems - metadata_stems),
+        sorted(metadata_stems - cif_stems),
+    )
+
+
+def report_orphans(cif_orphans: List[str], metadata_orphans: List[str]):
+    for model_id in cif_orphans[:MAX_REPORTED_ORPHANS]:
+        LOG.warning(f"{model_id}: CIF file has no matching metadata JSON, skipping")
+    for model_id in metadata_orphans[:MAX_REPORTED_ORPHANS]:
+        LOG.warning(f"{model_id}: metadata JSON has no matching CIF file")
+    if cif_orphans or metadata_orphans:
+        LOG.warning(
+            f"Found {len(cif_orphans)} CIF files without metadata and "
+            f"{len(metadata_orphans)} metadata files without CIF"
+        )
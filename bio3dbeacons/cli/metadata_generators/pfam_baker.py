@@ -1,68 +1,211 @@
 import json
 import logging
 import os
-from typing import Tuple
-from pathlib import Path
 import re
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
 
-# from prettyconf import config
-
+from bio3dbeacons.cli import layout
+from bio3dbeacons.cli.confidence import read_confidence
+from bio3dbeacons.cli.fileio import open_file
+from bio3dbeacons.cli.mnemonicindex.mnemonicindex import MnemonicIndex
 from bio3dbeacons.cli.models import ModelMetadata
+from bio3dbeacons.cli.scheduler import Scheduler
 from bio3dbeacons.cli.sparql import UniprotSparql
-from bio3dbeacons.cli.utils import get_avg_plddt_from_pdb
 
 LOG = logging.getLogger(__name__)
 
-UNIPROT_SPARQL = UniprotSparql()
+# resolves the mnemonics of A3M headers, online or with a local index
+Resolver = Union[UniprotSparql, MnemonicIndex]
+
+
+# models buffered while collecting a batch of mnemonics to resolve, per name
+MAX_MODELS_PER_NAME = 10
 
 
-def run(pdb_path: str, a3m_path: str, metadata_path: str, model_category: str):
+def process(
+    pdb_file: str,
+    metadata_file: str,
+    uniprot_acc: Optional[str],
+    start: int,
+    end: int,
+    model_category: str,
+) -> int:
+    """Creates the metadata json document of a single PFAM/Baker model
+
+    The document is written to a temporary file moved in place once complete,
+    so an interrupted run never leaves partial documents behind.
+
+    Args:
+        pdb_file (str): Path to the PDB file, may be compressed
+        metadata_file (str): Path to the output metadata file
+        uniprot_acc (str, optional): UniProt accession of the model, resolved
+            from the A3M header
+        start (int): First residue of the model in the UniProt sequence
+        end (int): Last residue of the model in the UniProt sequence
+        model_category (str): Category of the model, e.g. TEMPLATE-BASED
+
+    Returns:
+        int: 0 if the document was written, 1 otherwise
+    """
+    if uniprot_acc is None:
+        LOG.error(f"No UniProt accession for {pdb_file}")
+        return 1
+
+    confidence = read_confidence(pdb_file)
+    if confidence.average is None:
+        LOG.error(f"No residues with a confidence score in {pdb_file}")
+        return 1
+
+    LOG.info(f"{pdb_file}: {len(confidence.per_residue)} residues")
+    md = ModelMetadata(
+        mappingAccession=uniprot_acc,
+        mappingAccessionType="uniprot",
+        start=start,
+        end=end,
+        modelCategory=model_category,
+        modelType="single",
+        confidenceType="pLDDT",
+        confidenceAvgLocalScore="{:.2f}".format(confidence.average),
+    )
+
+    layout.ensure_parent(metadata_file)
+    write_metadata_to_file(Path(f"{metadata_file}.tmp"), md)
+    os.replace(f"{metadata_file}.tmp", metadata_file)
+
+    return 0
+
+
+def resolve_headers(
+    models: List[Tuple[str, str, "SeqHeader"]], resolver: Resolver
+) -> Iterator[Tuple]:
+    """Resolves the mnemonics of the headers of a batch of models at once
+
+    Args:
+        models (List[Tuple[str, str, SeqHeader]]): PDB file, metadata file and
+            A3M header of every model
+        resolver (Resolver): Resolves the mnemonics
+
+    Yields:
+        Tuple: PDB file, metadata file, accession, start and end of every model
+    """
+    accessions = resolver.get_uniprot_accs_for_gene_names(
+        seq_header.seq_id for _, _, seq_header in models if not seq_header.uniprot_acc
+    )
+    for pdb_file, metadata_file, seq_header in models:
+        uniprot_acc = seq_header.uniprot_acc or accessions.get(seq_header.seq_id)
+        yield pdb_file, metadata_file, uniprot_acc, seq_header.start, seq_header.end
+
+
+def run(
+    pdb_path: str,
+    a3m_path: str,
+    metadata_path: str,
+    model_category: str,
+    scheduler: Optional[Scheduler] = None,
+    overwrite: bool = False,
+    file_list: Optional[str] = None,
+    resolver: Optional[Resolver] = None,
+) -> int:
     """
     Create metadata json documents for PFAM/Baker models
 
+    The A3M headers are read and their mnemonics resolved to UniProt
+    accessions in the main process, in batches of resolver.batch_size names
+    per query, before the models are sent to the workers.
+
     Args:
         pdb_path (str): Path to the PDB file, if a directory is passed,
-            process all .pdb files inside it
+            process all .pdb files inside it and its subdirectories
         a3m_path (str): Path to the A3M file, if a directory is passed,
-            process all .a3m files inside it
+            the .a3m files are looked up at the same relative paths
         metadata_path (str): Path to the output metadata file, if a
-            directory is passed, output to .json
+            directory is passed, output to .json mirroring the PDB layout
+        model_category (str): Category of the models, e.g. TEMPLATE-BASED
+        scheduler (Scheduler, optional): Runs the models in directory mode,
+            defaults to one worker per available CPU.
+        overwrite (bool): Regenerate the metadata files which already exist
+            in directory mode, by default they are skipped so that an
+            interrupted run can be resumed.
+        file_list (str, optional): File listing the PDB files instead of
+            walking pdb_path, "-" for stdin.
+        resolver (Resolver, optional): Resolves the mnemonics of the A3M
+            headers, the UniProt SPARQL endpoint by default, or a MnemonicIndex
+            to run without network access
+
+    Returns:
+        int: 0 if all the documents were written, 1 otherwise
     """
 
     pdb_path = Path(str(pdb_path)).resolve()
     a3m_path = Path(str(a3m_path)).resolve()
     metadata_path = Path(str(metadata_path)).resolve()
+    resolver = resolver or UniprotSparql()
 
-    def process_pdb_file(pdb_file, rel_path):
-        stem = pdb_file.stem
-        full_pdb_file = pdb_path / rel_path / pdb_file
-        a3m_file = a3m_path / rel_path / (stem + ".a3m")
-        metadata_file = metadata_path / rel_path / (stem + ".json")
-        seq_header = get_first_seqhdr_from_a3m(a3m_file)
-        uniprot_acc, start, end = seq_header.get_uniprot_start_end()
-        md = ModelMetadata(
-            mappingAccession=uniprot_acc,
-            mappingAccessionType="uniprot",
-            start=start,
-            end=end,
-            modelCategory=model_category,
-            modelType="single",
-            confidenceType="pLDDT",
-            confidenceAvgLocalScore=get_avg_plddt_from_pdb(full_pdb_file),
-        )
-        write_metadata_to_file(metadata_file, md)
-
-    # if a directory is provided, convert all .pdb files in it
+    # if a directory is provided, process all .pdb files in it
     if pdb_path.is_dir() and a3m_path.is_dir() and metadata_path.is_dir():
         LOG.info(f"Processing all PDB files in {pdb_path}")
+        skipped = missing = 0
+
+        def models():
+            nonlocal skipped, missing
+            for pdb_file in layout.iter_files(pdb_path.as_posix(), ".pdb", file_list):
+                key = layout.relative_key(pdb_path.as_posix(), pdb_file, ".pdb")
+                metadata_file = layout.output_path(
+                    metadata_path.as_posix(), key, ".json"
+                )
+                if not overwrite and os.path.isfile(metadata_file):
+                    skipped += 1
+                    continue
 
-        for path, _, files in os.walk(pdb_path):
-            for pdb_file in files:
-                rel_path = Path(path).relative_to(pdb_path)
-                process_pdb_file(Path(pdb_file), rel_path)
+                a3m_file = layout.companion_path(a3m_path.as_posix(), key, ".a3m")
+                seq_header = None
+                if a3m_file:
+                    seq_header = get_first_seqhdr_from_a3m(Path(a3m_file))
+                if seq_header is None:
+                    LOG.error(f"No A3M header for {pdb_file} in {a3m_path}")
+                    missing += 1
+                    continue
+                yield pdb_file, metadata_file, seq_header
 
-    elif pdb_path.is_file() and a3m_path.is_file() and metadata_path.is_file():
-        process_pdb_file(pdb_path, ".")
+        def tasks():
+            batch, names = [], set()
+            for model in models():
+                batch.append(model)
+                if not model[2].uniprot_acc:
+                    names.add(model[2].seq_id)
+                if (
+                    len(names) >= resolver.batch_size
+                    or len(batch) >= resolver.batch_size * MAX_MODELS_PER_NAME
+                ):
+                    for resolved in resolve_headers(batch, resolver):
+                        yield resolved + (model_category,)
+                    batch, names = [], set()
+
+            for resolved in resolve_headers(batch, resolver):
+                yield resolved + (model_category,)
+
+        try:
+            summary = (scheduler or Scheduler()).run(process, tasks())
+        finally:
+            resolver.close()
+        if skipped:
+            LOG.info(f"Skipped {skipped} models with existing metadata")
+
+        return 1 if missing else summary.exit_status
+
+    elif pdb_path.is_file() and a3m_path.is_file() and not metadata_path.is_dir():
+        seq_header = get_first_seqhdr_from_a3m(a3m_path)
+        if seq_header is None:
+            LOG.error(f"No sequence header in {a3m_path}")
+            return 1
+
+        [resolved] = resolve_headers(
+            [(pdb_path.as_posix(), metadata_path.as_posix(), seq_header)], resolver
+        )
+        resolver.close()
+
+        return process(*resolved, model_category)
     else:
         msg = (
             f"expected either all dirs or all files (not a mixture): "
@@ -70,8 +213,6 @@ def run(pdb_path: str, a3m_path: str, metadata_path: str, model_category: str):
         )
         raise Exception(msg)
 
-    return 0
-
 
 class SeqHeader:
 
@@ -110,18 +251,21 @@ class SeqHeader:
         self.start = int(start)
         self.end = int(end)
 
-    def get_uniprot_start_end(self) -> Tuple[str, int, int]:
+    def get_uniprot_start_end(
+        self, resolver: Optional[Resolver] = None
+    ) -> Tuple[str, int, int]:
 
         uniprot_acc = self.uniprot_acc
         if not uniprot_acc:
             gene_name = self.seq_id
-            uniprot_acc = UNIPROT_SPARQL.get_uniprot_acc_for_gene_name(gene_name)
+            resolver = resolver or UniprotSparql()
+            uniprot_acc = resolver.get_uniprot_acc_for_gene_name(gene_name)
 
         return uniprot_acc, int(self.start), int(self.end)
 
 
 def get_first_seqhdr_from_a3m(a3m_path: Path) -> SeqHeader:
-    with a3m_path.open("rt") as fp:
+    with open_file(str(a3m_path), "rt") as fp:
         for line in fp:
             if line.startswith(">"):
                 return SeqHeader(line[1:].strip())
@@ -0,0 +1,146 @@
+import logging
+import os
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bio3dbeacons.cli import counters, fileio
+from bio3dbeacons.cli.sqliteindex import ReadOnlyIndex, build_index
+from bio3dbeacons.cli.utils import chunked
+
+LOG = logging.getLogger(__name__)
+
+# ID type of the entry names in idmapping.dat
+ENTRY_NAME_TYPE = "UniProtKB-ID"
+
+BATCH_SIZE = 100000
+# batches between progress messages
+PROGRESS_INTERVAL = 100
+# host parameters per lookup query, below the SQLite limit
+LOOKUP_BATCH_SIZE = 500
+
+HITS = "mnemonic index hits"
+MISSES = "mnemonic index misses"
+
+
+def iter_id_mappings(fh: IO) -> Iterator[Tuple[str, str]]:
+    """Streams the (entry name, accession) pairs of a UniProt ID mapping dump
+
+    Both the three column idmapping.dat (accession, ID type, ID) and the
+    idmapping_selected.tab (accession, entry name, ...) formats are read,
+    isoform accessions are skipped.
+    """
+    for line in fh:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) == 3:
+            if fields[1] != ENTRY_NAME_TYPE:
+                continue
+            accession, name = fields[0], fields[2]
+        elif len(fields) > 3:
+            accession, name = fields[0], fields[1]
+        else:
+            continue
+
+        if name and accession and "-" not in accession:
+            yield name.upper(), accession
+
+
+def build(dump_path: str, output_index_path: str, batch_size: int = BATCH_SIZE) -> int:
+    """Builds a mnemonic index from a UniProt ID mapping dump
+
+    The index is a single SQLite table clustered on the entry names, looked
+    up by binary search of its B-tree. It is written to a temporary file and
+    moved in place once complete.
+
+    Args:
+        dump_path (str): Path to idmapping.dat or idmapping_selected.tab,
+            optionally gzip or zstd compressed
+        output_index_path (str): Path to the index (SQLite)
+        batch_size (int): Number of pairs inserted at once
+
+    Returns:
+        int: Number of entry names in the index
+    """
+    with build_index(output_index_path) as conn:
+        conn.execute(
+            "CREATE TABLE mnemonics (mnemonic TEXT PRIMARY KEY, accession TEXT) "
+            "WITHOUT ROWID"
+        )
+        with fileio.open_file(dump_path, "rt") as fh:
+            for number, batch in enumerate(chunked(iter_id_mappings(fh), batch_size)):
+                # the first accession of a name wins
+                conn.executemany("INSERT OR IGNORE INTO mnemonics VALUES (?, ?)", batch)
+                if number and number % PROGRESS_INTERVAL == 0:
+                    LOG.info(f"Read {number * batch_size} entry names")
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM mnemonics").fetchone()[0]
+        conn.execute("VACUUM")
+
+    return count
+
+
+class MnemonicIndex(ReadOnlyIndex):
+    """Read-only lookup of UniProt accessions by entry name (mnemonic)
+
+    Offline replacement of UniprotSparql, built by the build-mnemonic-index
+    command. All the processes share the memory mapped pages of the file.
+    """
+
+    batch_size: int = LOOKUP_BATCH_SIZE
+
+    def get_uniprot_acc_for_gene_name(self, gene_name: str) -> Optional[str]:
+        return self.get_uniprot_accs_for_gene_names([gene_name]).get(gene_name)
+
+    def get_uniprot_accs_for_gene_names(
+        self, gene_names: Iterable[str]
+    ) -> Dict[str, Optional[str]]:
+        """Looks up the accessions of UniProt entry names
+
+        Args:
+            gene_names (Iterable[str]): UniProt entry names, e.g. W5MWU3_LEPOC
+
+        Returns:
+            Dict[str, Optional[str]]: The accession of every name, None if the
+                name is not in the index
+        """
+        names: List[str] = list(dict.fromkeys(gene_names))
+        found = {}
+        for batch in chunked(names, LOOKUP_BATCH_SIZE):
+            found.update(
+                self.conn.execute(
+                    "SELECT mnemonic, accession FROM mnemonics WHERE mnemonic IN "
+                    f"({', '.join('?' * len(batch))})",
+                    [name.upper() for name in batch],
+                ).fetchall()
+            )
+
+        result = {name: found.get(name.upper()) for name in names}
+        hits = sum(1 for accession in result.values() if accession)
+        counters.increment(HITS, hits)
+        counters.increment(MISSES, len(result) - hits)
+
+        return result
+
+
+def run(dump_path: str, output_index_path: str) -> int:
+    """Builds a mnemonic index to resolve A3M headers offline
+
+    Args:
+        dump_path (str): Path to a UniProt ID mapping dump, idmapping.dat or
+            idmapping_selected.tab, optionally gzip or zstd compressed
+        output_index_path (str): Path to the index (SQLite)
+
+    Returns:
+        int: 0 if the index was built, 1 otherwise
+    """
+    if not os.path.isfile(dump_path):
+        LOG.error(f"{dump_path} not found!")
+        return 1
+
+    try:
+        count = build(dump_path, output_index_path)
+    except Exception as e:
+        LOG.error(f"Error in building mnemonic index from {dump_path}! (err:{e})")
+        return 1
+
+    LOG.info(f"Indexed {count} UniProt entry names in {output_index_path}")
+
+    return 0
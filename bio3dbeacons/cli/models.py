@@ -4,13 +4,7 @@ from typing import Optional
 from bson import ObjectId
 from pydantic import BaseModel, Field
 
-
-class ModelCategory(Enum):  # pragma: no cover
-    EXPERIMENTALLY_DETERMINED = "EXPERIMENTALLY DETERMINED"
-    TEMPLATE_BASED = "TEMPLATE-BASED"
-    AB_INITIO = "AB-INITIO"
-    CONFORMATIONAL_ENSEMBLE = "CONFORMATIONAL ENSEMBLE"
-    DEEP_LEARNING = "DEEP-LEARNING"
+from bio3dbeacons.cli.constants import ModelCategory
 
 
 class ModelType(Enum):
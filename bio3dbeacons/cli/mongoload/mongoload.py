@@ -1,87 +1,611 @@
+import hashlib
 import json
 import logging
 import os
-from typing import Collection, Dict, List
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Optional, Set
 
 import pymongo
-from pymongo import UpdateOne
+from pymongo import InsertOne, UpdateOne, WriteConcern, uri_parser
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from pymongo.results import BulkWriteResult
 
-from bio3dbeacons.config import config
+from bio3dbeacons.cli import layout
+from bio3dbeacons.cli.constants import DEFAULT_PARSERS, DEFAULT_WRITERS
+from bio3dbeacons.cli.jsonl import INDEX_EXTENSIONS, iter_documents
+from bio3dbeacons.cli.manifest import Manifest
+from bio3dbeacons.mongo.indexes import ensure_indexes
 
 LOG = logging.getLogger(__name__)
 
+MANIFEST_STAGE = "load-index"
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# write errors worth retrying: the errors of a primary stepping down or
+# shutting down
+TRANSIENT_ERROR_CODES = frozenset(
+    (6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436)
+)
+# counts of a bulk write result, summed over the attempts of a batch
+RESULT_COUNTS = ("nInserted", "nUpserted", "nMatched", "nModified", "nRemoved")
+
+# digest of the content of the documents, unchanged documents are not rewritten
+FINGERPRINT_FIELD = "_fingerprint"
+
+# a fresh load fills a staging collection which is then renamed over the live
+# one, the live one becoming the previous generation kept for rollbacks
+LIVE_COLLECTION = "modelCollection"
+STAGING_COLLECTION = f"{LIVE_COLLECTION}_staging"
+PREVIOUS_COLLECTION = f"{LIVE_COLLECTION}_previous"
+# nothing reads the staging collection, its writes do not wait for the journal
+STAGING_WRITE_CONCERN = WriteConcern(w=1, j=False)
+DUPLICATE_KEY = 11000
+
+INSERTED = "inserted"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+
+
+def get_load_target(mongo_db_url: str) -> str:
+    """Returns the Mongo hosts and collection documents are loaded to, without
+    credentials"""
+    try:
+        nodes = uri_parser.parse_uri(mongo_db_url)["nodelist"]
+        hosts = ",".join(f"{host}:{port}" for host, port in nodes)
+    except Exception:
+        hosts = "unknown"
+
+    return f"mongodb://{hosts}/models.modelCollection"
+
+
+def get_fingerprint(document: Dict) -> str:
+    """Returns a digest of the content of an index document, whatever the
+    order of its keys"""
+    content = {k: v for k, v in document.items() if k != FINGERPRINT_FIELD}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def add_fingerprint(document: Dict) -> Dict:
+    return {**document, FINGERPRINT_FIELD: get_fingerprint(document)}
+
+
+def upsert(document: Dict) -> UpdateOne:
+    return UpdateOne({"_id": document.get("_id")}, {"$set": document}, upsert=True)
+
+
+def is_transient(error: Exception) -> bool:
+    """Checks if a failed bulk write can succeed when retried
+
+    All the writes are upserts by _id, so retrying a whole batch is safe.
+    """
+    if isinstance(error, ConnectionFailure):
+        return True
+
+    if isinstance(error, BulkWriteError):
+        details = error.details or {}
+        codes = [x.get("code") for x in details.get("writeErrors", [])]
+        return all(code in TRANSIENT_ERROR_CODES for code in codes)
+
+    return False
+
+
+def is_duplicate_key(error: BulkWriteError) -> bool:
+    """Checks if the writes of a bulk write only failed on duplicate keys"""
+    errors = (error.details or {}).get("writeErrors", [])
+
+    return bool(errors) and all(x.get("code") == DUPLICATE_KEY for x in errors)
+
+
+def write_batch(
+    collection: Collection, requests: List, retries: int = MAX_RETRIES
+) -> BulkWriteResult:
+    """Runs an unordered bulk write, retrying transient errors with backoff
+
+    Concurrent upserts of the same _id can both insert it, the one losing the
+    race fails with a duplicate key error. Only those writes are retried,
+    right away, and then update the document of the winner.
+
+    Args:
+        collection (Collection): Target collection
+        requests (List): Write operations
+        retries (int): Maximum number of retries
+
+    Returns:
+        BulkWriteResult: The counts of all the attempts
+    """
+    counts: Counter = Counter()
+    attempt = 0
+    while True:
+        try:
+            result = collection.bulk_write(requests, ordered=False)
+            if not counts:
+                return result
+            counts.update({x: result.bulk_api_result.get(x, 0) for x in RESULT_COUNTS})
+            return BulkWriteResult({**counts, "upserted": []}, result.acknowledged)
+        except (BulkWriteError, ConnectionFailure) as e:
+            if attempt == retries:
+                raise
+            attempt += 1
+            if isinstance(e, BulkWriteError) and is_duplicate_key(e):
+                errors = e.details["writeErrors"]
+                counts.update({x: e.details.get(x, 0) for x in RESULT_COUNTS})
+                requests = [requests[x["index"]] for x in errors]
+                LOG.warning(f"Retrying {len(requests)} upserts of duplicate keys")
+                continue
+            if not is_transient(e):
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+            LOG.warning(f"Retrying bulk write in {delay:.1f} s (err:{e})")
+            time.sleep(delay)
+
+
+def insert_batch(
+    collection: Collection, documents: List[Dict], retries: int = MAX_RETRIES
+) -> int:
+    """Inserts a batch of documents into a fresh collection
+
+    Inserts are cheaper than upserts, which look up every _id first. The
+    documents whose _id is already in the collection (duplicates across index
+    files), or the whole batch after a transient error, are then upserted.
+
+    Args:
+        collection (Collection): Target collection
+        documents (List[Dict]): Index documents
+        retries (int): Maximum number of retries
+
+    Returns:
+        int: Number of documents written
+    """
+    try:
+        result = collection.bulk_write([InsertOne(x) for x in documents], ordered=False)
+        return result.inserted_count
+    except BulkWriteError as e:
+        if is_duplicate_key(e):
+            retry = [documents[x["index"]] for x in e.details["writeErrors"]]
+        elif is_transient(e):
+            retry = documents
+        else:
+            raise
+    except ConnectionFailure:
+        retry = documents
+
+    LOG.warning(f"Upserting {len(retry)} of {len(documents)} documents")
+    write_batch(collection, [upsert(x) for x in retry], retries)
+
+    return len(documents)
+
+
+class BulkWriter:
+    """Writes batches of index documents to a collection from a pool of threads
+
+    Batches are queued, at most two per writer, and written concurrently with
+    unordered bulk writes over the connection pool of the collection's client,
+    so preparing the next batches overlaps with the network round trips.
+
+    Every document is stored with a fingerprint of its content. Unless
+    skip_unchanged is off, the fingerprints of the documents of a batch
+    already in the collection are fetched with a single query and only new
+    or changed documents are written. With insert on, the collection is
+    expected to be empty and the documents are inserted instead (see
+    insert_batch).
+
+    Every batch carries the keys (e.g. index files) whose last document it
+    holds. A key is completed once its batch and all the batches submitted
+    before it are written, as its earlier documents may be in any of them.
+
+    Args:
+        collection (Collection): Target collection
+        writers (int): Number of writer threads
+        retries (int): Maximum number of retries of a batch
+        skip_unchanged (bool): Do not rewrite documents whose fingerprint
+            has not changed
+        insert (bool): Insert the documents rather than upserting them
+    """
+
+    collection: Collection
+    writers: int
+    retries: int
+    skip_unchanged: bool
+    insert: bool
+
+    def __init__(
+        self,
+        collection: Collection,
+        writers: int = DEFAULT_WRITERS,
+        retries: int = MAX_RETRIES,
+        skip_unchanged: bool = True,
+        insert: bool = False,
+    ) -> None:
+        self.collection = collection
+        self.writers = max(1, writers)
+        self.retries = retries
+        self.skip_unchanged = skip_unchanged
+        self.insert = insert
+        self.counts: Counter = Counter()
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=self.writers * 2)
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._written: Set[int] = set()
+        self._watermark = 0
+        self._keys: Dict[int, List[str]] = {}
+        self._completed: List[str] = []
+        self._start = time.perf_counter()
+        self._threads = [
+            threading.Thread(target=self._write, name=f"mongo-writer-{i}", daemon=True)
+            for i in range(self.writers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def documents(self) -> int:
+        return sum(self.counts[x] for x in (INSERTED, UPDATED, UNCHANGED))
+
+    def submit(self, documents: List[Dict], keys: Iterable[str] = ()):
+        """Queues a batch, blocks while all the writers are busy
+
+        Args:
+            documents (List[Dict]): Index documents, may be empty
+            keys (Iterable[str]): Keys completed by this batch
+        """
+        with self._lock:
+            self._submitted += 1
+            number = self._submitted
+            self._keys[number] = list(keys)
+        self._queue.put((number, documents))
+
+    def pop_completed(self) -> List[str]:
+        """Returns the keys completed since the last call"""
+        with self._lock:
+            completed, self._completed = self._completed, []
+
+        return completed
+
+    def close(self) -> bool:
+        """Waits for all the batches to be written
+
+        Returns:
+            bool: True if all the batches were written
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        seconds = time.perf_counter() - self._start
+        LOG.info(
+            f"Written {self.documents} documents in {seconds:.1f} s "
+            f"({self.documents / max(seconds, 1e-9):.0f} documents/s): "
+            f"{self.counts[INSERTED]} inserted, {self.counts[UPDATED]} updated, "
+            f"{self.counts[UNCHANGED]} unchanged, {self.failed} failed batches"
+        )
+
+        return self.failed == 0
+
+    def write_documents(self, documents: List[Dict]) -> Counter:
+        """Writes the new and changed documents of a batch
+
+        Returns:
+            Counter: Number of inserted, updated and unchanged documents
+        """
+        documents = [add_fingerprint(x) for x in documents]
+        if self.insert:
+            if not documents:
+                return Counter()
+            inserted = insert_batch(self.collection, documents, self.retries)
+            return Counter({INSERTED: inserted})
+
+        stored = {}
+        if self.skip_unchanged and documents:
+            stored = {
+                row["_id"]: row.get(FINGERPRINT_FIELD)
+                for row in self.collection.find(
+                    {"_id": {"$in": [x.get("_id") for x in documents]}},
+                    {FINGERPRINT_FIELD: 1},
+                )
+            }
+
+        counts: Counter = Counter()
+        requests = []
+        for document in documents:
+            key = document.get("_id")
+            if key in stored and stored[key] == document[FINGERPRINT_FIELD]:
+                counts[UNCHANGED] += 1
+            else:
+                requests.append(upsert(document))
+
+        if requests:
+            result = write_batch(self.collection, requests, self.retries)
+            counts[INSERTED] += result.upserted_count
+            counts[UPDATED] += result.modified_count
+            # matched documents which were identical apart from the fingerprint
+            counts[UNCHANGED] += result.matched_count - result.modified_count
+
+        return counts
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            number, documents = item
+            start = time.perf_counter()
+            try:
+                counts = self.write_documents(documents)
+            except Exception as e:
+                LOG.error(f"Error in writing {len(documents)} documents! (err:{e})")
+                counts = None
+            seconds = time.perf_counter() - start
+
+            if counts and documents:
+                LOG.info(
+                    f"Written {len(documents)} documents in {seconds:.2f} s "
+                    f"({len(documents) / max(seconds, 1e-9):.0f} documents/s): "
+                    f"{counts[INSERTED]} inserted, {counts[UPDATED]} updated, "
+                    f"{counts[UNCHANGED]} unchanged"
+                )
+            self._done(number, counts)
+
+    def _done(self, number: int, counts: Optional[Counter]):
+        with self._lock:
+            if counts is None:
+                self.failed += 1
+            else:
+                self.counts.update(counts)
+            self._written.add(number)
+            while self._watermark + 1 in self._written:
+                self._watermark += 1
+                self._written.remove(self._watermark)
+                keys = self._keys.pop(self._watermark)
+                # nothing is completed after a failed batch, its documents may
+                # belong to the keys of the next batches
+                if not self.failed:
+                    self._completed.extend(keys)
+
 
 class MongoLoad:
 
     data: List[Dict]
+    database: Database
     collection: Collection
 
     def __init__(self) -> None:
         self.data = []
-        self.key_fields = list(
-            (x, "text") for x in config.get_config("cli", "MONGO_INDEXES").split(",")
-        )
 
     def init_collection(self, mongo_db_url):
-        self.collection = pymongo.MongoClient(
-            mongo_db_url).models.modelCollection
+        self.database = pymongo.MongoClient(mongo_db_url).models
+        self.collection = self.database[LIVE_COLLECTION]
+
+    def has_collection(self, name: str) -> bool:
+        return bool(self.database.list_collection_names(filter={"name": name}))
+
+    def init_staging(self):
+        """Loads to an empty staging collection instead of the live one"""
+        self.database.drop_collection(STAGING_COLLECTION)
+        self.collection = self.database.get_collection(
+            STAGING_COLLECTION, write_concern=STAGING_WRITE_CONCERN
+        )
+
+    def replace_live(self, source: str, replaced: str):
+        """Renames the live collection to replaced, and source to live
+
+        Renames only update the catalog, whatever the size of the collections,
+        and each generation keeps its indexes. Between the two renames, a few
+        milliseconds, there is no live collection and the API finds no models.
+        Copying the live collection instead would avoid this gap but rewrite
+        and reindex all the served data on every load.
+        """
+        if self.has_collection(LIVE_COLLECTION):
+            self.database[LIVE_COLLECTION].rename(replaced, dropTarget=True)
+        self.database[source].rename(LIVE_COLLECTION, dropTarget=True)
+        self.collection = self.database[LIVE_COLLECTION]
+
+    def swap(self):
+        """Renames the staging collection over the live one, which becomes the
+        previous generation"""
+        self.replace_live(STAGING_COLLECTION, PREVIOUS_COLLECTION)
+        LOG.info(f"Swapped {STAGING_COLLECTION} to {LIVE_COLLECTION}")
+
+    def rollback(self) -> bool:
+        """Restores the previous generation, the live one is moved to the
+        staging collection
+
+        Returns:
+            bool: False if there is no previous generation
+        """
+        if not self.has_collection(PREVIOUS_COLLECTION):
+            LOG.error(f"No previous generation ({PREVIOUS_COLLECTION}) to restore")
+            return False
+
+        self.replace_live(PREVIOUS_COLLECTION, STAGING_COLLECTION)
+        LOG.info(f"Restored {PREVIOUS_COLLECTION} to {LIVE_COLLECTION}")
+
+        return True
 
     def load(self):
-        self.collection.bulk_write(self.data)
+        write_batch(self.collection, self.data)
 
     def create_index(self):
-        LOG.info("Creating index")
-        self.collection.create_index(self.key_fields)
+        ensure_indexes(self.collection)
 
 
-def run(index_path: str, mongo_db_url: str, batch_size: int):
+def run(
+    index_path: str,
+    mongo_db_url: str,
+    batch_size: int,
+    manifest_path: Optional[str] = None,
+    file_list: Optional[str] = None,
+    parsers: int = DEFAULT_PARSERS,
+    writers: int = DEFAULT_WRITERS,
+    skip_unchanged: bool = True,
+    fresh: bool = False,
+) -> int:
     """Load json documents in MONGO
 
+    Loading is pipelined: parser threads read the index files and batch their
+    documents, writer threads upsert the batches concurrently (see
+    BulkWriter). The queues between them are bounded, so only a few batches
+    are held in memory whatever the size of the files.
+
+    A fresh load inserts all the documents into an empty staging collection,
+    creates the indexes once the data is in and swaps it with the live
+    collection, which is kept as the previous generation (see
+    MongoLoad.swap). The live collection is left untouched if the load fails.
+
     Args:
-        index_path (str): Path to the index json file, if a directory is passed,
-            process all .json files inside it
+        index_path (str): Path to the index json file or JSON Lines shard, if a
+            directory is passed, process all .json and .jsonl files inside it
+            and its subdirectories
         mongo_db_url (str): Mongo DB URL
         batch_size (int): Number of documents to batch in a single commit
+        manifest_path (str, optional): Build manifest, index files which have
+            not changed since they were loaded to the same database are skipped.
+        file_list (str, optional): File listing the JSON files to load instead
+            of walking index_path, "-" for stdin.
+        parsers (int): Number of threads reading the index files
+        writers (int): Number of concurrent bulk writes
+        skip_unchanged (bool): Only write the documents which are new or
+            whose content changed since they were loaded
+        fresh (bool): Replace the live collection by a new generation holding
+            only the documents of index_path
+
+    Returns:
+        int: 0 if all the documents were loaded, 1 otherwise
     """
 
+    if os.path.isdir(index_path):
+        LOG.info(f"Loading all json files in {index_path}")
+        index_files = layout.iter_files(index_path, INDEX_EXTENSIONS, file_list)
+    elif os.path.isfile(index_path):
+        LOG.info(f"Loading {index_path}")
+        index_files = iter([index_path])
+    else:
+        LOG.error("Index json not found!")
+        return 1
+
     lm = MongoLoad()
     lm.init_collection(mongo_db_url)
+    if fresh:
+        LOG.info(f"Loading a new generation into {STAGING_COLLECTION}")
+        lm.init_staging()
 
-    # if a directory is provided, convert all .pdb files in it
-    if os.path.isdir(index_path):
-        LOG.info(f"Loading all json files in {index_path}")
-        total = incr = 0
+    manifest = Manifest(manifest_path) if manifest_path else None
+    target = get_load_target(mongo_db_url)
+    writer = BulkWriter(
+        lm.collection, writers, skip_unchanged=skip_unchanged, insert=fresh
+    )
+    files: queue.Queue = queue.Queue(maxsize=max(1, parsers) * 2)
+    parse_errors: List[str] = []
+    # files of a fresh load are recorded once their generation is live
+    staged: List[str] = []
+
+    def manifest_key(index_file: str) -> str:
+        return f"{target}:{os.path.abspath(index_file)}"
+
+    def is_loaded(index_file: str) -> bool:
+        if manifest is None:
+            return False
+
+        args = (MANIFEST_STAGE, manifest_key(index_file), [index_file])
+        if fresh:
+            manifest.rebuild(*args, output_is_file=False)
+            return False
 
-        for path, _, files in os.walk(index_path):
-            for file in filter(lambda x: x.endswith(".json"), files):
-                j: dict = json.load(open(f"{path}/{file}"))
-                lm.data.append(
-                    UpdateOne({"_id": j.get("_id")}, {"$set": j}, upsert=True)
+        return manifest.is_up_to_date(*args, output_is_file=False)
+
+    def record(index_files: List[str]):
+        if manifest:
+            for index_file in index_files:
+                manifest.record(
+                    MANIFEST_STAGE, manifest_key(index_file), output_is_file=False
                 )
-                incr += 1
-                if incr == batch_size:
-                    total += incr
-                    incr = 0
-                    lm.load()
-                    lm.data.clear()
-                    LOG.info(f"Loading done: {incr} documents")
-
-            if lm.data:
-                lm.load()
-                LOG.info(f"Loading done: {incr} documents")
 
-    else:
-        if not os.path.isfile(index_path):
-            LOG.error("Index json not found!")
+    def record_completed():
+        if fresh:
+            staged.extend(writer.pop_completed())
+        else:
+            record(writer.pop_completed())
+
+    def parse():
+        documents: List[Dict] = []
+        completed: List[str] = []
+        while True:
+            index_file = files.get()
+            if index_file is None:
+                break
+            try:
+                for _, document in iter_documents(index_file):
+                    documents.append(document)
+                    if len(documents) == batch_size:
+                        writer.submit(documents, completed)
+                        documents, completed = [], []
+            except Exception as e:
+                LOG.error(f"Error in reading {index_file}! (err:{e})")
+                parse_errors.append(index_file)
+                continue
+            # recorded with the last batch holding documents of the file
+            completed.append(index_file)
+
+        if documents or completed:
+            writer.submit(documents, completed)
+
+    threads = [
+        threading.Thread(target=parse, name=f"index-parser-{i}", daemon=True)
+        for i in range(max(1, parsers))
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        try:
+            for index_file in index_files:
+                if not is_loaded(index_file):
+                    files.put(index_file)
+                record_completed()
+        finally:
+            for _ in threads:
+                files.put(None)
+            for thread in threads:
+                thread.join()
+            ok = writer.close() and not parse_errors
+            record_completed()
+
+        LOG.info(f"Loading done: {writer.documents} documents")
+        if fresh and not ok:
+            LOG.error(f"Load failed, {LIVE_COLLECTION} is left untouched")
             return 1
 
-        LOG.info(f"Loading {index_path}")
-        d = json.load(open(index_path, "r"))
-        lm.data.append(
-            UpdateOne({"_id": d.get("_id")}, {"$set": d}, upsert=True))
-        lm.load()
-        LOG.info(f"Loaded {index_path}")
+        lm.create_index()
+        if fresh:
+            lm.swap()
+            record(staged)
+    finally:
+        if manifest:
+            manifest.close()
+
+    return 0 if ok else 1
+
 
-    lm.create_index()
+def rollback(mongo_db_url: str) -> int:
+    """Restores the generation of the live collection a fresh load replaced
+
+    Args:
+        mongo_db_url (str): Mongo DB URL
+
+    Returns:
+        int: 0 if the previous generation was restored, 1 otherwise
+    """
+    lm = MongoLoad()
+    lm.init_collection(mongo_db_url)
 
-    return 0
+    return 0 if lm.rollback() else 1
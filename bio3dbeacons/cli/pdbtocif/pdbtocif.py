@@ -1,36 +1,133 @@
 import logging
-import multiprocessing
 import os
+import shutil
 import subprocess
-from concurrent.futures import ProcessPoolExecutor
+import tempfile
+from typing import Optional
+
+try:
+    import gemmi
+except ImportError:  # pragma: no cover
+    gemmi = None
+
+from bio3dbeacons.cli import fileio, layout
+from bio3dbeacons.cli.constants import ENGINE_PYTHON
+from bio3dbeacons.cli.manifest import Manifest
+from bio3dbeacons.cli.scheduler import Scheduler
 
 LOG = logging.getLogger(__name__)
 
 GEMMI_BIN = os.environ.get("GEMMI_BIN", "gemmi")
 
+MANIFEST_STAGE = "pdb2cif"
+
 
 class Pdb2Cif:
     pdb_path: str
     output_cif_path: str
+    engine: str
+    compression_level: Optional[int]
 
-    def __init__(self, pdb_path: str, output_cif_path: str) -> None:
+    def __init__(
+        self,
+        pdb_path: str,
+        output_cif_path: str,
+        engine: str = ENGINE_PYTHON,
+        compression_level: Optional[int] = None,
+    ) -> None:
         self.pdb_path = pdb_path
         self.output_cif_path = output_cif_path
+        self.engine = engine
+        self.compression_level = compression_level
 
     def convert(self) -> int:
-        """Converts PDB to CIF"""
+        """Converts PDB to CIF
+
+        Uses the gemmi Python bindings in-process by default and falls back to
+        the external gemmi program if the bindings are not available or the
+        in-process conversion fails.
+        """
         LOG.info(
             f"Converting PDB:{self.pdb_path} to CIF:{self.output_cif_path}")
-        try:
-            cmd_args = [
-                GEMMI_BIN,
-                "convert",
-                "--to",
-                "mmcif",
-                self.pdb_path,
+
+        if self.engine == ENGINE_PYTHON:
+            try:
+                self.convert_in_process()
+                LOG.info(f"Converted {self.pdb_path} to {self.output_cif_path}")
+                return 0
+            except Exception as e:
+                if not shutil.which(GEMMI_BIN):
+                    LOG.error(
+                        f"Error converting the PDB file: {self.pdb_path} (err:{e})"
+                    )
+                    LOG.debug(e)
+                    return 1
+
+                LOG.warning(
+                    f"In-process conversion failed for {self.pdb_path} (err:{e}), "
+                    f"falling back to {GEMMI_BIN}"
+                )
+
+        return self.convert_with_binary()
+
+    def convert_in_process(self):
+        """Converts PDB to CIF using the gemmi Python bindings
+
+        Mirrors what `gemmi convert --to mmcif` does: entities are set up from
+        the PDB records and single row categories are written as pairs.
+        Compressed input and output files are handled in memory.
+        """
+        self.write_document(self.make_document())
+
+    def make_document(self):
+        """Reads the PDB file and returns it as an in-memory mmCIF document"""
+        if gemmi is None:
+            raise RuntimeError("gemmi Python bindings are not installed")
+
+        if fileio.get_compression(self.pdb_path) == fileio.ZSTD:
+            structure = gemmi.read_pdb_string(fileio.read_text(self.pdb_path))
+        else:
+            # gemmi reads gzipped files itself
+            structure = gemmi.read_structure(self.pdb_path)
+        structure.setup_entities()
+        # only numbers residues aligned to a SEQRES, as gemmi convert does
+        structure.assign_label_seq_id(force=False)
+
+        return structure.make_mmcif_document()
+
+    def write_document(self, doc):
+        """Writes an mmCIF document to the output CIF file"""
+        if fileio.get_compression(self.output_cif_path):
+            fileio.write_text(
                 self.output_cif_path,
-            ]
-            subprocess.check_call(cmd_args)
+                doc.as_string(gemmi.cif.Style.PreferPairs),
+                self.compression_level,
+            )
+        else:
+            doc.write_file(self.output_cif_path, gemmi.cif.Style.PreferPairs)
+
+    def convert_with_binary(self) -> int:
+        """Converts PDB to CIF using the external gemmi program
+
+        The program reads gzipped files but only writes plain ones, other
+        compressed files go through a temporary file.
+        """
+        try:
+            with fileio.plain_file(
+                self.pdb_path, natively_supported=(fileio.GZIP,)
+            ) as pdb_path, tempfile.TemporaryDirectory() as temp_dir:
+                compressed = fileio.get_compression(self.output_cif_path)
+                cif_path = (
+                    os.path.join(temp_dir, "model.cif")
+                    if compressed
+                    else self.output_cif_path
+                )
+                cmd_args = [GEMMI_BIN, "convert", "--to", "mmcif", pdb_path, cif_path]
+                subprocess.check_call(cmd_args)
+                if compressed:
+                    fileio.compress_file(
+                        cif_path, self.output_cif_path, self.compression_level
+                    )
             LOG.info(f"Converted {self.pdb_path} to {self.output_cif_path}")
 
         except Exception as e:
@@ -42,19 +139,59 @@ class Pdb2Cif:
         return 0
 
 
-def process(pdb_path: str, output_cif_path: str):
-    pdbtocif = Pdb2Cif(pdb_path=pdb_path, output_cif_path=output_cif_path)
+def process(
+    pdb_path: str,
+    output_cif_path: str,
+    engine: str = ENGINE_PYTHON,
+    compression_level: Optional[int] = None,
+):
+    layout.ensure_parent(output_cif_path)
+    pdbtocif = Pdb2Cif(
+        pdb_path=pdb_path,
+        output_cif_path=output_cif_path,
+        engine=engine,
+        compression_level=compression_level,
+    )
     return pdbtocif.convert()
 
 
-def run(pdb_path: str, output_cif_path: str) -> int:
+def run(
+    pdb_path: str,
+    output_cif_path: str,
+    engine: str = ENGINE_PYTHON,
+    scheduler: Optional[Scheduler] = None,
+    manifest_path: Optional[str] = None,
+    shard_depth: Optional[int] = None,
+    file_list: Optional[str] = None,
+    compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+) -> int:
     """Converts PDB to CIF file
 
     Args:
         pdb_path (str): Path to the PDB file, if a directory is passed,
-            process all .pdb files inside it
+            process all .pdb files inside it and its subdirectories. PDB files
+            may be compressed (.pdb.gz, .pdb.zst).
         output_cif_path (str): Path to output cif file, if pdb_path is a directory,
-            this must be a directory too.
+            this must be a directory too. A file ending with .gz or .zst is
+            written compressed.
+        engine (str): Conversion engine, either "python" (in-process gemmi, with
+            the gemmi program as fallback) or "binary" (gemmi program only).
+        scheduler (Scheduler, optional): Runs the conversions in directory mode,
+            defaults to one worker per available CPU.
+        manifest_path (str, optional): Build manifest, PDB files which have not
+            changed since their CIF was built are skipped.
+        shard_depth (int, optional): Write the CIF files into this many levels
+            of hash shard directories, by default the layout of pdb_path is
+            mirrored.
+        file_list (str, optional): File listing the PDB files to convert
+            instead of walking pdb_path, "-" for stdin.
+        compression (str, optional): Compression of the CIF files written in
+            directory mode, "gzip" or "zstd"
+        compression_level (int, optional): Compression level of the CIF files
+
+    Returns:
+        int: 0 if all the files were converted, 1 otherwise
     """
 
     # if a directory is provided, convert all .pdb files in it
@@ -68,20 +205,57 @@ def run(pdb_path: str, output_cif_path: str) -> int:
         os.makedirs(output_cif_path, exist_ok=True)
         LOG.info(f"Created directory {output_cif_path}")
 
-        with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count() + 1) as p:
-            for _, _, filenames in os.walk(pdb_path):
-                for pdb_file in list(filter(lambda x: x.endswith(".pdb"), filenames)):
-                    cif_file = pdb_file.replace(".pdb", ".cif")
-                    pdb_file_path = f"{pdb_path}/{pdb_file}"
-                    output_cif_file_path = f"{output_cif_path}/{cif_file}"
-                    p.submit(process, pdb_file_path, output_cif_file_path)
+        manifest = Manifest(manifest_path) if manifest_path else None
+
+        def tasks():
+            for pdb_file_path in layout.iter_files(pdb_path, ".pdb", file_list):
+                output_cif_file_path = layout.output_path(
+                    output_cif_path,
+                    layout.relative_key(pdb_path, pdb_file_path, ".pdb"),
+                    fileio.compressed_path(".cif", compression),
+                    shard_depth,
+                )
+                if manifest and manifest.is_up_to_date(
+                    MANIFEST_STAGE, output_cif_file_path, [pdb_file_path], engine
+                ):
+                    continue
+                yield pdb_file_path, output_cif_file_path, engine, compression_level
+
+        def on_result(task, result):
+            if manifest:
+                manifest.record(MANIFEST_STAGE, task[1])
+
+        try:
+            summary = (scheduler or Scheduler()).run(process, tasks(), on_result)
+        finally:
+            if manifest:
+                manifest.close()
+
+        return summary.exit_status
 
     else:
         if not os.path.isfile(pdb_path):
             LOG.error("PDB file '%s' not found!", pdb_path)
             return 1
 
-        pdbtocif = Pdb2Cif(pdb_path=pdb_path, output_cif_path=output_cif_path)
-        return pdbtocif.convert()
+        manifest = Manifest(manifest_path) if manifest_path else None
+        if manifest and manifest.is_up_to_date(
+            MANIFEST_STAGE, output_cif_path, [pdb_path], engine
+        ):
+            manifest.close()
+            return 0
+
+        pdbtocif = Pdb2Cif(
+            pdb_path=pdb_path,
+            output_cif_path=output_cif_path,
+            engine=engine,
+            compression_level=compression_level,
+        )
+        status = pdbtocif.convert()
+
+        if manifest:
+            if status == 0:
+                manifest.record(MANIFEST_STAGE, output_cif_path)
+            manifest.close()
 
-    return 0
+        return status
@@ -0,0 +1,372 @@
+import faulthandler
+import logging
+import math
+import os
+import signal
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from bio3dbeacons.cli import counters
+from bio3dbeacons.cli.constants import DEFAULT_CHUNK_SIZE
+from bio3dbeacons.cli.utils import chunked
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_TASKS_PER_CHILD = 200
+MAX_REPORTED_FAILURES = 20
+
+# a task stuck in native code can not be interrupted by the SIGALRM handler,
+# the worker is killed once it overruns the timeout by this factor
+HARD_TIMEOUT_FACTOR = 2
+
+Task = Tuple[Any, ...]
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def _cgroup_cpu_quota() -> Optional[float]:
+    """Returns the CPU quota of the current cgroup (v2 or v1), if there is one"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as fh:
+            quota, period = fh.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as fh:
+            quota = int(fh.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as fh:
+            period = int(fh.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus() -> int:
+    """Returns the number of CPUs usable by this process
+
+    Takes the CPU affinity mask and the cgroup CPU quota (e.g. docker --cpus)
+    into account, unlike multiprocessing.cpu_count().
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        cpus = os.cpu_count() or 1
+
+    quota = _cgroup_cpu_quota()
+    if quota:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+
+    return cpus
+
+
+def _raise_timeout(signum, frame):
+    raise TaskTimeout("task timed out")
+
+
+@contextmanager
+def _time_limit(timeout: Optional[float], hard: bool = False):
+    if not timeout:
+        yield
+        return
+
+    if hard:
+        faulthandler.dump_traceback_later(timeout * HARD_TIMEOUT_FACTOR, exit=True)
+    soft = hasattr(signal, "setitimer")
+    if soft:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        if soft:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+        if hard:
+            faulthandler.cancel_dump_traceback_later()
+
+
+def is_failure(result: Any) -> bool:
+    """Task functions signal failure by returning False or a non-zero int"""
+    if result is False:
+        return True
+
+    return isinstance(result, int) and not isinstance(result, bool) and result != 0
+
+
+def run_batch(
+    func: Callable,
+    batch: List[Task],
+    timeout: Optional[float] = None,
+    hard_timeout: bool = False,
+) -> Tuple[List[Tuple[Task, Any, Optional[str]]], Dict[str, int]]:
+    """Runs func on every task of the batch, never raises
+
+    Args:
+        func (Callable): Function to run
+        batch (List[Task]): Argument tuples for func
+        timeout (float, optional): Seconds after which a task is interrupted
+        hard_timeout (bool): Exit the process if a task can not be interrupted,
+            only to be used inside worker processes
+
+    Returns:
+        Tuple[List[Tuple[Task, Any, Optional[str]]], Dict[str, int]]:
+            (task, result, error) for each task, and the counters incremented
+            while running the batch
+    """
+    results = []
+    for task in batch:
+        try:
+            with _time_limit(timeout, hard_timeout):
+                result = func(*task)
+            results.append((task, result, None))
+        except Exception as e:
+            results.append((task, None, f"{type(e).__name__}: {e}"))
+
+    return results, counters.drain()
+
+
+def _init_worker(initializer: Optional[Callable], initargs: Tuple):
+    # forked workers inherit the counts of the parent, which reports them
+    counters.drain()
+    if initializer:
+        initializer(*initargs)
+
+
+class RunSummary:
+    succeeded: int
+    failures: List[Tuple[Task, str]]
+    failed: int
+    counters: Counter
+
+    def __init__(self) -> None:
+        self.succeeded = 0
+        self.failed = 0
+        self.failures = []
+        self.counters = Counter()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def throughput(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def exit_status(self) -> int:
+        return 1 if self.failed else 0
+
+    def add_failure(self, task: Task, reason: str):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append((task, reason))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def log(self):
+        LOG.info(
+            f"Processed {self.total} files in {self.elapsed:.1f}s "
+            f"({self.throughput:.1f} files/s): {self.succeeded} succeeded, "
+            f"{self.failed} failed"
+        )
+        for task, reason in self.failures:
+            LOG.error(f"Failed {task[0] if task else task}: {reason}")
+        if self.failed > len(self.failures):
+            LOG.error(f"... and {self.failed - len(self.failures)} more failures")
+        for name, value in sorted(self.counters.items()):
+            LOG.info(f"{name}: {value}")
+
+
+class Scheduler:
+    """Runs a function over a stream of tasks in a pool of worker processes
+
+    Tasks are argument tuples, batched into chunks so that every submission
+    to a worker carries several files. Only a bounded number of chunks is in
+    flight at any time, so arbitrarily large directory trees can be streamed
+    without holding one future per file. Workers are recycled after
+    max_tasks_per_child chunks to cap the memory growth of long runs.
+    """
+
+    jobs: int
+    chunk_size: int
+    max_in_flight: int
+    timeout: Optional[float]
+    max_tasks_per_child: int
+    initializer: Optional[Callable]
+    initargs: Tuple
+
+    def __init__(
+        self,
+        jobs: Optional[int] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_in_flight: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_tasks_per_child: int = DEFAULT_MAX_TASKS_PER_CHILD,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple = (),
+    ) -> None:
+        self.jobs = jobs or available_cpus()
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max_in_flight or self.jobs * 2
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        # sets up per-process state (e.g. caches) in every worker, and in this
+        # process when running inline
+        self.initializer = initializer
+        self.initargs = initargs
+
+    def run(
+        self,
+        func: Callable,
+        tasks: Iterable[Task],
+        on_result: Optional[Callable[[Task, Any], None]] = None,
+    ) -> RunSummary:
+        """Runs func(*task) for every task
+
+        Args:
+            func (Callable): A picklable (module level) function
+            tasks (Iterable[Task]): Argument tuples, consumed lazily
+            on_result (Callable, optional): Called in this process with the task
+                and the result of every successful task
+
+        Returns:
+            RunSummary: Counts, throughput and the first failures of the run
+        """
+        LOG.info(f"Running with {self.jobs} workers, {self.chunk_size} files per task")
+        summary = RunSummary()
+
+        if self.jobs == 1:
+            if self.initializer:
+                self.initializer(*self.initargs)
+            for batch in chunked(tasks, self.chunk_size):
+                self._handle_results(
+                    *run_batch(func, batch, self.timeout), summary, on_result
+                )
+        else:
+            self._run_parallel(func, tasks, summary, on_result)
+        # counts of this process, e.g. incremented while generating the tasks
+        summary.counters.update(counters.drain())
+
+        summary.finish()
+        summary.log()
+
+        return summary
+
+    def _handle_results(self, results, batch_counters, summary: RunSummary, on_result):
+        summary.counters.update(batch_counters)
+        for task, result, error in results:
+            if error is None and not is_failure(result):
+                summary.succeeded += 1
+                if on_result:
+                    on_result(task, result)
+            else:
+                summary.add_failure(task, error or f"returned {result!r}")
+
+    def _run_parallel(self, func, tasks, summary: RunSummary, on_result):
+        in_flight: Dict[Any, Tuple[List[Task], bool, ProcessPoolExecutor]] = {}
+        # tasks of the chunks lost with a dead worker, rerun one at a time in
+        # a single worker so that only the task which kills it fails
+        retries: Deque[Task] = deque()
+        state = {"executor": self._new_executor(), "submitted": 0, "isolated": None}
+
+        def submit(batch):
+            if state["submitted"] >= self.max_tasks_per_child * self.jobs:
+                # retire the executor once its chunks are done, so that no
+                # more than jobs workers ever run at once
+                while any(
+                    executor is state["executor"]
+                    for _, _, executor in in_flight.values()
+                ):
+                    collect()
+                state["executor"].shutdown(wait=True)
+                state["executor"] = self._new_executor()
+                state["submitted"] = 0
+
+            executor = state["executor"]
+            future = executor.submit(run_batch, func, batch, self.timeout, True)
+            in_flight[future] = (batch, False, executor)
+            state["submitted"] += 1
+
+        def submit_retry():
+            if state["isolated"] is None:
+                state["isolated"] = self._new_executor(max_workers=1)
+
+            batch = [retries.popleft()]
+            executor = state["isolated"]
+            future = executor.submit(run_batch, func, batch, self.timeout, True)
+            in_flight[future] = (batch, True, executor)
+
+        def collect():
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, isolated, executor = in_flight.pop(future)
+                try:
+                    results, batch_counters = future.result()
+                except BrokenProcessPool:
+                    # a worker died (killed on timeout, segfault, OOM), every
+                    # chunk queued on that executor fails with it
+                    if isolated:
+                        # the task ran alone, it is the one which killed it
+                        executor.shutdown(wait=False)
+                        state["isolated"] = None
+                        summary.add_failure(batch[0], "worker process died")
+                        continue
+                    if executor is state["executor"]:
+                        state["executor"] = self._new_executor()
+                        state["submitted"] = 0
+                    retries.extend(batch)
+                    continue
+                except Exception as e:
+                    for task in batch:
+                        summary.add_failure(task, f"{type(e).__name__}: {e}")
+                    continue
+
+                self._handle_results(results, batch_counters, summary, on_result)
+
+            if retries and not any(isolated for _, isolated, _ in in_flight.values()):
+                submit_retry()
+
+        try:
+            for batch in chunked(tasks, self.chunk_size):
+                while len(in_flight) >= self.max_in_flight:
+                    collect()
+                submit(batch)
+
+            while in_flight:
+                collect()
+        finally:
+            state["executor"].shutdown(wait=True)
+            if state["isolated"] is not None:
+                state["isolated"].shutdown(wait=True)
+
+    def _new_executor(self, max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=max_workers or self.jobs,
+            initializer=_init_worker,
+            initargs=(self.initializer, self.initargs),
+        )
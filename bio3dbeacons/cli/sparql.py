@@ -1,33 +1,233 @@
 import logging
-from SPARQLWrapper import JSON
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+from SPARQLWrapper import JSON, POST
 from SPARQLWrapper import SPARQLWrapper
 
+from bio3dbeacons.cli import counters
+from bio3dbeacons.cli.utils import chunked
+from bio3dbeacons.config.config import get_config
 
 LOG = logging.getLogger(__name__)
 
+# UniProt mnemonics (entry names), e.g. BRCA1_HUMAN, anything else is never
+# sent to the endpoint
+MNEMONIC = re.compile(r"^[A-Za-z0-9_]+$")
+DEFAULT_BATCH_SIZE = 200
+
+# memoized names, UniProt knows them or not, and names which had to be queried
+MEMO_HITS = "sparql memo hits"
+MEMO_UNKNOWN_HITS = "sparql memo hits of unknown names"
+MEMO_MISSES = "sparql memo misses"
+
+
+def get_default_miss_ttl() -> float:
+    return float(get_config("cli", "SPARQL_MISS_TTL_DAYS")) * 24 * 3600
+
+
+def count_hits(accessions: Dict[str, Optional[str]]):
+    """Counts memoized names, apart from the ones UniProt does not know"""
+    unknown = sum(1 for accession in accessions.values() if accession is None)
+    if len(accessions) > unknown:
+        counters.increment(MEMO_HITS, len(accessions) - unknown)
+    if unknown:
+        counters.increment(MEMO_UNKNOWN_HITS, unknown)
+
 
 class UniprotSparql:
+    """Resolves UniProt mnemonics to accessions with the UniProt SPARQL endpoint
+
+    Mnemonics are resolved in batches, a single query per batch_size names.
+    Resolved names, and names UniProt does not know, are memoized in memory
+    and, if memo_path is given, in a SQLite database kept across runs. Names
+    UniProt did not know are queried again once they are older than miss_ttl,
+    as they may have been added since. Failed queries are not memoized.
+
+    Args:
+        endpoint (str): URL of the SPARQL endpoint
+        memo_path (str, optional): Path to the SQLite memo
+        batch_size (int): Number of mnemonics per query
+        miss_ttl (float, optional): Seconds after which unknown names are
+            queried again, defaults to SPARQL_MISS_TTL_DAYS in conf.ini
+    """
+
+    ENDPOINT = "https://sparql.uniprot.org/sparql"
+
+    endpoint: str
+    memo_path: Optional[str]
+    batch_size: int
+    miss_ttl: float
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        memo_path: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        miss_ttl: Optional[float] = None,
+    ) -> None:
+        self.endpoint = endpoint or self.ENDPOINT
+        self.memo_path = memo_path
+        self.batch_size = max(1, batch_size)
+        self.miss_ttl = get_default_miss_ttl() if miss_ttl is None else miss_ttl
+        self._memory: Dict[str, Optional[str]] = {}
+        # neither the connection nor the wrapper are shared with forked workers
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sparql: Optional[SPARQLWrapper] = None
+        self._pid: Optional[int] = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._conn = None
+            self._sparql = None
+            self._pid = os.getpid()
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        if self.memo_path is None:
+            return None
+
+        self._check_pid()
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.memo_path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.memo_path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS mnemonics ("
+                "mnemonic TEXT PRIMARY KEY, accession TEXT, resolved REAL)"
+            )
+            self._conn.commit()
+
+        return self._conn
+
+    @property
+    def sparql(self) -> SPARQLWrapper:
+        self._check_pid()
+        if self._sparql is None:
+            self._sparql = SPARQLWrapper(self.endpoint, returnFormat=JSON)
+            # batches of names do not fit in a URL
+            self._sparql.setMethod(POST)
+
+        return self._sparql
 
-    ENDPOINT = 'https://sparql.uniprot.org/sparql'
+    def get_uniprot_acc_for_gene_name(self, gene_name: str) -> Optional[str]:
+        return self.get_uniprot_accs_for_gene_names([gene_name]).get(gene_name)
 
-    def get_uniprot_acc_for_gene_name(self, gene_name):
+    def get_uniprot_accs_for_gene_names(
+        self, gene_names: Iterable[str]
+    ) -> Dict[str, Optional[str]]:
+        """Resolves UniProt mnemonics to accessions
+
+        Args:
+            gene_names (Iterable[str]): UniProt mnemonics, e.g. W5MWU3_LEPOC
+
+        Returns:
+            Dict[str, Optional[str]]: The accession of every name, None if
+                UniProt does not know the name or the query failed
+        """
+        result = {}
+        todo = []
+        for name in dict.fromkeys(gene_names):
+            if name in self._memory:
+                result[name] = self._memory[name]
+                count_hits({name: result[name]})
+            elif not MNEMONIC.match(name):
+                LOG.warning(f"'{name}' is not a UniProt mnemonic")
+                result[name] = None
+            else:
+                todo.append(name)
+
+        if todo:
+            result.update(self.read(todo))
+            todo = [name for name in todo if name not in result]
+
+        for batch in chunked(todo, self.batch_size):
+            accessions = self.query(batch)
+            if accessions is None:
+                result.update(dict.fromkeys(batch))
+                continue
+
+            resolved = {name: accessions.get(name) for name in batch}
+            counters.increment(MEMO_MISSES, len(batch))
+            self.write(resolved)
+            result.update(resolved)
+
+        return result
+
+    def query(self, gene_names: List[str]) -> Optional[Dict[str, str]]:
+        """Runs a single query for a batch of mnemonics
+
+        Returns:
+            Optional[Dict[str, str]]: The accessions of the names UniProt knows,
+                None if the query failed
+        """
+        values = " ".join(f"'{name}'" for name in gene_names)
         statement = (
             "PREFIX up: <http://purl.uniprot.org/core/> "
-            "SELECT ?protein "
+            "SELECT ?mnemonic ?protein "
             "WHERE { "
+            f"  VALUES ?mnemonic {{ {values} }} "
             "  ?protein a up:Protein . "
-            "  ?protein up:mnemonic '" + gene_name + "'"
-            "}")
-
-        sparql = SPARQLWrapper(self.ENDPOINT, returnFormat=JSON)
-        sparql.setQuery(statement)
+            "  ?protein up:mnemonic ?mnemonic . "
+            "}"
+        )
 
+        self.sparql.setQuery(statement)
         try:
-            ret = sparql.query().convert()
-            unp_url = ret['results']['bindings'][0]['protein']['value']
-            uniprot_acc = unp_url.split('/')[-1]
-            return uniprot_acc
+            ret = self.sparql.query().convert()
         except Exception as err:
-            msg = f"sparql query failed with genename query '{gene_name}': {err}"
-            LOG.warning(msg)
+            names = " ".join(gene_names)
+            LOG.warning(f"sparql query failed with genename query '{names}': {err}")
             return None
+
+        accessions = {}
+        for binding in ret["results"]["bindings"]:
+            unp_url = binding["protein"]["value"]
+            accessions.setdefault(binding["mnemonic"]["value"], unp_url.split("/")[-1])
+        LOG.info(f"Resolved {len(accessions)} of {len(gene_names)} mnemonics")
+
+        return accessions
+
+    def read(self, gene_names: List[str]) -> Dict[str, Optional[str]]:
+        """Returns the memoized accessions of the names, None for the misses
+        younger than miss_ttl"""
+        if self.conn is None:
+            return {}
+
+        result = {}
+        expired = time.time() - self.miss_ttl
+        # stays below the SQLite limit of host parameters
+        for batch in chunked(gene_names, 500):
+            rows = self.conn.execute(
+                "SELECT mnemonic, accession FROM mnemonics WHERE mnemonic IN "
+                f"({', '.join('?' * len(batch))}) "
+                "AND (accession IS NOT NULL OR resolved > ?)",
+                [*batch, expired],
+            ).fetchall()
+            result.update(rows)
+
+        count_hits(result)
+        self._memory.update(result)
+
+        return result
+
+    def write(self, accessions: Dict[str, Optional[str]]):
+        self._memory.update(accessions)
+        if self.conn is None:
+            return
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO mnemonics (mnemonic, accession, resolved) "
+                "VALUES (?, ?, ?)",
+                [(name, acc, time.time()) for name, acc in accessions.items()],
+            )
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# memory mapped size of a read-only index, in bytes
+INDEX_MMAP_SIZE = 2**34
+
+
+@contextmanager
+def build_index(output_index_path: str) -> Iterator[sqlite3.Connection]:
+    """Opens a new SQLite index to be filled
+
+    The index is written to a temporary file without journal, and moved in
+    place once the block completes, so readers never see a partial index. If
+    the block raises, the temporary file is removed.
+
+    Args:
+        output_index_path (str): Path to the index
+
+    Yields:
+        sqlite3.Connection: Connection to the temporary file
+    """
+    temp_path = f"{output_index_path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    directory = os.path.dirname(os.path.abspath(output_index_path))
+    os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(temp_path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.close()
+        os.remove(temp_path)
+        raise
+    conn.close()
+
+    os.replace(temp_path, output_index_path)
+
+
+class ReadOnlyIndex:
+    """A SQLite index opened read-only and memory mapped, so all the processes
+    share the pages of the file
+
+    The file is opened as immutable, SQLite then takes no locks and does not
+    check for changes. Every process opens its own connection.
+    """
+
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(
+                f"file:{os.path.abspath(self.path)}?mode=ro&immutable=1", uri=True
+            )
+            self._conn.execute(f"PRAGMA mmap_size={INDEX_MMAP_SIZE}")
+            self._conn_pid = os.getpid()
+
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
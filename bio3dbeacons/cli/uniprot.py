@@ -0,0 +1,632 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from bio3dbeacons.cli import counters, fileio, layout
+from bio3dbeacons.cli.sqliteindex import ReadOnlyIndex
+from bio3dbeacons.config.config import get_config
+
+# the HTTP clients are imported when entries are fetched, most runs serve them
+# from the cache or the local index
+if TYPE_CHECKING:  # pragma: no cover
+    import requests
+
+LOG = logging.getLogger(__name__)
+
+NAMESPACE = "{http://uniprot.org/uniprot}"
+ENTRY_TAG = f"{NAMESPACE}entry"
+ORGANISM_TAG = f"{NAMESPACE}organism"
+REQUEST_TIMEOUT = 30
+# size of the chunks fed to the XML parser, in bytes
+PARSE_CHUNK_SIZE = 16 * 1024
+MAX_MEMORY_ENTRIES = 100000
+
+# statuses of accessions not (or no longer) in UniProt, cached as empty entries
+NOT_FOUND_STATUSES = (400, 404, 410)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+HITS = "uniprot cache hits"
+MISSES = "uniprot cache misses"
+REVALIDATED = "uniprot cache revalidated"
+STALE = "uniprot cache stale entries served"
+ERRORS = "uniprot fetch errors"
+INDEX_HITS = "uniprot index hits"
+INDEX_MISSES = "uniprot index misses"
+
+
+class UniProtError(Exception):
+    pass
+
+
+def get_default_ttl() -> float:
+    return float(get_config("cli", "UNIPROT_CACHE_TTL_DAYS")) * 24 * 3600
+
+
+def get_url(accession: str) -> str:
+    return f"{get_config('cli', 'UNIPROT_XML_URL')}/{accession}.xml"
+
+
+def conditional_headers(row: Optional[Tuple]) -> Dict[str, str]:
+    """Returns the headers revalidating a cached entry"""
+    headers = {}
+    if row and row[1]:
+        headers["If-None-Match"] = row[1]
+    if row and row[2]:
+        headers["If-Modified-Since"] = row[2]
+
+    return headers
+
+
+def parse_response(
+    status: int, headers, content: bytes
+) -> Tuple[int, Dict, Optional[str], Optional[str]]:
+    """Turns a UniProt response into (status, fields, ETag, Last-Modified)
+
+    Raises:
+        UniProtError: If the status is neither a success nor a not found
+    """
+    etag = headers.get("ETag")
+    last_modified = headers.get("Last-Modified")
+
+    if status == 304 or status in NOT_FOUND_STATUSES:
+        return status, {}, etag, last_modified
+    if status != 200:
+        raise UniProtError(f"HTTP {status}")
+
+    return status, extract_uniprot_fields(iter_chunks(content)), etag, last_modified
+
+
+def get_retry_after(headers) -> Optional[float]:
+    """Returns the delay requested by a Retry-After header, in seconds"""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+
+
+def parse_uniprot_entry(xml_root: ET.Element) -> Dict:
+    """Extracts the fields of the index document from a UniProt XML
+
+    Args:
+        xml_root (ET.Element): Root element of the UniProt XML of an entry
+
+    Returns:
+        Dict: mappingId, mappingDescription, gene, organismScientificName
+            and taxId
+    """
+    return parse_entry_element(xml_root.find(f"./{NAMESPACE}entry"))
+
+
+def iter_chunks(content: bytes, size: int = PARSE_CHUNK_SIZE) -> Iterator[memoryview]:
+    view = memoryview(content)
+    for i in range(0, len(view), size):
+        yield view[i : i + size]
+
+
+def extract_uniprot_fields(chunks: Iterable[bytes]) -> Dict:
+    """Extracts the fields of the index document from a streamed UniProt XML
+
+    The XML is parsed incrementally and parsing stops at the end of the
+    <organism> element, which comes after all the other elements needed. The
+    references, comments, features and sequence making up most of large
+    entries are never parsed.
+
+    Args:
+        chunks (Iterable[bytes]): The UniProt XML of an entry, in chunks
+
+    Returns:
+        Dict: See parse_uniprot_entry()
+
+    Raises:
+        UniProtError: If there is no entry in the XML
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    entry = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                depth += 1
+                if depth == 2 and elem.tag == ENTRY_TAG:
+                    entry = elem
+                continue
+
+            depth -= 1
+            # the organism of the entry, not of e.g. a reference
+            if depth == 2 and elem.tag == ORGANISM_TAG and entry is not None:
+                return parse_entry_element(entry)
+
+    parser.close()
+    if entry is None:
+        raise UniProtError("No entry in UniProt XML")
+
+    return parse_entry_element(entry)
+
+
+def parse_entry_element(entry: ET.Element) -> Dict:
+    """Extracts the fields of the index document from a UniProt XML entry
+
+    Args:
+        entry (ET.Element): An <entry> element
+
+    Returns:
+        Dict: See parse_uniprot_entry()
+    """
+    ac_id = entry.find(f"{NAMESPACE}name").text
+    description = entry.find(
+        f"{NAMESPACE}protein/{NAMESPACE}recommendedName/{NAMESPACE}fullName"
+    )
+    if description is None:
+        description = entry.find(
+            f"{NAMESPACE}protein/{NAMESPACE}submittedName/{NAMESPACE}fullName"
+        )
+    gene = entry.find(f"{NAMESPACE}gene/{NAMESPACE}name")
+    scientific_name = entry.find(f"{NAMESPACE}organism/{NAMESPACE}name").text
+    tax_id = entry.find(f"{NAMESPACE}organism/{NAMESPACE}dbReference").attrib.get("id")
+
+    return {
+        "mappingId": ac_id,
+        "mappingDescription": description.text,
+        "gene": gene.text if gene is not None else None,
+        "organismScientificName": scientific_name,
+        "taxId": int(tax_id),
+    }
+
+
+class UniProtCache:
+    """Cache of the UniProt fields of the index documents, keyed by accession
+
+    Entries are kept in memory for the lifetime of the process and, if a path
+    is given, in a SQLite database shared by all the processes of a run and
+    across runs. Entries older than the TTL are revalidated with a conditional
+    request (ETag / Last-Modified) and served stale if UniProt can not be
+    reached.
+    """
+
+    path: Optional[str]
+    ttl: float
+    refresh: bool
+
+    def __init__(
+        self, path: Optional[str] = None, ttl: Optional[float] = None, refresh=False
+    ) -> None:
+        self.path = path
+        self.ttl = get_default_ttl() if ttl is None else ttl
+        self.refresh = refresh
+        self._memory: Dict[str, Dict] = {}
+        # connections and sessions must not be shared with forked workers, so
+        # they are created lazily and recreated in a different process
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._session: Optional["requests.Session"] = None
+        self._session_pid: Optional[int] = None
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        if self.path is None:
+            return None
+
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uniprot ("
+                "accession TEXT PRIMARY KEY, data TEXT, etag TEXT, "
+                "last_modified TEXT, fetched REAL)"
+            )
+            self._conn.commit()
+            self._conn_pid = os.getpid()
+
+        return self._conn
+
+    def get(self, accession: str) -> Optional[Dict]:
+        """Returns the UniProt fields of an accession
+
+        Args:
+            accession (str): A UniProt accession
+
+        Returns:
+            Optional[Dict]: The fields, empty if the accession is not in
+                UniProt, None if it could not be fetched.
+        """
+        if accession in self._memory:
+            counters.increment(HITS)
+            return self._memory[accession]
+
+        row = self.read(accession)
+        if self.is_fresh(row):
+            counters.increment(HITS)
+            return self._remember(accession, row[0])
+
+        try:
+            response = self._fetch(accession, row)
+        except Exception as e:
+            if row:
+                LOG.warning(f"Using cached UniProt data for {accession} (err:{e})")
+                counters.increment(STALE)
+                return self._remember(accession, row[0])
+
+            LOG.error(f"Error in fetching UniProt XML for {accession}! (err:{e})")
+            counters.increment(ERRORS)
+            return None
+
+        return self._remember(accession, self.store(accession, row, *response))
+
+    def is_fresh(self, row: Optional[Tuple]) -> bool:
+        """Checks if a cached entry can be used without revalidation"""
+        return bool(row) and not self.refresh and time.time() - row[3] < self.ttl
+
+    def store(
+        self,
+        accession: str,
+        row: Optional[Tuple],
+        status: int,
+        data: Dict,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> Dict:
+        """Stores a fetched entry, a 304 response renews the cached row
+
+        Returns:
+            Dict: The fields of the entry
+        """
+        if status == 304:
+            counters.increment(REVALIDATED)
+            data, etag, last_modified = row[0], row[1] or etag, row[2] or last_modified
+        else:
+            counters.increment(MISSES)
+
+        self._write(accession, data, etag, last_modified)
+
+        return data
+
+    def close(self):
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        if self._session is not None and self._session_pid == os.getpid():
+            self._session.close()
+        self._conn = None
+        self._session = None
+
+    def _fetch(
+        self, accession: str, row: Optional[Tuple]
+    ) -> Tuple[int, Dict, Optional[str], Optional[str]]:
+        if self._session is None or self._session_pid != os.getpid():
+            import requests
+
+            self._session = requests.Session()
+            self._session_pid = os.getpid()
+
+        url = get_url(accession)
+        response = self._session.get(
+            url, headers=conditional_headers(row), timeout=REQUEST_TIMEOUT
+        )
+        LOG.info(f"Received {url} ({response.status_code})")
+
+        return parse_response(response.status_code, response.headers, response.content)
+
+    def read(self, accession: str) -> Optional[Tuple]:
+        """Returns the cached (fields, ETag, Last-Modified, fetched time)"""
+        if self.conn is None:
+            return None
+
+        row = self.conn.execute(
+            "SELECT data, etag, last_modified, fetched FROM uniprot "
+            "WHERE accession = ?",
+            (accession,),
+        ).fetchone()
+
+        return (json.loads(row[0]),) + row[1:] if row else None
+
+    def _write(
+        self,
+        accession: str,
+        data: Dict,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ):
+        if self.conn is None:
+            return
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO uniprot "
+                "(accession, data, etag, last_modified, fetched) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (accession, json.dumps(data), etag, last_modified, time.time()),
+            )
+
+    def _remember(self, accession: str, data: Dict) -> Dict:
+        if len(self._memory) >= MAX_MEMORY_ENTRIES:
+            self._memory.clear()
+        self._memory[accession] = data
+
+        return data
+
+
+class UniProtIndex(ReadOnlyIndex):
+    """Read-only lookup of the UniProt fields in a local index
+
+    The index is built from a UniProtKB dump by the build-uniprot-index
+    command and maps accessions (primary and secondary) and entry names to the
+    fields of the index documents. All the workers share the memory mapped
+    pages of the file.
+    """
+
+    def get(self, key: str) -> Dict:
+        """Returns the UniProt fields of an accession or entry name
+
+        Args:
+            key (str): A UniProt accession or entry name
+
+        Returns:
+            Dict: The fields, empty if the key is not in the index
+        """
+        row = self.conn.execute(
+            "SELECT e.data FROM keys k JOIN entries e ON e.id = k.entry "
+            "WHERE k.key = ?",
+            (key.upper(),),
+        ).fetchone()
+        if row is None:
+            counters.increment(INDEX_MISSES)
+            return {}
+
+        counters.increment(INDEX_HITS)
+        return json.loads(row[0])
+
+
+# one cache per process, see configure_cache()
+_cache = UniProtCache()
+_index: Optional[UniProtIndex] = None
+
+
+def configure_cache(
+    path: Optional[str] = None,
+    ttl: Optional[float] = None,
+    refresh: bool = False,
+    index_path: Optional[str] = None,
+):
+    """Sets up the UniProt cache of the current process
+
+    Passed as the scheduler initializer so that every worker uses the same
+    settings.
+
+    Args:
+        path (str, optional): SQLite file to keep the cache in across processes
+            and runs, in memory only if not given
+        ttl (float, optional): Seconds after which an entry is revalidated,
+            defaults to UNIPROT_CACHE_TTL_DAYS in conf.ini
+        refresh (bool): Revalidate all the entries read from the cache file
+        index_path (str, optional): Local UniProt index, if given accessions
+            are resolved against it instead of UniProt
+    """
+    global _cache, _index
+    _cache.close()
+    _cache = UniProtCache(path, ttl, refresh)
+    if _index is not None:
+        _index.close()
+    _index = UniProtIndex(index_path) if index_path else None
+
+
+def get_uniprot_info(accession: str) -> Optional[Dict]:
+    """Returns the UniProt fields of an accession from the process cache, or
+    the local index if one is configured"""
+    if _index is not None:
+        return _index.get(accession)
+
+    return _cache.get(accession)
+
+
+def collect_accessions(metadata_path: str) -> Set[str]:
+    """Returns the distinct UniProt accessions of a directory of metadata JSONs"""
+    accessions = set()
+    for metadata_file in layout.iter_files(metadata_path, ".json"):
+        try:
+            with fileio.open_file(metadata_file, "rt") as fh:
+                metadata = json.load(fh)
+        except Exception as e:
+            LOG.warning(f"Can not read {metadata_file} (err:{e})")
+            continue
+        if metadata.get("mappingAccessionType") == "uniprot":
+            accessions.add(metadata.get("mappingAccession"))
+
+    accessions.discard(None)
+
+    return accessions
+
+
+class RateLimiter:
+    """Pauses all the requests of a prefetch when UniProt asks to slow down"""
+
+    def __init__(self) -> None:
+        self.resume_at = 0.0
+
+    def pause(self, delay: float):
+        self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+    async def wait(self):
+        while time.monotonic() < self.resume_at:
+            await asyncio.sleep(self.resume_at - time.monotonic())
+
+
+def import_aiohttp():
+    """Returns the aiohttp module, only needed to prefetch entries, None if it
+    is not installed"""
+    try:
+        import aiohttp
+    except ImportError:  # pragma: no cover
+        return None
+
+    return aiohttp
+
+
+async def fetch_async(
+    session, accession: str, row: Optional[Tuple], limiter: RateLimiter
+) -> Tuple[int, Dict, Optional[str], Optional[str]]:
+    """Fetches an entry, retrying with backoff on errors and rate limiting
+
+    A Retry-After header sets the delay before the next attempt, on a 429
+    response all the other requests wait as well.
+    """
+    aiohttp = import_aiohttp()
+    error = None
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.wait()
+        delay = None
+        try:
+            async with session.get(
+                get_url(accession), headers=conditional_headers(row)
+            ) as response:
+                content = await response.read()
+                if response.status not in RETRY_STATUSES:
+                    return parse_response(response.status, response.headers, content)
+
+                error = f"HTTP {response.status}"
+                delay = get_retry_after(response.headers)
+                if response.status == 429:
+                    limiter.pause(delay if delay is not None else get_backoff(attempt))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = f"{type(e).__name__}: {e}"
+
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(delay if delay is not None else get_backoff(attempt))
+
+    raise UniProtError(error)
+
+
+async def _prefetch(todo: List[Tuple[str, Optional[Tuple]]], cache: UniProtCache):
+    aiohttp = import_aiohttp()
+    connector = aiohttp.TCPConnector(limit=int(get_config("api", "SIZE_POOL_AIOHTTP")))
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    limiter = RateLimiter()
+    pending = iter(todo)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def worker():
+            for accession, row in pending:
+                try:
+                    response = await fetch_async(session, accession, row, limiter)
+                except Exception as e:
+                    LOG.error(
+                        f"Error in fetching UniProt XML for {accession}! (err:{e})"
+                    )
+                    counters.increment(ERRORS)
+                    continue
+                cache.store(accession, row, *response)
+
+        # the workers share the iterator, so at most ASYNCIO_SEMAPHORE_COUNT
+        # requests are in flight
+        await asyncio.gather(
+            *(
+                worker()
+                for _ in range(int(get_config("api", "ASYNCIO_SEMAPHORE_COUNT")))
+            )
+        )
+
+
+def prefetch(
+    accessions: Iterable[str], cache: Optional[UniProtCache] = None
+) -> Dict[str, int]:
+    """Fetches the accessions missing or stale in the cache concurrently
+
+    Args:
+        accessions (Iterable[str]): UniProt accessions
+        cache (UniProtCache, optional): Cache to fill, defaults to the cache of
+            this process. It should be backed by a file for the workers to read
+            the prefetched entries.
+
+    Returns:
+        Dict[str, int]: Counts of fetched, revalidated and failed entries
+    """
+    cache = cache or _cache
+    if import_aiohttp() is None:  # pragma: no cover
+        LOG.warning("aiohttp is not installed, UniProt entries are not prefetched")
+        return {}
+
+    todo = []
+    for accession in sorted(set(accessions)):
+        row = cache.read(accession)
+        if not cache.is_fresh(row):
+            todo.append((accession, row))
+
+    LOG.info(f"Prefetching {len(todo)} UniProt entries")
+    counters.drain()
+    asyncio.run(_prefetch(todo, cache))
+
+    counts = counters.drain()
+    for name, value in sorted(counts.items()):
+        LOG.info(f"prefetch {name}: {value}")
+
+    return counts
+
+
+def prepare_cache(
+    path: Optional[str] = None,
+    ttl: Optional[float] = None,
+    refresh: bool = False,
+    prefetch_from: Optional[str] = None,
+    index_path: Optional[str] = None,
+) -> Tuple:
+    """Configures the cache of this process and prefetches the UniProt entries
+
+    Args:
+        path (str, optional): SQLite file of the cache, see configure_cache()
+        ttl (float, optional): Seconds after which an entry is revalidated
+        refresh (bool): Revalidate all the cached entries
+        prefetch_from (str, optional): Directory of metadata JSONs, the entries
+            of all the accessions in it are fetched before returning. Without
+            a cache file, a temporary one is used for the run.
+        index_path (str, optional): Local UniProt index, nothing is fetched
+            from UniProt if given
+
+    Returns:
+        Tuple: Arguments of configure_cache() for the workers
+    """
+    if index_path:
+        LOG.info(f"Resolving UniProt accessions against {index_path}")
+    elif (
+        prefetch_from and os.path.isdir(prefetch_from) and import_aiohttp() is not None
+    ):
+        if path is None:
+            temp_dir = tempfile.mkdtemp(prefix="uniprot-cache-")
+            atexit.register(shutil.rmtree, temp_dir, True)
+            path = os.path.join(temp_dir, "uniprot.sqlite")
+
+        configure_cache(path, ttl, refresh)
+        prefetch(collect_accessions(prefetch_from))
+        # the entries have just been revalidated
+        refresh = False
+
+    configure_cache(path, ttl, refresh, index_path)
+
+    return path, ttl, refresh, index_path
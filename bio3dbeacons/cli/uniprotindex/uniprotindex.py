@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+from bio3dbeacons.cli import fileio
+from bio3dbeacons.cli.sqliteindex import build_index
+from bio3dbeacons.cli.uniprot import NAMESPACE, parse_entry_element
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_XML = "xml"
+FORMAT_FLAT = "flat"
+FORMATS = {".xml": FORMAT_XML, ".dat": FORMAT_FLAT, ".txt": FORMAT_FLAT}
+
+BATCH_SIZE = 10000
+PROGRESS_INTERVAL = 1000000
+
+# (accessions, primary accession first, and the fields of the entry)
+Entry = Tuple[List[str], Dict]
+
+EVIDENCE = re.compile(r"\s*\{[^}]*\}")
+DESCRIPTION = re.compile(r"(RecName|SubName): Full=([^;]*);")
+GENE_NAME = re.compile(r"Name=([^;]*);")
+TAX_ID = re.compile(r"NCBI_TaxID=(\d+)")
+
+
+def get_format(path: str) -> Optional[str]:
+    """Returns the format of a UniProtKB dump detected from its extension"""
+    base, _ = fileio.split_compression_ext(path)
+
+    return FORMATS.get(os.path.splitext(base)[1].lower())
+
+
+def iter_xml_entries(fh: IO) -> Iterator[Entry]:
+    """Streams the entries of a UniProtKB XML dump
+
+    Parsed entries are removed from the tree, so memory use does not grow
+    with the size of the dump.
+    """
+    root = None
+    for event, elem in ET.iterparse(fh, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event != "end" or elem.tag != f"{NAMESPACE}entry":
+            continue
+
+        accessions = [x.text for x in elem.findall(f"{NAMESPACE}accession")]
+        try:
+            yield accessions, parse_entry_element(elem)
+        except (AttributeError, TypeError, ValueError) as e:
+            LOG.warning(f"Skipping UniProt entry {accessions[:1]} (err:{e})")
+        root.clear()
+
+
+def get_scientific_name(organism: str) -> str:
+    """Returns the scientific name of an OS line, without the common names
+
+    Parenthesised strain, isolate or subspecies qualifiers are part of the
+    scientific name and start with a lowercase word, common names and synonyms
+    start with an uppercase one, e.g. "Homo sapiens (Human)".
+    """
+    name = organism.strip().rstrip(".")
+    while name.endswith(")"):
+        depth = 0
+        for i in range(len(name) - 1, -1, -1):
+            depth += {")": 1, "(": -1}.get(name[i], 0)
+            if depth == 0:
+                break
+        group = name[i + 1 : -1]
+        if i == 0 or not group[:1].isupper():
+            break
+        name = name[:i].rstrip()
+
+    return name
+
+
+def parse_flat_entry(lines: Dict[str, List[str]]) -> Entry:
+    """Extracts the fields of the index document from a flat file entry
+
+    Args:
+        lines (Dict[str, List[str]]): Line contents of an entry by line code
+
+    Returns:
+        Entry: The accessions and fields of the entry
+    """
+    accessions = [x.strip() for x in " ".join(lines["AC"]).split(";") if x.strip()]
+    descriptions = dict(
+        (kind, EVIDENCE.sub("", name))
+        for kind, name in reversed(DESCRIPTION.findall(" ".join(lines["DE"])))
+    )
+    gene = GENE_NAME.search(" ".join(lines.get("GN", [])))
+
+    return accessions, {
+        "mappingId": lines["ID"][0].split()[0],
+        "mappingDescription": descriptions.get("RecName", descriptions.get("SubName")),
+        "gene": EVIDENCE.sub("", gene.group(1)) if gene else None,
+        "organismScientificName": get_scientific_name(" ".join(lines["OS"])),
+        "taxId": int(TAX_ID.search(" ".join(lines["OX"])).group(1)),
+    }
+
+
+def iter_flat_entries(fh: IO) -> Iterator[Entry]:
+    """Streams the entries of a UniProtKB flat file (.dat) dump"""
+    lines: Dict[str, List[str]] = {}
+    for line in fh:
+        code = line[:2]
+        if code == "//":
+            try:
+                yield parse_flat_entry(lines)
+            except (AttributeError, KeyError, IndexError, ValueError) as e:
+                LOG.warning(
+                    f"Skipping UniProt entry {lines.get('AC', [])[:1]} (err:{e})"
+                )
+            lines = {}
+        elif code in ("ID", "AC", "DE", "GN", "OS", "OX"):
+            lines.setdefault(code, []).append(line[5:].rstrip())
+
+
+def iter_entries(dump_path: str) -> Iterator[Entry]:
+    """Streams the entries of a UniProtKB XML or flat file dump, plain or
+    compressed"""
+    dump_format = get_format(dump_path)
+    if dump_format == FORMAT_XML:
+        with fileio.open_file(dump_path, "rb") as fh:
+            yield from iter_xml_entries(fh)
+    else:
+        with fileio.open_file(dump_path, "rt") as fh:
+            yield from iter_flat_entries(fh)
+
+
+def build(dump_path: str, output_index_path: str, batch_size: int = BATCH_SIZE) -> int:
+    """Builds a UniProt index from a UniProtKB dump
+
+    The index is written to a temporary file and moved in place once complete,
+    so readers never see a partial index.
+
+    Args:
+        dump_path (str): Path to the UniProtKB XML or flat file dump
+        output_index_path (str): Path to the index (SQLite)
+        batch_size (int): Number of entries inserted at once
+
+    Returns:
+        int: Number of entries in the index
+    """
+    entries: List[Tuple[int, str]] = []
+    primary_keys: List[Tuple[str, int]] = []
+    secondary_keys: List[Tuple[str, int]] = []
+
+    with build_index(output_index_path) as conn:
+        conn.execute("CREATE TABLE entries (id INTEGER PRIMARY KEY, data TEXT)")
+        conn.execute(
+            "CREATE TABLE keys (key TEXT PRIMARY KEY, entry INTEGER) WITHOUT ROWID"
+        )
+
+        def flush():
+            conn.executemany("INSERT INTO entries VALUES (?, ?)", entries)
+            # a primary accession wins over the secondary accession of another
+            # entry, whichever comes first in the dump
+            conn.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?)", primary_keys)
+            conn.executemany("INSERT OR IGNORE INTO keys VALUES (?, ?)", secondary_keys)
+            entries.clear()
+            primary_keys.clear()
+            secondary_keys.clear()
+
+        count = 0
+        for accessions, data in iter_entries(dump_path):
+            count += 1
+            entries.append((count, json.dumps(data, separators=(",", ":"))))
+            primary_keys.append((accessions[0].upper(), count))
+            primary_keys.append((data["mappingId"].upper(), count))
+            secondary_keys.extend((x.upper(), count) for x in accessions[1:])
+            if len(entries) >= batch_size:
+                flush()
+            if count % PROGRESS_INTERVAL == 0:
+                LOG.info(f"Indexed {count} UniProt entries")
+        flush()
+
+    return count
+
+
+def run(dump_path: str, output_index_path: str) -> int:
+    """Builds a UniProt index for offline enrichment of the index documents
+
+    Args:
+        dump_path (str): Path to a UniProtKB XML (.xml) or flat file (.dat)
+            dump, optionally gzip or zstd compressed
+        output_index_path (str): Path to the index (SQLite)
+
+    Returns:
+        int: 0 if the index was built, 1 otherwise
+    """
+    if not os.path.isfile(dump_path):
+        LOG.error(f"{dump_path} not found!")
+        return 1
+
+    if get_format(dump_path) is None:
+        LOG.error(f"Unknown format of {dump_path}, expected .xml or .dat")
+        return 1
+
+    try:
+        count = build(dump_path, output_index_path)
+    except Exception as e:
+        LOG.error(f"Error in building UniProt index from {dump_path}! (err:{e})")
+        return 1
+
+    LOG.info(f"Indexed {count} UniProt entries in {output_index_path}")
+
+    return 0
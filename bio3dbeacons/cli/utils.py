@@ -1,43 +1,38 @@
 import json
 import logging
 import xml.etree.ElementTree as ET
-from typing import Any, Dict
-
-import requests
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Set
 
+from bio3dbeacons.cli.fileio import open_file
 from bio3dbeacons.config.config import get_config, get_config_keys
 
 LOG = logging.getLogger(__name__)
 
+# categories read by prepare_data_dictionary_from_cif()
+INDEX_CIF_CATEGORIES = ("_entry", "_exptl", "_entity", "_struct_asym")
+# first characters of the CIF lines read_cif_categories() needs to look at
+CIF_CONTROL_CHARS = frozenset((b"_", b";", b"l", b"L", b"d", b"D"))
+
 
 def get_avg_plddt_from_pdb(pdb_path) -> float:
     """Returns the average pLDDT score from PDB file (from temp factor)
 
     Args:
-        pdb_path: Path to PDB file
+        pdb_path: Path to PDB file, may be compressed (.gz, .zst)
 
+    Raises:
+        ValueError: If the file has no ATOM records with a temp factor
     """
+    # imported here as the confidence module reads CIF files with this one
+    from bio3dbeacons.cli.confidence import read_pdb_confidence
 
-    # ATOM      1  N   GLU A   1       0.599  -0.769  -0.906  1.00  6.85           N
-
-    plddt_total = 0
-    residue_count = 0
-    current_res_seq_num = None
-    with open(f"{pdb_path}", "r") as fh:
-        for line in fh:
-            if not line.startswith("ATOM"):
-                continue
-            res_seq_num = int(line[22:26].strip())
-            temperature_factor = float(line[60:66].strip())
-
-            if current_res_seq_num != res_seq_num:
-                current_res_seq_num = res_seq_num
-                plddt_total += temperature_factor
-                residue_count += 1
+    confidence = read_pdb_confidence(f"{pdb_path}")
+    if confidence.average is None:
+        raise ValueError(f"No ATOM records with a temp factor in {pdb_path}")
+    avg_plddt = "{:.2f}".format(confidence.average)
 
-    avg_plddt = "{:.2f}".format(plddt_total / residue_count)
-
-    LOG.info(f"residues: {residue_count}")
+    LOG.info(f"residues: {len(confidence.per_residue)}")
     LOG.info(f"avg_plddt: {avg_plddt}")
 
     return avg_plddt
@@ -76,6 +71,80 @@ def prepare_data_dictionary_from_cif(cif_block: Any) -> Dict:
     return data_dict
     
 
+def get_index_cif_categories() -> Set[str]:
+    """Returns the CIF categories needed to build an index document, those of
+    prepare_data_dictionary_from_cif() and of the cif_json_mapping in conf.ini
+    """
+    categories = set(INDEX_CIF_CATEGORIES)
+    for key in get_config_keys("cif_json_mapping"):
+        categories.add(get_config("cif_json_mapping", key).split(".")[0].lower())
+
+    return categories
+
+
+def read_cif_categories(cif_path: str, categories: Iterable[str]) -> str:
+    """Returns the first data block of a CIF file reduced to some categories
+
+    Lines of the other categories, e.g. the _atom_site loop, are skipped
+    without being tokenized, and reading stops once all the categories have
+    been read (each category is contiguous in mmCIF). The result can be read
+    with gemmi.cif.read_string().
+
+    Args:
+        cif_path (str): Path to the CIF file, may be compressed (.gz, .zst)
+        categories (Iterable[str]): Category names, e.g. "_entity"
+
+    Returns:
+        str: CIF text with the data block header and the categories
+    """
+    wanted = set(x.encode().lower() for x in categories)
+    seen = set()
+    lines = []
+    keep = False
+    loop_start = False
+    in_text = False
+    block_found = False
+
+    with open_file(cif_path, "rb") as fh:
+        for line in fh:
+            if line[:1] not in CIF_CONTROL_CHARS:
+                # most lines are values, e.g. the rows of the _atom_site loop
+                if keep:
+                    lines.append(line)
+                continue
+
+            if in_text:
+                # inside a multi-line text field, which ends with a ';' line
+                in_text = not line.startswith(b";")
+            elif line.startswith(b";"):
+                in_text = True
+            elif line.startswith(b"_") and b"." in line.split(None, 1)[0]:
+                # a tag, unlike values starting with '_' mmCIF tags have a dot
+                category = line.split(b".", 1)[0].lower()
+                if category not in wanted and seen == wanted:
+                    break
+                keep = category in wanted
+                if keep:
+                    seen.add(category)
+                    if loop_start:
+                        lines.append(b"loop_\n")
+                loop_start = False
+            elif line[:5].lower() == b"loop_":
+                keep = False
+                loop_start = True
+            elif line[:5].lower() == b"data_":
+                if block_found:
+                    break
+                block_found = True
+                keep = False
+                lines.append(line)
+
+            if keep:
+                lines.append(line)
+
+    return b"".join(lines).decode("utf-8")
+
+
 def prepare_data_dictionary(cif_block: Any, config_section: str) -> Dict:
     """Returns a Python object from a CIF block (read by GEMMI) from a config
 
@@ -106,6 +175,8 @@ def get_uniprot_xml(accession: str) -> ET.Element:
         ET.Element: An XML element
     """
 
+    import requests
+
     uniprot_xml_url = get_config("cli", "UNIPROT_XML_URL")
 
     try:
@@ -123,9 +194,20 @@ def prepare_data_dictionary_from_json(json_file: str):
     """Gets a Python object from a JSON file
 
     Args:
-        json_file (str): Path to the JSON file
+        json_file (str): Path to the JSON file, may be compressed (.gz, .zst)
 
     Returns:
         [Any]: A Python object
     """
-    return json.load(open(json_file, "r"))
+    with open_file(json_file, "rt") as fh:
+        return json.load(fh)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Lazily splits an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
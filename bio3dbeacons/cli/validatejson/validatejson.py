@@ -1,12 +1,18 @@
 import json
 import logging
-import multiprocessing
 import os
-from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional
 
-import jsonschema
-from jsonschema.exceptions import ValidationError
+from jsonschema.exceptions import ValidationError, best_match
+from jsonschema.protocols import Validator
+from jsonschema.validators import validator_for
+
+from bio3dbeacons.cli import layout
+from bio3dbeacons.cli.constants import DEFAULT_MAX_ERRORS
+from bio3dbeacons.cli.jsonl import INDEX_EXTENSIONS, iter_documents
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.utils import chunked
 
 LOG = logging.getLogger(__name__)
 
@@ -14,58 +20,343 @@ RESOURCES_PATH = (
     Path(__file__).parent.parent.parent.parent / "resources").as_posix()
 
 
+def get_rule(error: ValidationError) -> str:
+    """Returns the schema rule an error breaks, e.g. properties/start/type"""
+    return "/".join(str(x) for x in error.absolute_schema_path) or "(root)"
+
+
+class ValidationReport:
+    """Aggregated results of validating many documents
+
+    Invalid documents are counted per schema rule they break, and the first
+    max_errors errors of every rule are kept. Reports of the workers are merged into the
+    report of the run.
+
+    Args:
+        max_errors (int): Number of errors kept per rule
+    """
+
+    documents: int
+    invalid: int
+    max_errors: int
+    rules: Dict[str, int]
+    errors: Dict[str, List[str]]
+
+    def __init__(self, max_errors: int = DEFAULT_MAX_ERRORS) -> None:
+        self.documents = 0
+        self.invalid = 0
+        self.max_errors = max_errors
+        self.rules = {}
+        self.errors = {}
+
+    @property
+    def valid(self) -> int:
+        return self.documents - self.invalid
+
+    @property
+    def exit_status(self) -> int:
+        return 1 if self.invalid else 0
+
+    def add(self, name: str, errors: List[ValidationError]):
+        self.documents += 1
+        if not errors:
+            return
+
+        self.invalid += 1
+        broken = {}
+        for error in errors:
+            broken.setdefault(get_rule(error), []).append(error.message)
+        for rule, messages in broken.items():
+            self.add_error(name, rule, messages)
+
+    def reject(self, rejected: "Rejected", rule: str):
+        """Counts a document which could not be validated, e.g. a file which
+        is not found or is not valid JSON, as invalid"""
+        self.documents += 1
+        self.invalid += 1
+        self.add_error(rejected.path, rule, [rejected.reason])
+
+    def add_error(self, name: str, rule: str, messages: List[str]):
+        self.rules[rule] = self.rules.get(rule, 0) + 1
+        kept = self.errors.setdefault(rule, [])
+        for message in messages[: self.max_errors - len(kept)]:
+            kept.append(f"{name}: {message}")
+
+    def merge(self, other: "ValidationReport"):
+        self.documents += other.documents
+        self.invalid += other.invalid
+        for rule, count in other.rules.items():
+            self.rules[rule] = self.rules.get(rule, 0) + count
+            kept = self.errors.setdefault(rule, [])
+            kept.extend(other.errors.get(rule, [])[: self.max_errors - len(kept)])
+
+    def to_dict(self) -> Dict:
+        return {
+            "documents": self.documents,
+            "valid": self.valid,
+            "invalid": self.invalid,
+            "rules": {
+                rule: {"count": count, "errors": self.errors.get(rule, [])}
+                for rule, count in sorted(self.rules.items())
+            },
+        }
+
+    def log(self):
+        LOG.info(
+            f"Validated {self.documents} documents: {self.valid} valid, "
+            f"{self.invalid} invalid"
+        )
+        for rule, count in sorted(self.rules.items(), key=lambda x: -x[1]):
+            LOG.error(f"{count} documents break {rule}, e.g.")
+            for error in self.errors.get(rule, []):
+                LOG.error(f"  {error}")
+
+
+class Rejected:
+    """An index document which is not valid, sent back by the workers instead
+    of their result
+
+    Args:
+        path (str): The file the document was built from
+        reason (str): Why the document is not valid
+        document (Dict): The document
+    """
+
+    path: str
+    reason: str
+    document: Dict
+
+    def __init__(self, path: str, reason: str, document: Dict) -> None:
+        self.path = path
+        self.reason = reason
+        self.document = document
+
+
+class RejectWriter:
+    """Writes rejected documents, with the reason, to a JSON Lines file
+
+    The file is rewritten on every run, models rejected again are listed
+    again. Without a path rejected documents are only logged and counted.
+
+    Args:
+        path (str, optional): Path to the reject file
+    """
+
+    path: Optional[str]
+    rejected: int
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.rejected = 0
+        self._fh = None
+
+    def write(self, rejected: Rejected):
+        self.rejected += 1
+        if not self.path:
+            return
+
+        if self._fh is None:
+            layout.ensure_parent(self.path)
+            self._fh = open(self.path, "w")
+        line = {
+            "path": rejected.path,
+            "reason": rejected.reason,
+            "document": rejected.document,
+        }
+        self._fh.write(f"{json.dumps(line)}\n")
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self.rejected:
+            where = f", written to {self.path}" if self.path else ""
+            LOG.error(f"Rejected {self.rejected} documents not valid{where}")
+
+    def __enter__(self) -> "RejectWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class ValidateJSON:
 
-    schema = json.load(open(f"{RESOURCES_PATH}/schema.json"))
+    # read and compiled on first use, once per process
+    _schema: Optional[Dict] = None
+    _validator: Optional[Validator] = None
+
+    @classmethod
+    def get_schema(cls) -> Dict:
+        if cls._schema is None:
+            with open(f"{RESOURCES_PATH}/schema.json") as fh:
+                cls._schema = json.load(fh)
+
+        return cls._schema
+
+    @classmethod
+    def get_validator(cls) -> Validator:
+        """Returns the validator of the schema
+
+        jsonschema.validate() checks the schema and builds a validator on every
+        call, the schema is checked once here and the validator reused.
+        """
+        if cls._validator is None:
+            schema = cls.get_schema()
+            validator_class = validator_for(schema)
+            validator_class.check_schema(schema)
+            cls._validator = validator_class(schema)
+
+        return cls._validator
+
+    @classmethod
+    def reject(cls, index: Dict, name: str) -> Optional[Rejected]:
+        """Checks an index document already in memory
+
+        Args:
+            index (Dict): The index document
+            name (str): The file the document was built from
+
+        Returns:
+            Optional[Rejected]: None if the document is valid
+        """
+        error = best_match(cls.get_validator().iter_errors(index))
+        if error is None:
+            return None
+
+        reason = f"{error.json_path}: {error.message}"
+        LOG.error(f"{name} not valid!\nExtra info: {reason}")
+
+        return Rejected(name, reason, index)
 
     @classmethod
-    def validate(cls, index_json) -> bool:
+    def validate(cls, index_json, report: Optional[ValidationReport] = None) -> bool:
+        """Validates an index JSON file, or all the documents of a JSON Lines
+        shard
+
+        Args:
+            index_json (str): Path to the file
+            report (ValidationReport, optional): Report the results are added to
 
+        Returns:
+            bool: True if all the documents are valid
+        """
         if not os.path.exists(index_json):
             LOG.error(f"{index_json} not found!")
+            if report is not None:
+                report.reject(Rejected(index_json, "not found", {}), "(file)")
             return False
 
-        index = json.load(open(index_json))
+        valid = True
+
+        def on_error(name: str, error: ValueError):
+            nonlocal valid
+            valid = False
+            LOG.error(f"{name} is not valid JSON: {error}")
+            if report is not None:
+                report.reject(Rejected(name, str(error), {}), "(json)")
+
+        for name, index in iter_documents(index_json, on_error):
+            valid = cls.validate_document(index, name, report) and valid
+
+        return valid
+
+    @classmethod
+    def validate_document(
+        cls, index: Dict, name: str, report: Optional[ValidationReport] = None
+    ) -> bool:
+        """Validates an index document already in memory
+
+        Args:
+            index (Dict): The index document
+            name (str): Name of the document in log messages
+            report (ValidationReport, optional): Report the result is added to
 
-        try:
-            jsonschema.validate(index, schema=cls.schema)
-            LOG.info(f"Validated {index_json}")
-        except ValidationError as e:
-            LOG.error(f"{index_json} not valid!\nExtra info: {e.message}")
+        Returns:
+            bool: True if the document is valid
+        """
+        errors = list(cls.get_validator().iter_errors(index))
+        if report is not None:
+            report.add(name, errors)
+        if errors:
+            LOG.error(f"{name} not valid!\nExtra info: {best_match(errors).message}")
             return False
 
+        LOG.debug(f"Validated {name}")
         return True
 
 
-def process(index_file_path: str):
-    return ValidateJSON.validate(index_file_path)
+def validate_files(
+    index_file_paths: Iterable[str], max_errors: int = DEFAULT_MAX_ERRORS
+) -> ValidationReport:
+    """Validates all the documents of the files
 
+    Returns:
+        ValidationReport: The results of all the documents, a file that can not
+            be found or a document which is not valid JSON counts as an invalid
+            document
+    """
+    report = ValidationReport(max_errors)
+    for index_file_path in index_file_paths:
+        ValidateJSON.validate(index_file_path, report)
+
+    return report
+
+
+def process(index_file_paths: List[str], max_errors: int = DEFAULT_MAX_ERRORS):
+    return validate_files(index_file_paths, max_errors)
 
-def run(index_json_path: str):  # pragma: no cover
+
+def run(
+    index_json_path: str,
+    scheduler: Optional[Scheduler] = None,
+    file_list: Optional[str] = None,
+    max_errors: int = DEFAULT_MAX_ERRORS,
+    report_path: Optional[str] = None,
+):  # pragma: no cover
     """Validates JSON documents before loading to Mongo
 
     Args:
-        index_json_path (str): Path to the index json file, if a directory is passed,
-            process all .json files inside it
+        index_json_path (str): Path to the index json file or JSON Lines shard,
+            if a directory is passed, process all .json and .jsonl files inside
+            it and its subdirectories
+        scheduler (Scheduler, optional): Runs the validations in directory mode,
+            defaults to one worker per available CPU.
+        file_list (str, optional): File listing the JSON files to validate
+            instead of walking index_json_path, "-" for stdin.
+        max_errors (int): Number of errors reported per schema rule
+        report_path (str, optional): File the report is written to as JSON
+
+    Returns:
+        int: 0 if all the documents are valid, 1 otherwise
     """
 
-    # if a directory is provided, convert all .pdb files in it
+    # if a directory is provided, validate all the files in it
     if os.path.isdir(index_json_path):
         LOG.info(f"Validating all json files in {index_json_path}")
 
-        with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count() + 1) as p:
-            for _, _, filenames in os.walk(index_json_path):
-                for index_file in list(
-                    filter(lambda x: x.endswith(".json"), filenames)
-                ):
-                    index_file_path = f"{index_json_path}/{index_file}"
-                    p.submit(process, index_file_path)
+        scheduler = scheduler or Scheduler()
+
+        def tasks():
+            # every task validates a chunk of files and sends back one report
+            files = layout.iter_files(index_json_path, INDEX_EXTENSIONS, file_list)
+            for index_files in chunked(files, scheduler.chunk_size):
+                yield (index_files, max_errors)
+
+        report = ValidationReport(max_errors)
+        summary = scheduler.run(
+            process, tasks(), on_result=lambda task, result: report.merge(result)
+        )
+        exit_status = summary.exit_status or report.exit_status
     else:
         LOG.info(f"Validating {index_json_path}")
 
-        if ValidateJSON.validate(index_json_path):
-            return 0
+        report = validate_files([index_json_path], max_errors)
+        exit_status = report.exit_status
 
-        return 1
+    report.log()
+    if report_path:
+        with open(report_path, "w") as fh:
+            json.dump(report.to_dict(), fh, indent=2)
 
-    return 0
+    return exit_status
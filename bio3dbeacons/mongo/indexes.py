@@ -0,0 +1,131 @@
+import logging
+from typing import Any, Dict, List
+
+import pymongo
+from pymongo import ASCENDING, IndexModel
+from pymongo.collection import Collection
+
+from bio3dbeacons.mongo.queries import API_QUERIES, SORTS
+
+LOG = logging.getLogger(__name__)
+
+# the indexes of modelCollection, one per sort order of the API queries and
+# field the entry is looked up by. The sort key follows the equality fields,
+# so the models are read in order and the scan stops at the limit, and the
+# residue range fields come last to filter the range within the index. The
+# unsorted queries use the equality prefix of either index
+INDEXES: List[IndexModel] = [
+    IndexModel(
+        [
+            (field, ASCENDING),
+            ("mappingAccessionType", ASCENDING),
+            *SORTS[sort],
+            ("start", ASCENDING),
+            ("end", ASCENDING),
+        ],
+        name=f"{field}_{sort}",
+    )
+    for field in ("mappingAccession", "mappingId")
+    for sort in SORTS
+]
+
+ID_INDEX = "_id_"
+COLLSCAN = "COLLSCAN"
+# sorting in memory, rather than reading an index in order
+SORT = "SORT"
+
+
+def ensure_indexes(collection: Collection, drop_unknown: bool = False) -> List[str]:
+    """Creates the declared indexes missing from a collection
+
+    Creating an index which exists with the same keys and options is a no-op,
+    so this can run after every load.
+
+    Args:
+        collection (Collection): Model collection
+        drop_unknown (bool): Drop the indexes which are not declared, e.g. the
+            text index of former versions
+
+    Returns:
+        List[str]: Names of the declared indexes
+    """
+    declared = [x.document["name"] for x in INDEXES]
+    if drop_unknown:
+        for name in collection.index_information():
+            if name != ID_INDEX and name not in declared:
+                LOG.info(f"Dropping index {name}")
+                collection.drop_index(name)
+
+    LOG.info(f"Creating indexes {', '.join(declared)}")
+    return collection.create_indexes(INDEXES)
+
+
+def find_stages(plan: Any, stage: str) -> List[Dict]:
+    """Returns the stages of a query plan of the given type, recursively"""
+    found = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            found.append(plan)
+        for value in plan.values():
+            found.extend(find_stages(value, stage))
+    elif isinstance(plan, list):
+        for value in plan:
+            found.extend(find_stages(value, stage))
+
+    return found
+
+
+def get_winning_plan(explanation: Dict) -> Dict:
+    planner = explanation.get("queryPlanner", {})
+    # the classic plan, or the one of the slot based engine
+    plan = planner.get("winningPlan", {})
+
+    return plan.get("queryPlan", plan)
+
+
+def check_queries(
+    collection: Collection, queries: Dict[str, Dict] = API_QUERIES
+) -> List[str]:
+    """Explains the queries of the API and reports the collection scans and
+    in-memory sorts
+
+    Args:
+        collection (Collection): Model collection
+        queries (Dict[str, Dict]): find() arguments by name
+
+    Returns:
+        List[str]: Names of the queries which are not answered by an index
+    """
+    scans = []
+    for name, query in queries.items():
+        plan = get_winning_plan(collection.find(**query).explain())
+        if find_stages(plan, COLLSCAN):
+            LOG.error(f"Query '{name}' scans {collection.name}: {query}")
+            scans.append(name)
+        elif find_stages(plan, SORT):
+            LOG.error(f"Query '{name}' sorts in memory: {query}")
+            scans.append(name)
+        else:
+            LOG.info(f"Query '{name}' uses an index")
+
+    return scans
+
+
+def run(mongo_db_url: str, drop_unknown: bool = False, check: bool = False) -> int:
+    """Creates the indexes of the model collection, optionally checking the
+    API queries use them
+
+    Args:
+        mongo_db_url (str): Mongo DB URL
+        drop_unknown (bool): Drop the indexes which are not declared
+        check (bool): Explain the API queries
+
+    Returns:
+        int: 1 if a query scans the collection, 0 otherwise
+    """
+    collection = pymongo.MongoClient(mongo_db_url).models.modelCollection
+    ensure_indexes(collection, drop_unknown=drop_unknown)
+    if check and check_queries(collection):
+        return 1
+
+    return 0
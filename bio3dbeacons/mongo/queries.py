@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import DESCENDING
+
+# mappingAccessionType of the models of UniProt entries
+UNIPROT = "uniprot"
+
+# orders of the models of a UniProt entry, by the sort parameter of the API.
+# Each one is served by its own indexes (see bio3dbeacons.mongo.indexes)
+SORTS: Dict[str, List[Tuple[str, int]]] = {
+    "coverage": [("coverage", DESCENDING)],
+    "created": [("createdDate", DESCENDING)],
+}
+
+
+def get_uniprot_summary_filter(
+    qualifier: str,
+    residue_start: Optional[int] = None,
+    residue_end: Optional[int] = None,
+) -> Dict:
+    """Returns the filter of the models of a UniProt entry
+
+    Every $or branch holds the whole predicate, so each is answered by its
+    own index (see bio3dbeacons.mongo.indexes).
+
+    Args:
+        qualifier (str): UniProt accession or entry name, e.g. P00520 or
+            ABL1_MOUSE
+        residue_start (int, optional): Only the models overlapping the residue
+            range from residue_start to residue_end
+        residue_end (int, optional): See residue_start
+
+    Returns:
+        Dict: The filter
+    """
+    branch = {"mappingAccessionType": UNIPROT}
+    # a model overlaps the range if it starts before its end and ends after
+    # its start
+    if residue_end is not None:
+        branch["start"] = {"$lte": residue_end}
+    if residue_start is not None:
+        branch["end"] = {"$gte": residue_start}
+
+    return {
+        "$or": [
+            {"mappingAccession": qualifier, **branch},
+            {"mappingId": qualifier, **branch},
+        ]
+    }
+
+
+def get_uniprot_summary_query(
+    qualifier: str,
+    residue_start: Optional[int] = None,
+    residue_end: Optional[int] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Dict:
+    """Returns the find() arguments of the models of a UniProt entry
+
+    Args:
+        qualifier (str): UniProt accession or entry name
+        residue_start (int, optional): Start of the residue range
+        residue_end (int, optional): End of the residue range
+        sort (str, optional): A key of SORTS, by default the models are not
+            sorted
+        limit (int, optional): Maximum number of models
+
+    Returns:
+        Dict: Keyword arguments of find()
+    """
+    query = {
+        "filter": get_uniprot_summary_filter(qualifier, residue_start, residue_end)
+    }
+    if sort:
+        query["sort"] = SORTS[sort]
+    if limit:
+        query["limit"] = limit
+
+    return query
+
+
+# the queries of the API, with a sample of their parameters, checked with
+# explain() against the indexes
+API_QUERIES: Dict[str, Dict] = {
+    "uniprot summary by accession": get_uniprot_summary_query("P38398"),
+    "uniprot summary by entry name": get_uniprot_summary_query("BRCA1_HUMAN"),
+    "uniprot summary of a range": get_uniprot_summary_query("P38398", 50, 120),
+    "uniprot summary by coverage": get_uniprot_summary_query(
+        "P38398", 50, 120, sort="coverage", limit=10
+    ),
+    "uniprot summary by created date": get_uniprot_summary_query(
+        "BRCA1_HUMAN", sort="created", limit=10
+    ),
+}
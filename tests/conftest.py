@@ -1,9 +1,16 @@
+import json
 import logging
+import re
 import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import parse_qs
 
 from prettyconf import config
 
+import mongomock
 import pymongo
 import pytest
 
@@ -11,7 +18,7 @@ import gemmi
 
 sys.path.append(Path(__file__).parent.parent.as_posix())
 
-from bio3dbeacons.cli.mongoload.mongoload import MongoLoad  # noqa
+from bio3dbeacons.cli.mongoload.mongoload import LIVE_COLLECTION, MongoLoad  # noqa
 
 MONGO_USERNAME = config("MONGO_USERNAME")
 MONGO_PASSWORD = config("MONGO_PASSWORD")
@@ -65,9 +72,118 @@ def mongo_collection(mongo_db):
     return mongo_db.modelCollection
 
 
+@pytest.fixture(scope="session")
+def live_mongo_collection(mongo_collection):
+    """The model collection, skips the tests needing a Mongo DB server without
+    one (mongomock can not explain queries)"""
+    client = pymongo.MongoClient(MONGO_DB_URL, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"No Mongo DB server at {MONGO_DB_HOST}")
+    finally:
+        client.close()
+
+    return mongo_collection
+
+
+@pytest.fixture
+def mock_mongo_db():
+    """An in-memory database, used by every MongoLoad created in the test"""
+    database = mongomock.MongoClient().models
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        # mongomock does not know the sort option of recent pymongo updates
+        return add_update(self, *args, **kwargs)
+
+    def init_collection(self, mongo_db_url):
+        self.database = database
+        self.collection = database[LIVE_COLLECTION]
+
+    with patch.object(MongoLoad, "init_collection", init_collection), patch.object(
+        mongomock.collection.BulkOperationBuilder,
+        "add_update",
+        add_update_without_sort,
+    ):
+        yield database
+
+
 @pytest.fixture(scope="session")
 def mongo_load(mongo_collection) -> MongoLoad:
     ml = MongoLoad()
     ml.collection = mongo_collection
 
     return ml
+
+
+def add_extra_uniprot_info(self):
+    # avoids calling UniProt, the documents are not valid without these fields
+    self.interim_entry.update(
+        mappingId="BRCA1_HUMAN",
+        mappingDescription="Breast cancer type 1 susceptibility protein",
+    )
+
+
+@pytest.fixture
+def offline_uniprot():
+    with patch(
+        "bio3dbeacons.cli.ciftojson.ciftojson.Cif2Json.add_extra_uniprot_info",
+        add_extra_uniprot_info,
+    ):
+        yield
+
+
+# mnemonics known to the local SPARQL endpoint
+SPARQL_MNEMONICS = {"SMP_YERPE": "Q8ZIQ1", "W5MWU3_LEPOC": "W5MWU3"}
+UNIPROT_URI = "http://purl.uniprot.org/uniprot/"
+
+
+class SparqlHandler(BaseHTTPRequestHandler):
+    """Answers the mnemonic queries of UniprotSparql like UniProt does"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        query = parse_qs(body)["query"][0]
+        self.server.queries.append(query)
+        values = re.search(r"VALUES \?mnemonic \{(.*?)\}", query).group(1)
+        bindings = [
+            {
+                "mnemonic": {"type": "literal", "value": name},
+                "protein": {
+                    "type": "uri",
+                    "value": UNIPROT_URI + SPARQL_MNEMONICS[name],
+                },
+            }
+            for name in re.findall(r"'(\w+)'", values)
+            if name in SPARQL_MNEMONICS
+        ]
+        content = json.dumps(
+            {
+                "head": {"vars": ["mnemonic", "protein"]},
+                "results": {"bindings": bindings},
+            }
+        ).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/sparql-results+json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sparql_server():
+    """Local stand-in for the UniProt SPARQL endpoint, its queries are
+    recorded in server.queries"""
+    server = HTTPServer(("127.0.0.1", 0), SparqlHandler)
+    server.queries = []
+    server.url = f"http://127.0.0.1:{server.server_port}/sparql"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -35,3 +35,33 @@ async def test_uniprot_summary_api(mongo_collection, metadata_file):
     mongo_collection.drop()
 
     assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        "range=100",
+        "range=a-b",
+        "range=120-50",
+        "range=1-2-3",
+        "range=-5",
+        "sort=size",
+        "limit=0",
+    ],
+)
+def test_uniprot_summary_invalid_params(params):
+    response = client.get(f"/uniprot/summary/P38398.json?{params}")
+
+    assert response.status_code in (
+        status.HTTP_400_BAD_REQUEST,
+        status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
+@pytest.mark.parametrize(
+    "res_range", ["1-2-3", "-5", "5-", "1.5-3", "²-3", "1-½", "١-2"]
+)
+def test_uniprot_summary_malformed_range(res_range):
+    response = client.get(f"/uniprot/summary/P38398.json?range={res_range}")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,169 @@
+import gzip
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from gemmi import cif
+
+from bio3dbeacons.cli import confidence, utils
+from bio3dbeacons.cli.ciftojson import ciftojson
+from bio3dbeacons.cli.ciftojson.ciftojson import Cif2Json
+from bio3dbeacons.cli.metadata_generators import pfam_baker
+
+MODEL_NAME = "P38398_1jm7.1.A_1_103"
+
+# PDB files without a residue score: no ATOM records, and ATOM records cut
+# before the B-factor column
+PDB_WITHOUT_SCORES = [
+    "",
+    "HETATM    1  O   HOH A   1      10.000  10.000  10.000  1.00 50.00\n",
+    "ATOM      1  N   MET A   1      10.000  10.000  10.000  1.00\n",
+]
+
+MODELCIF = """data_model
+loop_
+_ma_qa_metric.id
+_ma_qa_metric.name
+_ma_qa_metric.type
+1 pLDDT pLDDT
+2 PAE PAE
+#
+loop_
+_ma_qa_metric_local.ordinal_id
+_ma_qa_metric_local.label_seq_id
+_ma_qa_metric_local.metric_id
+_ma_qa_metric_local.metric_value
+1 1 2 1.5
+2 1 1 95.0
+3 2 1 75.0
+4 3 1 40.0
+5 4 1 60.0
+"""
+
+
+def legacy_avg_plddt(pdb_path):
+    """The per-line loop the engine replaces"""
+    total = count = 0
+    current = None
+    with open(pdb_path) as fh:
+        for line in fh:
+            if line.startswith("ATOM") and line[22:26] != current:
+                current = line[22:26]
+                total += float(line[60:66])
+                count += 1
+
+    return total / count
+
+
+class TestConfidence:
+    def test_pdb(self, data_dir):
+        pdb_path = data_dir / "pdb" / f"{MODEL_NAME}.pdb"
+        result = confidence.read_confidence(pdb_path.as_posix())
+
+        assert len(result.per_residue) == 103
+        assert result.average == pytest.approx(legacy_avg_plddt(pdb_path))
+        assert sum(result.bands().values()) == pytest.approx(1)
+
+    def test_compressed_pdb(self, data_dir):
+        pdb_path = data_dir / "pdb" / f"{MODEL_NAME}.pdb"
+        with tempfile.TemporaryDirectory() as d:
+            gz_path = Path(d) / f"{MODEL_NAME}.pdb.gz"
+            gz_path.write_bytes(gzip.compress(pdb_path.read_bytes()))
+
+            result = confidence.read_confidence(gz_path.as_posix())
+
+        expected = confidence.read_confidence(pdb_path.as_posix())
+        assert list(result.per_residue) == list(expected.per_residue)
+
+    def test_cif_matches_pdb(self, data_dir):
+        cif_result = confidence.read_confidence(
+            (data_dir / "cif" / f"{MODEL_NAME}.cif").as_posix()
+        )
+        pdb_result = confidence.read_confidence(
+            (data_dir / "pdb" / f"{MODEL_NAME}.pdb").as_posix()
+        )
+
+        assert list(cif_result.per_residue) == list(pdb_result.per_residue)
+
+    def test_modelcif_local_metric(self):
+        block = cif.read_string(MODELCIF).sole_block()
+        result = confidence.get_cif_block_confidence(block)
+
+        # only the pLDDT metric is used
+        assert list(result.per_residue) == [95.0, 75.0, 40.0, 60.0]
+        assert result.average == pytest.approx(67.5)
+        assert result.bands() == {
+            "veryLow": 0.25,
+            "low": 0.25,
+            "confident": 0.25,
+            "veryHigh": 0.25,
+        }
+
+    @pytest.mark.parametrize("full_cif", [False, True])
+    def test_cif2index_fills_missing_plddt(self, data_dir, full_cif):
+        cif_path = (data_dir / "cif" / f"{MODEL_NAME}.cif").as_posix()
+        converter = Cif2Json(cif_path, "", "", full_cif=full_cif)
+        converter.read_cif()
+        converter.interim_entry["confidenceType"] = "pLDDT"
+
+        converter.add_confidence()
+        assert converter.interim_entry["confidenceAvgLocalScore"] == 0.66
+
+        # the score of the metadata is kept
+        converter.interim_entry["confidenceAvgLocalScore"] = 98.76
+        converter.add_confidence()
+        assert converter.interim_entry["confidenceAvgLocalScore"] == 98.76
+
+    @pytest.mark.parametrize("confidence_type", [None, "QMEANDisCo"])
+    def test_cif2index_ignores_b_factors(self, data_dir, confidence_type):
+        cif_path = (data_dir / "cif" / f"{MODEL_NAME}.cif").as_posix()
+        converter = Cif2Json(cif_path, "", "")
+        converter.read_cif()
+        converter.interim_entry["confidenceType"] = confidence_type
+
+        # the atoms are not parsed to look for a QA metric
+        with patch.object(ciftojson, "read_cif_confidence", side_effect=AssertionError):
+            converter.add_confidence()
+        assert "confidenceAvgLocalScore" not in converter.interim_entry
+
+    def test_cif2index_uses_local_metric(self):
+        with tempfile.TemporaryDirectory() as d:
+            cif_path = Path(d) / "model.cif"
+            cif_path.write_text(MODELCIF)
+            converter = Cif2Json(cif_path.as_posix(), "", "")
+            converter.read_cif()
+            converter.interim_entry["confidenceType"] = "QMEANDisCo"
+
+            converter.add_confidence()
+
+        assert converter.interim_entry["confidenceAvgLocalScore"] == 67.5
+
+    def test_empty(self):
+        result = confidence.Confidence([])
+
+        assert result.average is None
+        assert sum(result.bands().values()) == 0
+
+    @pytest.mark.parametrize("content", PDB_WITHOUT_SCORES)
+    def test_pdb_without_scores(self, content):
+        with tempfile.TemporaryDirectory() as d:
+            pdb_path = Path(d) / "model.pdb"
+            pdb_path.write_text(content)
+            metadata_path = Path(d) / "model.json"
+
+            assert confidence.read_confidence(pdb_path.as_posix()).average is None
+            with pytest.raises(ValueError, match="No ATOM records"):
+                utils.get_avg_plddt_from_pdb(pdb_path)
+            assert (
+                pfam_baker.process(
+                    pdb_path.as_posix(),
+                    metadata_path.as_posix(),
+                    "P38398",
+                    1,
+                    103,
+                    "TEMPLATE-BASED",
+                )
+                == 1
+            )
+            assert not metadata_path.exists()
@@ -0,0 +1,86 @@
+import gzip
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli import fileio, layout
+from bio3dbeacons.cli.pdbtocif import pdbtocif
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.utils import get_avg_plddt_from_pdb
+
+PDB_NAME = "P38398_1jm7.1.A_1_103.pdb"
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as d:
+        yield Path(d)
+
+
+def compress(src: Path, dst: Path):
+    fileio.compress_file(src.as_posix(), dst.as_posix())
+
+
+class TestFileIO:
+    @pytest.mark.parametrize("ext", ["", ".gz", ".zst"])
+    def test_round_trip(self, temp_dir, ext):
+        if ext == ".zst":
+            pytest.importorskip("zstandard")
+        path = (temp_dir / f"model.json{ext}").as_posix()
+
+        fileio.write_text(path, '{"a": 1}\n', level=1)
+        assert fileio.read_text(path) == '{"a": 1}\n'
+        if ext == ".gz":
+            assert gzip.open(path, "rt").read() == '{"a": 1}\n'
+
+    def test_split_compression_ext(self):
+        assert fileio.split_compression_ext("a/model.cif.gz") == ("a/model.cif", ".gz")
+        assert fileio.split_compression_ext("model.cif") == ("model.cif", "")
+        assert fileio.compressed_path("model.cif", fileio.ZSTD) == "model.cif.zst"
+        assert layout.model_id_from_path("a/model.pdb.zst", ".pdb") == "model"
+        assert layout.has_ext("model.json.gz", ".json")
+
+    def test_plain_file(self, data_dir, temp_dir):
+        gz_file = temp_dir / f"{PDB_NAME}.gz"
+        compress(data_dir / "pdb" / PDB_NAME, gz_file)
+
+        with fileio.plain_file(gz_file.as_posix(), (fileio.GZIP,)) as path:
+            assert path == gz_file.as_posix()
+        with fileio.plain_file(gz_file.as_posix()) as path:
+            assert path.endswith(PDB_NAME)
+            assert Path(path).read_bytes() == (data_dir / "pdb" / PDB_NAME).read_bytes()
+
+    def test_avg_plddt_from_compressed_pdb(self, data_dir, temp_dir):
+        gz_file = temp_dir / f"{PDB_NAME}.gz"
+        compress(data_dir / "pdb" / PDB_NAME, gz_file)
+
+        assert get_avg_plddt_from_pdb(gz_file) == get_avg_plddt_from_pdb(
+            data_dir / "pdb" / PDB_NAME
+        )
+
+    @pytest.mark.parametrize("compression", [fileio.GZIP, fileio.ZSTD])
+    def test_pdbtocif_compressed(self, data_dir, temp_dir, compression):
+        if compression == fileio.ZSTD:
+            pytest.importorskip("zstandard")
+        pdb_dir = temp_dir / "pdb"
+        pdb_dir.mkdir()
+        compress(data_dir / "pdb" / PDB_NAME, pdb_dir / f"{PDB_NAME}.gz")
+
+        s = pdbtocif.run(
+            pdb_dir.as_posix(),
+            (temp_dir / "cif").as_posix(),
+            scheduler=Scheduler(jobs=1),
+            compression=compression,
+        )
+        assert s == 0
+
+        expected = temp_dir / "expected.cif"
+        assert (
+            pdbtocif.run((data_dir / "pdb" / PDB_NAME).as_posix(), expected.as_posix())
+            == 0
+        )
+
+        ext = fileio.EXTENSIONS[compression]
+        got = temp_dir / "cif" / f"{Path(PDB_NAME).stem}.cif{ext}"
+        assert fileio.read_text(got.as_posix()) == expected.read_text()
@@ -1,3 +1,4 @@
+import json
 import tempfile
 import pytest
 import shutil
@@ -5,6 +6,8 @@ import logging
 from pathlib import Path
 
 from bio3dbeacons.cli.metadata_generators import pfam_baker
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.sparql import UniprotSparql
 from .utils import compare_files
 
 LOG = logging.getLogger(__name__)
@@ -56,6 +59,85 @@ def test_generate_pfam_baker_metadata(example):
     )
 
 
+def test_generate_directory_resumes(example):
+    # UniProt accession headers need no SPARQL lookup
+    a3m = (DATA_ROOT / "a3m" / (example.file_stem + ".a3m")).read_text()
+    a3m = a3m.replace(example.first_seq_id, "A0A0R4FPS1.1/31-143", 1)
+    for subdir in ["x", "y"]:
+        for path in [example.pdb_path, example.a3m_path]:
+            (path / subdir).mkdir()
+        shutil.copy(
+            str(DATA_ROOT / "pdb" / (example.file_stem + ".pdb")),
+            str(example.pdb_path / subdir / f"{subdir}.pdb"),
+        )
+        (example.a3m_path / subdir / f"{subdir}.a3m").write_text(a3m)
+    (example.a3m_path / (example.file_stem + ".a3m")).write_text(a3m)
+
+    def run(**kwargs):
+        return pfam_baker.run(
+            example.pdb_path,
+            example.a3m_path,
+            example.metadata_path,
+            example.model_category,
+            scheduler=Scheduler(jobs=2, chunk_size=1),
+            **kwargs,
+        )
+
+    assert run() == 0
+    outputs = [
+        example.metadata_path / (example.file_stem + ".json"),
+        example.metadata_path / "x" / "x.json",
+        example.metadata_path / "y" / "y.json",
+    ]
+    for output in outputs:
+        data = json.loads(output.read_text())
+        assert data["mappingAccession"] == "A0A0R4FPS1"
+        assert data["confidenceAvgLocalScore"] == "8.55"
+
+    # existing metadata files are kept unless overwritten
+    outputs[1].write_text("{}")
+    assert run() == 0
+    assert outputs[1].read_text() == "{}"
+    assert run(overwrite=True) == 0
+    assert json.loads(outputs[1].read_text())["start"] == 31
+
+    # a model without alignment fails the run
+    (example.a3m_path / "y" / "y.a3m").unlink()
+    assert run(overwrite=True) == 1
+
+
+def test_generate_resolves_mnemonics_in_batch(example, sparql_server):
+    for subdir in ["x", "y"]:
+        for path, ext in [(example.pdb_path, ".pdb"), (example.a3m_path, ".a3m")]:
+            (path / subdir).mkdir()
+            shutil.copy(
+                str(DATA_ROOT / ext[1:] / (example.file_stem + ext)),
+                str(path / subdir / f"{subdir}{ext}"),
+            )
+
+    assert (
+        pfam_baker.run(
+            example.pdb_path,
+            example.a3m_path,
+            example.metadata_path,
+            example.model_category,
+            scheduler=Scheduler(jobs=2, chunk_size=1),
+            resolver=UniprotSparql(sparql_server.url),
+        )
+        == 0
+    )
+
+    # the mnemonic of the three models is resolved by a single query
+    assert len(sparql_server.queries) == 1
+    filename = str(example.file_stem + ".json")
+    assert compare_files(
+        got=(example.metadata_path / filename),
+        expected=(DATA_ROOT / "metadata" / filename),
+    )
+    metadata = json.loads((example.metadata_path / "y" / "y.json").read_text())
+    assert metadata["mappingAccession"] == "W5MWU3"
+
+
 def test_get_first_seqhdr_from_a3m(example):
     a3m_file = example.a3m_path / (example.file_stem + ".a3m")
     hdr = pfam_baker.get_first_seqhdr_from_a3m(a3m_file)
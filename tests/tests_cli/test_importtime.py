@@ -0,0 +1,62 @@
+import os
+import re
+import subprocess
+import sys
+
+# cumulative import time of the CLI, in microseconds. It was ~700 ms when the
+# commands imported everything, and is ~80 ms with the imports deferred
+IMPORT_BUDGET_US = 250000
+
+# dependencies only the commands using them import
+HEAVY_MODULES = (
+    "aiohttp",
+    "bson",
+    "fastapi",
+    "gemmi",
+    "jsonschema",
+    "numpy",
+    "pydantic",
+    "pymongo",
+    "requests",
+)
+
+IMPORT_TIME = re.compile(r"^import time:\s*\d+ \|\s*(\d+) \|\s*(\S+)$")
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    env = {
+        "MONGO_USERNAME": "test",
+        "MONGO_PASSWORD": "test",
+        "ASSETS_URL": "localhost",
+        **os.environ,
+    }
+
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def test_cli_import_time():
+    # the best of a few runs, the first one may warm the file system cache
+    timings = []
+    for _ in range(3):
+        stderr = run_python(
+            "-X", "importtime", "-c", "import bio3dbeacons.cli.cli"
+        ).stderr
+        for line in stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match and match.group(2) == "bio3dbeacons.cli.cli":
+                timings.append(int(match.group(1)))
+
+    assert timings
+    assert min(timings) < IMPORT_BUDGET_US
+
+
+def test_cli_does_not_import_heavy_modules():
+    stdout = run_python(
+        "-c",
+        "import sys, bio3dbeacons.cli.cli; "
+        f"print(' '.join(x for x in {HEAVY_MODULES!r} if x in sys.modules))",
+    ).stdout
+
+    assert stdout.split() == []
@@ -0,0 +1,156 @@
+from unittest.mock import MagicMock
+
+import mongomock
+import pytest
+
+from bio3dbeacons.mongo import indexes
+from bio3dbeacons.mongo.queries import (
+    API_QUERIES,
+    get_uniprot_summary_filter,
+    get_uniprot_summary_query,
+)
+
+IXSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "SUBPLAN",
+            "inputStage": {
+                "stage": "FETCH",
+                "inputStage": {
+                    "stage": "OR",
+                    "inputStages": [
+                        {"stage": "IXSCAN", "indexName": "mappingAccession_coverage"},
+                        {"stage": "IXSCAN", "indexName": "mappingId_coverage"},
+                    ],
+                },
+            },
+        }
+    }
+}
+SORT_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "SORT",
+            "inputStage": {"stage": "IXSCAN", "indexName": "mappingAccession_created"},
+        }
+    }
+}
+COLLSCAN_PLAN = {
+    "queryPlanner": {
+        "winningPlan": {
+            "queryPlan": {"stage": "COLLSCAN", "filter": {}},
+            "slotBasedPlan": {"stages": "..."},
+        }
+    }
+}
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().models.modelCollection
+
+
+def test_ensure_indexes(collection):
+    collection.create_index([("uniprotAccession", "text"), ("uniprotId", "text")])
+
+    names = [
+        "mappingAccession_coverage",
+        "mappingAccession_created",
+        "mappingId_coverage",
+        "mappingId_created",
+    ]
+    assert indexes.ensure_indexes(collection) == names
+    # existing indexes are kept unless unknown ones are dropped
+    assert len(collection.index_information()) == 6
+    indexes.ensure_indexes(collection, drop_unknown=True)
+    assert sorted(collection.index_information()) == sorted(["_id_"] + names)
+
+
+def test_uniprot_summary_filter(collection):
+    collection.insert_many(
+        [
+            {
+                "_id": 1,
+                "mappingAccession": "P38398",
+                "mappingId": "BRCA1_HUMAN",
+                "mappingAccessionType": "uniprot",
+            },
+            {
+                "_id": 2,
+                "mappingAccession": "P38398",
+                "mappingId": "BRCA1_HUMAN",
+                "mappingAccessionType": "other",
+            },
+            {
+                "_id": 3,
+                "mappingAccession": "P00520",
+                "mappingId": "ABL1_MOUSE",
+                "mappingAccessionType": "uniprot",
+            },
+        ]
+    )
+
+    for qualifier in ("P38398", "BRCA1_HUMAN"):
+        found = collection.find(get_uniprot_summary_filter(qualifier))
+        assert [x["_id"] for x in found] == [1]
+
+
+def test_uniprot_summary_query(collection):
+    collection.insert_many(
+        [
+            {
+                "_id": i,
+                "mappingAccession": "P38398",
+                "mappingId": "BRCA1_HUMAN",
+                "mappingAccessionType": "uniprot",
+                "start": start,
+                "end": end,
+                "coverage": (end - start + 1) / 1863,
+                "createdDate": created,
+            }
+            for i, start, end, created in (
+                (1, 1, 103, "2023-02-23"),
+                (2, 90, 300, "2022-01-01"),
+                (3, 200, 400, "2023-05-01"),
+                (4, 500, 600, "2024-01-01"),
+            )
+        ]
+    )
+
+    def find(*args, **kwargs):
+        return [
+            x["_id"]
+            for x in collection.find(**get_uniprot_summary_query(*args, **kwargs))
+        ]
+
+    # models overlapping the range, including those crossing its bounds
+    assert find("P38398", 100, 250) == [1, 2, 3]
+    assert find("BRCA1_HUMAN", 400, 500) == [3, 4]
+    assert find("P38398", 601, 700) == []
+    assert find("P38398", sort="coverage") == [2, 3, 1, 4]
+    assert find("BRCA1_HUMAN", sort="created", limit=2) == [4, 3]
+    assert find("P38398", 1, 300, sort="created", limit=2) == [3, 1]
+
+
+@pytest.mark.parametrize(
+    "explanation, scans",
+    [
+        (IXSCAN_PLAN, []),
+        (SORT_PLAN, list(API_QUERIES)),
+        (COLLSCAN_PLAN, list(API_QUERIES)),
+    ],
+)
+def test_check_queries(explanation, scans):
+    collection = MagicMock()
+    collection.find.return_value.explain.return_value = explanation
+
+    assert indexes.check_queries(collection) == scans
+    assert [x.kwargs for x in collection.find.call_args_list] == list(
+        API_QUERIES.values()
+    )
+
+
+def test_api_queries_use_indexes(live_mongo_collection):
+    indexes.ensure_indexes(live_mongo_collection)
+
+    assert indexes.check_queries(live_mongo_collection) == []
@@ -0,0 +1,107 @@
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from bio3dbeacons.cli.ingest import ingest
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.validatejson.validatejson import Rejected
+from bio3dbeacons.mongo.indexes import INDEXES
+
+MODEL_ID = "P38398_1jm7.1.A_1_103"
+
+
+class TestIngest:
+    def test_process_in_memory(self, pdb_file, metadata_file, offline_uniprot):
+        entry = ingest.process(pdb_file, metadata_file)
+
+        assert entry["_id"] == MODEL_ID
+        assert entry["mappingId"] == "BRCA1_HUMAN"
+        assert entry["entities"]
+
+    def test_process_writes_intermediate_files(
+        self, pdb_file, metadata_file, offline_uniprot
+    ):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cif_file = Path(temp_dir) / "cif" / f"{MODEL_ID}.cif.gz"
+            index_file = Path(temp_dir) / "index" / f"{MODEL_ID}.json"
+            entry = ingest.process(
+                pdb_file, metadata_file, cif_file.as_posix(), index_file.as_posix()
+            )
+
+            assert cif_file.stat().st_size > 0
+            with open(index_file) as fh:
+                assert json.load(fh) == entry
+
+    def test_process_invalid(self, pdb_file, data_dir, offline_uniprot):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(data_dir / "metadata" / f"{MODEL_ID}.json") as fh:
+                metadata = json.load(fh)
+            del metadata["modelCategory"]
+            metadata_file = Path(temp_dir) / f"{MODEL_ID}.json"
+            with open(metadata_file, "w") as fh:
+                json.dump(metadata, fh)
+
+            rejected = ingest.process(pdb_file, metadata_file.as_posix())
+            assert isinstance(rejected, Rejected)
+            assert rejected.path == pdb_file
+            assert rejected.reason == "$: 'modelCategory' is a required property"
+            assert ingest.process(pdb_file, metadata_file.as_posix(), validate=False)
+
+    def test_directory(self, data_dir, mock_mongo_db, offline_uniprot):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pdb_dir = Path(temp_dir) / "pdb"
+            shutil.copytree(data_dir / "pdb", pdb_dir / "nested")
+
+            s = ingest.run(
+                pdb_dir.as_posix(),
+                (data_dir / "metadata").as_posix(),
+                "sample mongo url",
+                batch_size=1,
+                scheduler=Scheduler(jobs=1),
+            )
+
+            assert s == 0
+
+        doc = mock_mongo_db.modelCollection.find_one({"_id": MODEL_ID})
+        assert doc["mappingId"] == "BRCA1_HUMAN"
+        indexes = mock_mongo_db.modelCollection.index_information()
+        assert INDEXES[0].document["name"] in indexes
+
+    def test_directory_rejected(self, data_dir, mock_mongo_db, offline_uniprot):
+        def reject(pdb_file, *args):
+            return Rejected(pdb_file, "$: 'modelCategory' is a required property", {})
+
+        with patch.object(ingest, "process", reject):
+            s = ingest.run(
+                (data_dir / "pdb").as_posix(),
+                (data_dir / "metadata").as_posix(),
+                "sample mongo url",
+                reject_path=None,
+                scheduler=Scheduler(jobs=1),
+            )
+
+        assert s == 1
+        # the indexes are only built after a successful load
+        indexes = mock_mongo_db.modelCollection.index_information()
+        assert INDEXES[0].document["name"] not in indexes
+
+    def test_single_file_missing_metadata(self, pdb_file, mock_mongo_db):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            metadata_file = f"{temp_dir}/missing.json"
+            reject_path = f"{temp_dir}/rejects.jsonl"
+
+            s = ingest.run(
+                pdb_file,
+                metadata_file,
+                "sample mongo url",
+                manifest_path=f"{temp_dir}/manifest.sqlite",
+                reject_path=reject_path,
+            )
+
+            assert s == 1
+            with open(reject_path) as fh:
+                [line] = [json.loads(line) for line in fh]
+            assert line["path"] == pdb_file
+            assert line["reason"] == f"metadata file {metadata_file} not found"
@@ -0,0 +1,309 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo import UpdateOne
+
+from bio3dbeacons.cli import jsonl
+from bio3dbeacons.cli.ciftojson import ciftojson
+from bio3dbeacons.cli.constants import ModelCategory
+from bio3dbeacons.cli.mongoload import mongoload
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.validatejson.validatejson import ValidateJSON
+from bio3dbeacons.mongo.indexes import INDEXES
+
+from .test_ingest import MODEL_ID
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_shard_writer(compression):
+    with tempfile.TemporaryDirectory() as d:
+        shards = []
+        with jsonl.ShardWriter(
+            d, 2, compression, on_shard=lambda path, keys: shards.append(keys)
+        ) as writer:
+            for i in range(5):
+                writer.write({"_id": i}, key=str(i))
+
+        assert shards == [["0", "1"], ["2", "3"], ["4"]]
+        names = sorted(os.listdir(d))
+        ext = {None: "", "gzip": ".gz", "zstd": ".zst"}[compression]
+        assert names == [f"index-00000{i}.jsonl{ext}" for i in range(3)]
+
+        documents = [
+            doc for name in names for _, doc in jsonl.iter_documents(f"{d}/{name}")
+        ]
+        assert documents == [{"_id": i} for i in range(5)]
+
+        # numbering continues after the existing shards
+        with jsonl.ShardWriter(d, 2, compression) as writer:
+            writer.write({"_id": 5})
+        assert f"index-000003.jsonl{ext}" in os.listdir(d)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_compact_shards(compression):
+    with tempfile.TemporaryDirectory() as d:
+        with jsonl.ShardWriter(d, 2, compression) as writer:
+            for i in range(5):
+                writer.write({"_id": str(i)})
+        with jsonl.ShardWriter(d, 2, compression) as writer:
+            assert writer.first_number == 3
+            for i in (1, 4):
+                writer.write({"_id": str(i), "new": True})
+
+        assert jsonl.compact_shards(d, {"1", "4"}, writer.first_number) == 2
+        documents = [
+            doc
+            for name in sorted(os.listdir(d))
+            for _, doc in jsonl.iter_documents(f"{d}/{name}")
+        ]
+        assert documents == [
+            {"_id": "0"},
+            {"_id": "2"},
+            {"_id": "3"},
+            {"_id": "1", "new": True},
+            {"_id": "4", "new": True},
+        ]
+        # the shard of the document 4 was emptied
+        assert len(os.listdir(d)) == 3
+
+
+def test_compact_shards_reads_ids_only():
+    with tempfile.TemporaryDirectory() as d:
+        with jsonl.ShardWriter(d, 2) as writer:
+            for i in range(4):
+                writer.write({"value": i, "_id": str(i)})
+            # shards of former releases do not start with the _id
+            writer.write_line(json.dumps({"value": 4, "_id": "4"}))
+        untouched = os.stat(f"{d}/index-000000.jsonl").st_mtime_ns
+
+        with patch.object(jsonl.json, "loads", wraps=json.loads) as loads:
+            assert jsonl.compact_shards(d, {"2", "4"}, 3) == 2
+
+        # only the line without the _id first is parsed in full
+        assert loads.call_count == 2
+        assert os.stat(f"{d}/index-000000.jsonl").st_mtime_ns == untouched
+        with open(f"{d}/index-000001.jsonl") as fh:
+            assert fh.read() == '{"_id": "3", "value": 3}\n'
+        assert sorted(os.listdir(d)) == ["index-000000.jsonl", "index-000001.jsonl"]
+
+
+def test_cif_to_jsonl(data_dir, offline_uniprot):
+    with tempfile.TemporaryDirectory() as d:
+        output_dir = Path(d) / "index"
+        manifest_path = (Path(d) / "manifest.sqlite").as_posix()
+
+        def run():
+            return ciftojson.run(
+                (data_dir / "cif").as_posix(),
+                (data_dir / "metadata").as_posix(),
+                output_dir.as_posix(),
+                scheduler=Scheduler(jobs=1),
+                manifest_path=manifest_path,
+                jsonl_records=10,
+                compression="gzip",
+            )
+
+        assert run() == 0
+        assert os.listdir(output_dir) == ["index-000000.jsonl.gz"]
+        shard = (output_dir / "index-000000.jsonl.gz").as_posix()
+        [(name, document)] = jsonl.iter_documents(shard)
+        assert name == f"{shard}:1"
+        assert document["_id"] == MODEL_ID
+        assert document["mappingId"] == "BRCA1_HUMAN"
+
+        # models already in a shard are not written again
+        assert run() == 0
+        assert os.listdir(output_dir) == ["index-000000.jsonl.gz"]
+
+
+def test_validate_shard():
+    with tempfile.TemporaryDirectory() as d:
+        with jsonl.ShardWriter(d) as writer:
+            writer.write({"entryId": "someId"})
+            writer.write({"entryId": "otherId"})
+
+        with patch.object(ValidateJSON, "validate_document", return_value=True) as v:
+            assert ValidateJSON.validate(f"{d}/index-000000.jsonl")
+        assert [x.args[0] for x in v.call_args_list] == [
+            {"entryId": "someId"},
+            {"entryId": "otherId"},
+        ]
+
+        assert not ValidateJSON.validate(f"{d}/index-000000.jsonl")
+
+
+def upsert(doc):
+    doc = mongoload.add_fingerprint(doc)
+    return UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True)
+
+
+def test_load_shards():
+    collection = MagicMock()
+    collection.find.return_value = []
+    batches = []
+
+    def bulk_write(requests, **kwargs):
+        batches.append(list(requests))
+        return MagicMock(
+            upserted_count=len(requests), modified_count=0, matched_count=0
+        )
+
+    collection.bulk_write.side_effect = bulk_write
+
+    def init_collection(self, mongo_db_url):
+        self.collection = collection
+
+    with tempfile.TemporaryDirectory() as d, patch.object(
+        mongoload.MongoLoad, "init_collection", init_collection
+    ):
+        with open(f"{d}/model.json", "w") as fh:
+            json.dump({"_id": "model"}, fh)
+        with jsonl.ShardWriter(d, 3) as writer:
+            for i in range(5):
+                writer.write({"_id": i})
+
+        assert mongoload.run(d, "sample mongo url", 2, parsers=1, writers=1) == 0
+
+    # shards are streamed in batches, whatever their size
+    assert batches == [
+        [upsert({"_id": 0}), upsert({"_id": 1})],
+        [upsert({"_id": 2}), upsert({"_id": 3})],
+        [upsert({"_id": 4}), upsert({"_id": "model"})],
+    ]
+    collection.create_indexes.assert_called_once_with(INDEXES)
+
+
+def test_to_jsonable():
+    document = {
+        "entryId": "model",
+        "modelCategory": ModelCategory.TEMPLATE_BASED,
+        "createdDate": datetime.date(2023, 3, 1),
+        "coverage": Decimal("0.5"),
+        "start": Decimal("1"),
+        "chainIds": ("A", "B"),
+        "entities": [{"chainIds": ["A"], "entityDescription": None}],
+    }
+
+    result = jsonl.to_jsonable(document)
+    assert result == {
+        "entryId": "model",
+        "modelCategory": "TEMPLATE-BASED",
+        "createdDate": "2023-03-01",
+        "coverage": 0.5,
+        "start": 1,
+        "chainIds": ["A", "B"],
+        "entities": [{"chainIds": ["A"], "entityDescription": None}],
+    }
+    assert json.loads(json.dumps(result)) == result
+
+    with pytest.raises(TypeError):
+        jsonl.to_jsonable({"value": object()})
+
+
+@pytest.mark.parametrize("jsonl_records", [None, 10])
+def test_cif_to_json_rejects_invalid(data_dir, offline_uniprot, jsonl_records):
+    with tempfile.TemporaryDirectory() as d:
+        cif_dir = Path(d) / "cif"
+        metadata_dir = Path(d) / "metadata"
+        output_dir = Path(d) / "index"
+        reject_path = Path(d) / "rejected.jsonl"
+        cif_dir.mkdir()
+        metadata_dir.mkdir()
+
+        with open(data_dir / "metadata" / f"{MODEL_ID}.json") as fh:
+            metadata = json.load(fh)
+        for name, coverage in (("valid", metadata["coverage"]), ("invalid", "high")):
+            shutil.copy(data_dir / "cif" / f"{MODEL_ID}.cif", cif_dir / f"{name}.cif")
+            with open(metadata_dir / f"{name}.json", "w") as fh:
+                json.dump({**metadata, "coverage": coverage}, fh)
+
+        status = ciftojson.run(
+            cif_dir.as_posix(),
+            metadata_dir.as_posix(),
+            output_dir.as_posix(),
+            scheduler=Scheduler(jobs=1),
+            jsonl_records=jsonl_records,
+            validate=True,
+            reject_path=reject_path.as_posix(),
+        )
+        assert status == 1
+
+        documents = [
+            doc
+            for name in os.listdir(output_dir)
+            for _, doc in jsonl.iter_documents((output_dir / name).as_posix())
+        ]
+        assert [doc["coverage"] for doc in documents] == [metadata["coverage"]]
+
+        [(_, rejected)] = jsonl.iter_documents(reject_path.as_posix())
+        assert rejected["path"] == (cif_dir / "invalid.cif").as_posix()
+        assert rejected["reason"] == "$.coverage: 'high' is not of type 'number'"
+        assert rejected["document"]["coverage"] == "high"
+
+
+def test_rerun_supersedes_changed_models(data_dir, offline_uniprot):
+    with tempfile.TemporaryDirectory() as d:
+        cif_dir = Path(d) / "cif"
+        metadata_dir = Path(d) / "metadata"
+        output_dir = Path(d) / "index"
+        cif_dir.mkdir()
+        metadata_dir.mkdir()
+
+        cif_text = (data_dir / "cif" / f"{MODEL_ID}.cif").read_text()
+        with open(data_dir / "metadata" / f"{MODEL_ID}.json") as fh:
+            metadata = json.load(fh)
+        for name in ("model_a", "model_b"):
+            (cif_dir / f"{name}.cif").write_text(cif_text.replace(MODEL_ID, name))
+            with open(metadata_dir / f"{name}.json", "w") as fh:
+                json.dump(metadata, fh)
+
+        def run():
+            return ciftojson.run(
+                cif_dir.as_posix(),
+                metadata_dir.as_posix(),
+                output_dir.as_posix(),
+                scheduler=Scheduler(jobs=1),
+                manifest_path=(Path(d) / "manifest.sqlite").as_posix(),
+                jsonl_records=1,
+            )
+
+        assert run() == 0
+        assert len(os.listdir(output_dir)) == 2
+
+        with open(metadata_dir / "model_a.json", "w") as fh:
+            json.dump({**metadata, "coverage": 0.5}, fh)
+        assert run() == 0
+
+        # the former document of model_a is gone with its shard
+        names = sorted(os.listdir(output_dir))
+        assert len(names) == 2
+        assert names[-1] == "index-000002.jsonl"
+
+        collection = MagicMock()
+        collection.find.return_value = []
+        loaded = []
+
+        def bulk_write(requests, **kwargs):
+            loaded.extend(x._doc["$set"] for x in requests)
+            return MagicMock(
+                upserted_count=len(requests), modified_count=0, matched_count=0
+            )
+
+        collection.bulk_write.side_effect = bulk_write
+
+        def init_collection(self, mongo_db_url):
+            self.collection = collection
+
+        with patch.object(mongoload.MongoLoad, "init_collection", init_collection):
+            assert mongoload.run(output_dir.as_posix(), "sample mongo url", 10) == 0
+
+    coverages = sorted((x["_id"], x["coverage"]) for x in loaded)
+    assert coverages == [("model_a", 0.5), ("model_b", metadata["coverage"])]
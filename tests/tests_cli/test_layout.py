@@ -0,0 +1,95 @@
+import io
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli import layout
+from bio3dbeacons.cli.pdbtocif import pdbtocif
+from bio3dbeacons.cli.scheduler import Scheduler
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as d:
+        yield Path(d)
+
+
+def touch(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("")
+
+
+class TestLayout:
+    def test_output_path(self):
+        assert layout.output_path("out", "a/b/model", ".cif") == "out/a/b/model.cif"
+
+        sharded = layout.output_path("out", "a/b/model", ".cif", shard_depth=2)
+        first, second = layout.shard_dirs("model", 2)
+        assert sharded == f"out/{first}/{second}/model.cif"
+        assert len(first) == len(second) == layout.SHARD_WIDTH
+
+    def test_iter_files_is_recursive(self, temp_dir):
+        for name in ["a.cif", "x/b.cif", "x/y/c.cif", "x/y/c.json"]:
+            touch(temp_dir / name)
+
+        files = list(layout.iter_files(temp_dir.as_posix(), ".cif"))
+        assert [layout.relative_key(temp_dir.as_posix(), x, ".cif") for x in files] == [
+            "a",
+            "x/b",
+            "x/y/c",
+        ]
+
+    def test_iter_files_from_list(self, temp_dir):
+        file_list = temp_dir / "files.txt"
+        file_list.write_text("# models\nx/b.cif\n\n/elsewhere/c.cif\nd.json\n")
+
+        files = list(layout.iter_files("root", ".cif", file_list.as_posix()))
+        assert files == ["root/x/b.cif", "/elsewhere/c.cif"]
+        assert layout.relative_key("root", files[1], ".cif") == "c"
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("sys.stdin", io.StringIO("x/b.cif\n"))
+            assert list(layout.iter_files("root", ".cif", layout.STDIN)) == [
+                "root/x/b.cif"
+            ]
+
+    def test_companion_path(self, temp_dir):
+        touch(temp_dir / "x" / "a.json")
+        touch(temp_dir / "b.json")
+
+        root = temp_dir.as_posix()
+        assert layout.companion_path(root, "x/a", ".json") == f"{root}/x/a.json"
+        assert layout.companion_path(root, "y/b", ".json") == f"{root}/b.json"
+        assert layout.companion_path(root, "c", ".json") is None
+
+    def test_pdbtocif_nested_and_sharded(self, data_dir, temp_dir):
+        pdb_dir = temp_dir / "pdb"
+        for name in ["a", "x/b", "x/y/c"]:
+            (pdb_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(
+                data_dir / "pdb" / "P38398_1jm7.1.A_1_103.pdb", pdb_dir / f"{name}.pdb"
+            )
+
+        mirrored = temp_dir / "mirrored"
+        s = pdbtocif.run(
+            pdb_dir.as_posix(), mirrored.as_posix(), scheduler=Scheduler(jobs=1)
+        )
+        assert s == 0
+        for name in ["a", "x/b", "x/y/c"]:
+            assert os.path.isfile(mirrored / f"{name}.cif")
+
+        sharded = temp_dir / "sharded"
+        s = pdbtocif.run(
+            pdb_dir.as_posix(),
+            sharded.as_posix(),
+            scheduler=Scheduler(jobs=1),
+            shard_depth=2,
+        )
+        assert s == 0
+        for name in ["a", "b", "c"]:
+            assert os.path.isfile(
+                layout.output_path(sharded.as_posix(), name, ".cif", 2)
+            )
@@ -0,0 +1,108 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli import manifest as manifest_module
+from bio3dbeacons.cli.manifest import Manifest, find_orphans
+from bio3dbeacons.cli.pdbtocif import pdbtocif
+from bio3dbeacons.cli.scheduler import Scheduler
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as d:
+        yield Path(d)
+
+
+class TestManifest:
+    def test_up_to_date_after_record(self, temp_dir):
+        input_file = temp_dir / "model.pdb"
+        output_file = temp_dir / "model.cif"
+        input_file.write_text("ATOM")
+        output_file.write_text("data_model")
+
+        m = Manifest((temp_dir / "manifest.sqlite").as_posix(), tool_version="1")
+        assert not m.is_up_to_date("stage", output_file, [input_file])
+        m.record("stage", output_file)
+        assert m.is_up_to_date("stage", output_file, [input_file])
+
+        # other parameters, stage or tool version need a rebuild
+        assert not m.is_up_to_date("stage", output_file, [input_file], "other")
+        assert not m.is_up_to_date("other", output_file, [input_file])
+        m.close()
+
+        m = Manifest((temp_dir / "manifest.sqlite").as_posix(), tool_version="2")
+        assert not m.is_up_to_date("stage", output_file, [input_file])
+        m.close()
+
+    def test_changed_input_or_missing_output(self, temp_dir):
+        input_file = temp_dir / "model.pdb"
+        output_file = temp_dir / "model.cif"
+        input_file.write_text("ATOM")
+        output_file.write_text("data_model")
+
+        m = Manifest((temp_dir / "manifest.sqlite").as_posix())
+        m.is_up_to_date("stage", output_file, [input_file])
+        m.record("stage", output_file)
+
+        input_file.write_text("ATOM ATOM")
+        assert not m.is_up_to_date("stage", output_file, [input_file])
+        m.record("stage", output_file)
+
+        output_file.unlink()
+        assert not m.is_up_to_date("stage", output_file, [input_file])
+        m.close()
+
+    def test_digest_is_cached(self, temp_dir):
+        input_file = temp_dir / "model.pdb"
+        input_file.write_text("ATOM")
+
+        m = Manifest((temp_dir / "manifest.sqlite").as_posix())
+        digest = m.digest(input_file)
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(manifest_module, "file_digest", lambda path: 1 / 0)
+            assert m.digest(input_file) == digest
+        m.close()
+
+    def test_find_orphans(self):
+        cif_orphans, metadata_orphans = find_orphans(["a", "b", "c"], ["b", "c", "d"])
+
+        assert cif_orphans == ["a"]
+        assert metadata_orphans == ["d"]
+
+    def test_pdbtocif_skips_unchanged(self, data_dir, temp_dir):
+        pdb_dir = temp_dir / "pdb"
+        cif_dir = temp_dir / "cif"
+        pdb_dir.mkdir()
+        for name in ["a", "b"]:
+            shutil.copy(
+                data_dir / "pdb" / "P38398_1jm7.1.A_1_103.pdb", pdb_dir / f"{name}.pdb"
+            )
+        manifest_path = (temp_dir / "manifest.sqlite").as_posix()
+
+        def convert():
+            converted = []
+            s = pdbtocif.run(
+                pdb_dir.as_posix(),
+                cif_dir.as_posix(),
+                scheduler=Scheduler(jobs=1),
+                manifest_path=manifest_path,
+            )
+            assert s == 0
+            for name in ["a", "b"]:
+                converted.append(os.stat(cif_dir / f"{name}.cif").st_mtime_ns)
+            return converted
+
+        first = convert()
+        second = convert()
+        assert first == second
+
+        with open(pdb_dir / "b.pdb", "a") as fh:
+            fh.write("END\n")
+        third = convert()
+        assert third[0] == first[0]
+        assert third[1] != first[1]
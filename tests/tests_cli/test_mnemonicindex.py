@@ -0,0 +1,74 @@
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli.metadata_generators import pfam_baker
+from bio3dbeacons.cli.mnemonicindex import mnemonicindex
+from bio3dbeacons.cli.scheduler import Scheduler
+
+IDMAPPING_DAT = """P38398\tUniProtKB-ID\tBRCA1_HUMAN
+P38398\tGene_Name\tBRCA1
+P38398-2\tUniProtKB-ID\tBRCA1_HUMAN
+W5MWU3\tUniProtKB-ID\tW5MWU3_LEPOC
+W5MWU3\tNCBI_TaxID\t7918
+"""
+
+IDMAPPING_SELECTED = """P38398\tBRCA1_HUMAN\t672\tNP_009225.1\t\t\t\t
+W5MWU3\tW5MWU3_LEPOC\t\t\t\t\t\t
+"""
+
+DATA_ROOT = Path(__file__).parent.parent / "data" / "pfam_baker"
+
+
+@pytest.fixture
+def index_path():
+    with tempfile.TemporaryDirectory() as d:
+        dump = Path(d) / "idmapping.dat.gz"
+        dump.write_bytes(gzip.compress(IDMAPPING_DAT.encode()))
+        path = (Path(d) / "mnemonic-index.sqlite").as_posix()
+        assert mnemonicindex.run(dump.as_posix(), path) == 0
+        yield path
+
+
+@pytest.mark.parametrize("dump", [IDMAPPING_DAT, IDMAPPING_SELECTED])
+def test_iter_id_mappings(dump):
+    pairs = list(mnemonicindex.iter_id_mappings(dump.splitlines(keepends=True)))
+
+    assert pairs == [("BRCA1_HUMAN", "P38398"), ("W5MWU3_LEPOC", "W5MWU3")]
+
+
+def test_lookup(index_path):
+    index = mnemonicindex.MnemonicIndex(index_path)
+
+    assert index.get_uniprot_accs_for_gene_names(
+        ["BRCA1_HUMAN", "w5mwu3_lepoc", "UNKNOWN_HUMAN"]
+    ) == {"BRCA1_HUMAN": "P38398", "w5mwu3_lepoc": "W5MWU3", "UNKNOWN_HUMAN": None}
+    assert index.get_uniprot_acc_for_gene_name("W5MWU3_LEPOC") == "W5MWU3"
+    index.close()
+
+
+def test_generate_metadata_offline(index_path):
+    with tempfile.TemporaryDirectory() as d:
+        for subdir, ext in [("pdb", ".pdb"), ("a3m", ".a3m")]:
+            (Path(d) / subdir).mkdir()
+            shutil.copy(DATA_ROOT / subdir / f"PF06625{ext}", Path(d) / subdir)
+        (Path(d) / "metadata").mkdir()
+
+        assert (
+            pfam_baker.run(
+                Path(d) / "pdb",
+                Path(d) / "a3m",
+                Path(d) / "metadata",
+                "TEMPLATE-BASED",
+                scheduler=Scheduler(jobs=1),
+                resolver=mnemonicindex.MnemonicIndex(index_path),
+            )
+            == 0
+        )
+
+        assert (Path(d) / "metadata" / "PF06625.json").read_text() == (
+            DATA_ROOT / "metadata" / "PF06625.json"
+        ).read_text()
@@ -1,9 +1,23 @@
 import json
 import os
 import tempfile
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from bio3dbeacons.cli.mongoload.mongoload import run
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+from pymongo.results import BulkWriteResult
+
+from bio3dbeacons.cli import jsonl
+from bio3dbeacons.cli.mongoload import mongoload as mongoload_module
+from bio3dbeacons.cli.mongoload.mongoload import (
+    DUPLICATE_KEY,
+    FINGERPRINT_FIELD,
+    MongoLoad,
+    add_fingerprint,
+    get_fingerprint,
+    run,
+)
+from bio3dbeacons.mongo.indexes import INDEXES
 
 
 class TestMongoLoad:
@@ -91,3 +105,264 @@ class TestMongoLoad:
 
         # test if there is a single document in the collection
         assert cursor.collection.estimated_document_count() == 2
+
+
+class TestPipelinedLoad:
+    @pytest.fixture
+    def collection(self):
+        collection = MagicMock()
+        collection.written = []
+        collection.stored = {}
+
+        def bulk_write(requests, **kwargs):
+            upserted = modified = 0
+            for request in requests:
+                document = request._doc["$set"]
+                stored = collection.stored.get(document["_id"])
+                upserted += stored is None
+                modified += stored is not None and stored != document
+                collection.written.append(document["_id"])
+                collection.stored[document["_id"]] = document
+
+            return BulkWriteResult(
+                {
+                    "nUpserted": upserted,
+                    "nModified": modified,
+                    "nMatched": len(requests) - upserted,
+                    "upserted": [],
+                },
+                True,
+            )
+
+        def find(query, projection):
+            return [
+                {
+                    "_id": key,
+                    FINGERPRINT_FIELD: collection.stored[key][FINGERPRINT_FIELD],
+                }
+                for key in query["_id"]["$in"]
+                if key in collection.stored
+            ]
+
+        collection.bulk_write.side_effect = bulk_write
+        collection.find.side_effect = find
+
+        def init_collection(self, mongo_db_url):
+            self.collection = collection
+
+        with patch.object(MongoLoad, "init_collection", init_collection):
+            yield collection
+
+    @pytest.fixture
+    def index_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            for i in range(10):
+                with open(f"{d}/{i}.json", "w") as fh:
+                    json.dump({"_id": i}, fh)
+            with jsonl.ShardWriter(d, 50) as writer:
+                for i in range(10, 100):
+                    writer.write({"_id": i})
+            yield d
+
+    def test_concurrent_writers(self, collection, index_dir):
+        assert run(index_dir, "sample mongo url", 7, parsers=3, writers=4) == 0
+
+        assert sorted(collection.written) == list(range(100))
+        for call in collection.bulk_write.call_args_list:
+            assert call.kwargs == {"ordered": False}
+            assert len(call.args[0]) <= 7
+
+    def test_transient_errors_are_retried(self, collection, index_dir):
+        write = collection.bulk_write.side_effect
+        errors = [AutoReconnect("connection reset")]
+
+        def bulk_write(requests, **kwargs):
+            error = errors.pop(0) if errors else None
+            if error:
+                raise error
+            return write(requests)
+
+        collection.bulk_write.side_effect = bulk_write
+        with patch.object(mongoload_module, "BACKOFF_BASE", 0):
+            assert run(index_dir, "sample mongo url", 50, writers=1) == 0
+
+        assert not errors
+        assert sorted(collection.written) == list(range(100))
+
+    def test_duplicate_upserts_are_retried(self, collection):
+        write = collection.bulk_write.side_effect
+        requests = [mongoload_module.upsert({"_id": i}) for i in range(4)]
+
+        def bulk_write(requests, **kwargs):
+            if len(requests) < 4:
+                return write(requests)
+            # a concurrent upsert inserted _id 2 first
+            write(requests[:2] + requests[3:])
+            raise BulkWriteError(
+                {
+                    "nUpserted": 3,
+                    "nMatched": 0,
+                    "nModified": 0,
+                    "writeErrors": [{"index": 2, "code": DUPLICATE_KEY}],
+                }
+            )
+
+        collection.bulk_write.side_effect = bulk_write
+        result = mongoload_module.write_batch(collection, requests)
+
+        # only the failed upsert is retried, right away
+        assert [len(x.args[0]) for x in collection.bulk_write.call_args_list] == [4, 1]
+        assert result.upserted_count == 4
+        assert sorted(collection.written) == [0, 1, 2, 3]
+
+    def test_duplicate_keys_are_not_transient(self):
+        error = BulkWriteError({"writeErrors": [{"index": 0, "code": DUPLICATE_KEY}]})
+        assert not mongoload_module.is_transient(error)
+        assert mongoload_module.is_duplicate_key(error)
+        assert mongoload_module.is_transient(
+            BulkWriteError({"writeErrors": [{"index": 0, "code": 11602}]})
+        )
+
+    def test_failed_batches_are_not_recorded(self, collection, index_dir):
+        write = collection.bulk_write.side_effect
+        collection.bulk_write.side_effect = OperationFailure("unauthorized")
+
+        with tempfile.TemporaryDirectory() as d:
+            manifest = f"{d}/manifest.sqlite"
+            assert run(index_dir, "sample mongo url", 50, manifest_path=manifest) == 1
+
+            collection.bulk_write.side_effect = write
+            assert run(index_dir, "sample mongo url", 50, manifest_path=manifest) == 0
+            calls = collection.bulk_write.call_count
+
+            # all the files are recorded once loaded
+            assert run(index_dir, "sample mongo url", 50, manifest_path=manifest) == 0
+            assert collection.bulk_write.call_count == calls
+
+    def test_unchanged_documents_are_skipped(self, collection, index_dir):
+        assert run(index_dir, "sample mongo url", 50) == 0
+        assert len(collection.written) == 100
+
+        collection.written.clear()
+        with open(f"{index_dir}/3.json", "w") as fh:
+            json.dump({"_id": 3, "changed": True}, fh)
+        with open(f"{index_dir}/new.json", "w") as fh:
+            json.dump({"_id": 100}, fh)
+
+        assert run(index_dir, "sample mongo url", 50) == 0
+        assert sorted(collection.written) == [3, 100]
+        assert collection.stored[3]["changed"]
+
+        # one query for the stored fingerprints per batch
+        for call in collection.find.call_args_list:
+            assert call.args[1] == {FINGERPRINT_FIELD: 1}
+
+        collection.written.clear()
+        assert run(index_dir, "sample mongo url", 50, skip_unchanged=False) == 0
+        assert len(collection.written) == 101
+
+    def test_fingerprint_ignores_key_order(self):
+        assert get_fingerprint({"a": 1, "b": [1, 2]}) == get_fingerprint(
+            {"b": [1, 2], "a": 1}
+        )
+        assert get_fingerprint({"a": 1}) != get_fingerprint({"a": 2})
+        # the stored fingerprint is not part of the content
+        assert get_fingerprint(add_fingerprint({"a": 1})) == get_fingerprint({"a": 1})
+
+
+class TestFreshLoad:
+    @pytest.fixture
+    def database(self, mock_mongo_db):
+        return mock_mongo_db
+
+    def make_index(self, d, ids, **fields):
+        with jsonl.ShardWriter(d, 3) as writer:
+            for i in ids:
+                writer.write({"_id": i, **fields})
+
+    def live_ids(self, database, name=mongoload_module.LIVE_COLLECTION):
+        return sorted(x["_id"] for x in database[name].find())
+
+    def test_swap_and_rollback(self, database):
+        with tempfile.TemporaryDirectory() as d, tempfile.TemporaryDirectory() as e:
+            self.make_index(d, range(5))
+            self.make_index(e, range(3, 8))
+
+            assert run(d, "sample mongo url", 2, writers=1, fresh=True) == 0
+            assert self.live_ids(database) == list(range(5))
+            assert (
+                mongoload_module.STAGING_COLLECTION
+                not in database.list_collection_names()
+            )
+
+            assert run(e, "sample mongo url", 2, writers=1, fresh=True) == 0
+            assert self.live_ids(database) == list(range(3, 8))
+            assert self.live_ids(
+                database, mongoload_module.PREVIOUS_COLLECTION
+            ) == list(range(5))
+            # documents loaded fresh are skipped by incremental loads
+            assert database.modelCollection.find_one({"_id": 3})[FINGERPRINT_FIELD]
+
+            # the previous generation keeps its indexes when renamed
+            previous = database[mongoload_module.PREVIOUS_COLLECTION]
+            assert INDEXES[0].document["name"] in previous.index_information()
+
+            assert mongoload_module.rollback("sample mongo url") == 0
+            assert self.live_ids(database) == list(range(5))
+            assert self.live_ids(database, mongoload_module.STAGING_COLLECTION) == list(
+                range(3, 8)
+            )
+
+            assert mongoload_module.rollback("sample mongo url") == 1
+
+    def test_failed_load_leaves_live_collection(self, database):
+        database.modelCollection.insert_one({"_id": "live"})
+
+        with tempfile.TemporaryDirectory() as d:
+            self.make_index(d, range(5))
+            with open(f"{d}/broken.json", "w") as fh:
+                fh.write("{")
+
+            assert run(d, "sample mongo url", 2, writers=1, fresh=True) == 1
+
+        assert self.live_ids(database) == ["live"]
+        assert (
+            mongoload_module.PREVIOUS_COLLECTION not in database.list_collection_names()
+        )
+
+    def test_duplicates_are_upserted(self, database):
+        with tempfile.TemporaryDirectory() as d:
+            self.make_index(f"{d}/a", range(4), source="a")
+            self.make_index(f"{d}/b", range(2, 6), source="b")
+
+            assert run(d, "sample mongo url", 10, parsers=1, writers=1, fresh=True) == 0
+
+        assert self.live_ids(database) == list(range(6))
+        sources = {x["_id"]: x["source"] for x in database.modelCollection.find()}
+        assert sources == {0: "a", 1: "a", 2: "b", 3: "b", 4: "b", 5: "b"}
+
+    def test_manifest_is_recorded_after_swap(self, database):
+        with tempfile.TemporaryDirectory() as d:
+            manifest = f"{d}/manifest.sqlite"
+            index_dir = f"{d}/index"
+            self.make_index(index_dir, range(5))
+
+            assert (
+                run(
+                    index_dir, "sample mongo url", 2, manifest_path=manifest, fresh=True
+                )
+                == 0
+            )
+            database.modelCollection.delete_many({})
+
+            # a fresh load ignores the manifest, incremental ones use its records
+            assert (
+                run(
+                    index_dir, "sample mongo url", 2, manifest_path=manifest, fresh=True
+                )
+                == 0
+            )
+            assert self.live_ids(database) == list(range(5))
+            database.modelCollection.delete_many({})
+            assert run(index_dir, "sample mongo url", 2, manifest_path=manifest) == 0
+            assert self.live_ids(database) == []
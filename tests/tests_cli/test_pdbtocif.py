@@ -1,17 +1,28 @@
 import os
+import shutil
 import tempfile
+from unittest.mock import patch
 
+import gemmi
+import pytest
+
+from bio3dbeacons.cli.constants import ENGINE_BINARY, ENGINES
 from bio3dbeacons.cli.pdbtocif import pdbtocif
-from .utils import compare_files
+from .utils import compare_structures
 
 
 class TestPDBToCif:
-    def test_convert_single_pdb_valid(self, pdb_file, cif_file):
-        with tempfile.NamedTemporaryFile("w+") as temp_cif:
-            s = pdbtocif.run(pdb_file, temp_cif.name)
+    @pytest.mark.parametrize("engine", ENGINES)
+    def test_convert_single_pdb_valid(self, pdb_file, cif_file, engine):
+        if engine == ENGINE_BINARY and not shutil.which(pdbtocif.GEMMI_BIN):
+            pytest.skip(f"{pdbtocif.GEMMI_BIN} is not installed")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_cif = f"{temp_dir}/out.cif"
+            s = pdbtocif.run(pdb_file, output_cif, engine=engine)
 
-            # test if generated file is same as the sample file
-            assert compare_files(got=temp_cif.name, expected=cif_file)
+            # test if generated file holds the same model as the sample file
+            assert compare_structures(got=output_cif, expected=cif_file)
 
         # test if successful
         assert s == 0
@@ -48,3 +59,34 @@ class TestPDBToCif:
         s = pdbtocif.run(non_pdb_file.name, some_file.name)
 
         assert s == 1
+
+    def test_convert_in_process(self, pdb_file):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_cif = f"{temp_dir}/out.cif"
+            with patch("subprocess.check_call") as check_call:
+                s = pdbtocif.run(pdb_file, output_cif, engine=pdbtocif.ENGINE_PYTHON)
+
+            # test if the gemmi program was never invoked
+            assert s == 0
+            check_call.assert_not_called()
+
+            # test if all atoms made it to the CIF
+            expected = gemmi.read_structure(pdb_file)[0].count_atom_sites()
+            got = gemmi.read_structure(output_cif)[0].count_atom_sites()
+            assert got == expected
+
+    def test_convert_falls_back_to_binary(self, pdb_file):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_cif = f"{temp_dir}/out.cif"
+            with patch(
+                "bio3dbeacons.cli.pdbtocif.pdbtocif.Pdb2Cif.convert_in_process",
+                side_effect=RuntimeError("boom"),
+            ), patch("shutil.which", return_value=pdbtocif.GEMMI_BIN), patch(
+                "subprocess.check_call"
+            ) as check_call:
+                s = pdbtocif.run(pdb_file, output_cif)
+
+        assert s == 0
+        check_call.assert_called_once_with(
+            [pdbtocif.GEMMI_BIN, "convert", "--to", "mmcif", pdb_file, output_cif]
+        )
@@ -0,0 +1,201 @@
+import os
+import time
+
+import pytest
+
+from bio3dbeacons.cli import counters, scheduler
+from bio3dbeacons.cli.scheduler import Scheduler
+
+
+def square(x):
+    if x < 0:
+        raise ValueError("negative")
+    return {"square": x * x}
+
+
+def status(x):
+    return x
+
+
+def slow(x):
+    time.sleep(x)
+    return 0
+
+
+def pid():
+    return {"pid": os.getpid()}
+
+
+def die(x):
+    if x == 3:
+        os._exit(1)
+    return 0
+
+
+def test_available_cpus():
+    assert 1 <= scheduler.available_cpus() <= os.cpu_count()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_collects_results(jobs):
+    results = {}
+    summary = Scheduler(jobs=jobs, chunk_size=3).run(
+        square,
+        ((x,) for x in range(-2, 10)),
+        on_result=lambda task, result: results.update({task[0]: result}),
+    )
+
+    assert summary.succeeded == 10
+    assert summary.failed == 2
+    assert summary.exit_status == 1
+    assert sorted(task[0] for task, _ in summary.failures) == [-2, -1]
+    assert all("ValueError: negative" in reason for _, reason in summary.failures)
+    assert results == {x: {"square": x * x} for x in range(10)}
+
+
+def test_run_status_results():
+    summary = Scheduler(jobs=1).run(status, [(0,), (1,), (None,), (True,), (False,)])
+
+    assert summary.succeeded == 3
+    assert summary.failed == 2
+
+
+def test_run_bounds_in_flight_tasks():
+    consumed = []
+
+    def tasks():
+        for x in range(100):
+            consumed.append(x)
+            yield (x,)
+
+    seen = []
+
+    def on_result(task, result):
+        # only the chunks in flight and the next one are read ahead
+        assert len(consumed) - len(seen) <= (2 + 1) * 5
+        seen.append(task)
+
+    summary = Scheduler(jobs=2, chunk_size=5, max_in_flight=2).run(
+        square, tasks(), on_result=on_result
+    )
+    assert summary.succeeded == 100
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_timeout(jobs):
+    summary = Scheduler(jobs=jobs, timeout=0.2).run(slow, [(0,), (2,)])
+
+    assert summary.succeeded == 1
+    assert summary.failed == 1
+    assert "TaskTimeout" in summary.failures[0][1]
+
+
+def test_run_worker_death():
+    summary = Scheduler(jobs=2, chunk_size=1).run(die, [(x,) for x in range(6)])
+
+    assert summary.failed == 1
+    assert summary.failures[0] == ((3,), "worker process died")
+    assert summary.succeeded >= 1
+
+
+@pytest.mark.parametrize("chunk_size", [3, 6])
+def test_run_worker_death_fails_only_the_crashing_task(chunk_size):
+    results = []
+    summary = Scheduler(jobs=2, chunk_size=chunk_size).run(
+        die,
+        [(x,) for x in range(12)],
+        on_result=lambda task, result: results.append(task[0]),
+    )
+
+    assert summary.failures == [((3,), "worker process died")]
+    assert summary.succeeded == 11
+    assert sorted(results) == [x for x in range(12) if x != 3]
+
+
+def test_run_recycles_workers():
+    summary = Scheduler(jobs=2, chunk_size=1, max_tasks_per_child=1).run(
+        pid, [() for _ in range(8)]
+    )
+    assert summary.succeeded == 8
+
+
+def interval(x):
+    start = time.monotonic()
+    time.sleep(x)
+    return {"interval": (start, time.monotonic())}
+
+
+def test_run_recycling_keeps_worker_limit():
+    intervals = []
+    summary = Scheduler(jobs=2, chunk_size=1, max_tasks_per_child=1).run(
+        interval,
+        [(0.05,) for _ in range(12)],
+        on_result=lambda task, result: intervals.append(result["interval"]),
+    )
+
+    assert summary.succeeded == 12
+    # no more tasks run at once than there are workers
+    for start, _ in intervals:
+        running = [1 for s, e in intervals if s <= start < e]
+        assert len(running) <= 2
+
+
+def count(x):
+    counters.increment("calls")
+    counters.increment("total", x)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_aggregates_counters(jobs):
+    summary = Scheduler(jobs=jobs, chunk_size=2).run(count, [(x,) for x in range(5)])
+
+    assert summary.counters == {"calls": 5, "total": 10}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_aggregates_counters_of_this_process(jobs):
+    def tasks():
+        for x in range(5):
+            counters.increment("generated")
+            yield (x,)
+
+    summary = Scheduler(jobs=jobs, chunk_size=2).run(count, tasks())
+
+    assert summary.counters == {"generated": 5, "calls": 5, "total": 10}
+
+
+def count_or_die(x):
+    counters.increment("calls")
+    die(x)
+
+
+def test_run_aggregates_counters_of_recycled_and_retried_workers():
+    summary = Scheduler(jobs=2, chunk_size=3, max_tasks_per_child=1).run(
+        count_or_die, [(x,) for x in range(12)]
+    )
+
+    assert summary.failures == [((3,), "worker process died")]
+    # the counts of the chunks lost with the dead worker are lost with it,
+    # their tasks are counted once retried
+    assert summary.counters["calls"] == 11
+
+
+def set_offset(offset):
+    global OFFSET
+    OFFSET = offset
+
+
+def add_offset(x):
+    return {"value": x + OFFSET}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_initializer(jobs):
+    results = []
+    Scheduler(jobs=jobs, initializer=set_offset, initargs=(10,)).run(
+        add_offset,
+        [(x,) for x in range(3)],
+        on_result=lambda task, result: results.append(result["value"]),
+    )
+
+    assert sorted(results) == [10, 11, 12]
@@ -1,6 +1,15 @@
+import tempfile
+from unittest.mock import patch
+
 from _pytest.fixtures import fixture
 import pytest
-from bio3dbeacons.cli.sparql import UniprotSparql
+from bio3dbeacons.cli import counters
+from bio3dbeacons.cli.sparql import (
+    MEMO_HITS,
+    MEMO_MISSES,
+    MEMO_UNKNOWN_HITS,
+    UniprotSparql,
+)
 
 
 @fixture
@@ -14,3 +23,94 @@ def test_get_uniprot_acc_from_gene_name(sparql):
 
     uniprot_acc = sparql.get_uniprot_acc_for_gene_name("W5MWU3_LEPOC")
     assert uniprot_acc == "W5MWU3"
+
+
+def test_batch_resolution(sparql_server):
+    sparql = UniprotSparql(sparql_server.url, batch_size=2)
+    names = ["SMP_YERPE", "W5MWU3_LEPOC", "UNKNOWN_HUMAN", "SMP_YERPE"]
+
+    assert sparql.get_uniprot_accs_for_gene_names(names) == {
+        "SMP_YERPE": "Q8ZIQ1",
+        "W5MWU3_LEPOC": "W5MWU3",
+        "UNKNOWN_HUMAN": None,
+    }
+    # unique names only, batch_size names per query
+    assert len(sparql_server.queries) == 2
+
+    # hits and misses are memoized
+    assert sparql.get_uniprot_acc_for_gene_name("UNKNOWN_HUMAN") is None
+    assert sparql.get_uniprot_acc_for_gene_name("W5MWU3_LEPOC") == "W5MWU3"
+    assert len(sparql_server.queries) == 2
+
+    # names which are not mnemonics are never sent
+    assert sparql.get_uniprot_acc_for_gene_name("x' } ?s ?p ?o {") is None
+    assert len(sparql_server.queries) == 2
+
+
+def test_persistent_memo(sparql_server):
+    with tempfile.TemporaryDirectory() as d:
+        memo_path = f"{d}/sparql.sqlite"
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path)
+        sparql.get_uniprot_accs_for_gene_names(["SMP_YERPE", "UNKNOWN_HUMAN"])
+        sparql.close()
+        assert len(sparql_server.queries) == 1
+
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path)
+        assert sparql.get_uniprot_accs_for_gene_names(
+            ["SMP_YERPE", "UNKNOWN_HUMAN", "W5MWU3_LEPOC"]
+        ) == {"SMP_YERPE": "Q8ZIQ1", "UNKNOWN_HUMAN": None, "W5MWU3_LEPOC": "W5MWU3"}
+        sparql.close()
+
+        # only the name missing from the memo is queried
+        assert len(sparql_server.queries) == 2
+        assert "SMP_YERPE" not in sparql_server.queries[1]
+
+
+def test_memo_counters(sparql_server):
+    with tempfile.TemporaryDirectory() as d:
+        memo_path = f"{d}/sparql.sqlite"
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path)
+        counters.drain()
+        sparql.get_uniprot_accs_for_gene_names(["SMP_YERPE", "UNKNOWN_HUMAN"])
+        sparql.close()
+        assert counters.drain() == {MEMO_MISSES: 2}
+
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path)
+        names = ["SMP_YERPE", "UNKNOWN_HUMAN", "W5MWU3_LEPOC"]
+        sparql.get_uniprot_accs_for_gene_names(names)
+        # memoized in memory this time
+        sparql.get_uniprot_accs_for_gene_names(names)
+        sparql.close()
+
+        assert counters.drain() == {
+            MEMO_HITS: 3,
+            MEMO_UNKNOWN_HITS: 2,
+            MEMO_MISSES: 1,
+        }
+
+
+def test_failed_queries_are_not_memoized(sparql_server):
+    sparql = UniprotSparql(sparql_server.url)
+    with patch.object(UniprotSparql, "query", return_value=None):
+        assert sparql.get_uniprot_acc_for_gene_name("SMP_YERPE") is None
+
+    assert sparql.get_uniprot_acc_for_gene_name("SMP_YERPE") == "Q8ZIQ1"
+
+
+def test_memoized_misses_expire(sparql_server):
+    with tempfile.TemporaryDirectory() as d:
+        memo_path = f"{d}/sparql.sqlite"
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path)
+        sparql.get_uniprot_accs_for_gene_names(["SMP_YERPE", "UNKNOWN_HUMAN"])
+        sparql.close()
+
+        # the miss is queried again once expired, the resolved name is not
+        sparql = UniprotSparql(sparql_server.url, memo_path=memo_path, miss_ttl=0)
+        assert sparql.get_uniprot_accs_for_gene_names(
+            ["SMP_YERPE", "UNKNOWN_HUMAN"]
+        ) == {"SMP_YERPE": "Q8ZIQ1", "UNKNOWN_HUMAN": None}
+        sparql.close()
+
+        assert len(sparql_server.queries) == 2
+        assert "UNKNOWN_HUMAN" in sparql_server.queries[1]
+        assert "SMP_YERPE" not in sparql_server.queries[1]
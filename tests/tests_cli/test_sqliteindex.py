@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+import pytest
+
+from bio3dbeacons.cli.sqliteindex import ReadOnlyIndex, build_index
+
+
+def test_build_and_read_index():
+    with tempfile.TemporaryDirectory() as d:
+        path = f"{d}/nested/index.sqlite"
+        with build_index(path) as conn:
+            conn.execute("CREATE TABLE t (k TEXT PRIMARY KEY, v TEXT)")
+            conn.execute("INSERT INTO t VALUES ('a', 'b')")
+            # readers never see a partial index
+            assert not os.path.exists(path)
+
+        index = ReadOnlyIndex(path)
+        assert index.conn.execute("SELECT v FROM t").fetchall() == [("b",)]
+        index.close()
+        assert os.listdir(f"{d}/nested") == ["index.sqlite"]
+
+
+def test_failed_build_keeps_previous_index():
+    with tempfile.TemporaryDirectory() as d:
+        path = f"{d}/index.sqlite"
+        with build_index(path) as conn:
+            conn.execute("CREATE TABLE t (k TEXT)")
+
+        with pytest.raises(ValueError):
+            with build_index(path) as conn:
+                conn.execute("CREATE TABLE u (k TEXT)")
+                raise ValueError("broken dump")
+
+        assert os.listdir(d) == ["index.sqlite"]
+        index = ReadOnlyIndex(path)
+        tables = index.conn.execute("SELECT name FROM sqlite_master").fetchall()
+        assert tables == [("t",)]
+        index.close()
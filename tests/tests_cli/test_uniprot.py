@@ -0,0 +1,225 @@
+import json
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli import counters, fileio, uniprot
+from bio3dbeacons.cli.scheduler import Scheduler
+
+UNIPROT_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<uniprot xmlns="http://uniprot.org/uniprot">
+<entry>
+  <accession>P38398</accession>
+  <name>BRCA1_HUMAN</name>
+  <protein>
+    <recommendedName>
+      <fullName>Breast cancer type 1 susceptibility protein</fullName>
+    </recommendedName>
+  </protein>
+  <gene><name type="primary">BRCA1</name></gene>
+  <organism>
+    <name type="scientific">Homo sapiens</name>
+    <dbReference type="NCBI Taxonomy" id="9606"/>
+  </organism>
+</entry>
+</uniprot>
+"""
+
+ETAG = '"v1"'
+
+
+class UniProtHandler(BaseHTTPRequestHandler):
+    requests = []
+    throttled = set()
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.path in self.throttled:
+            self.throttled.remove(self.path)
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+        elif self.path != "/P38398.xml":
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            self.wfile.write(UNIPROT_XML)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def uniprot_server():
+    server = HTTPServer(("127.0.0.1", 0), UniProtHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    UniProtHandler.requests = []
+    UniProtHandler.throttled = set()
+    url = f"http://127.0.0.1:{server.server_port}"
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(
+            uniprot,
+            "get_config",
+            lambda section, key: url if key == "UNIPROT_XML_URL" else "30",
+        )
+        yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache_path():
+    with tempfile.TemporaryDirectory() as d:
+        yield (Path(d) / "uniprot.sqlite").as_posix()
+
+
+def test_parse_uniprot_entry():
+    assert uniprot.parse_uniprot_entry(ET.fromstring(UNIPROT_XML)) == {
+        "mappingId": "BRCA1_HUMAN",
+        "mappingDescription": "Breast cancer type 1 susceptibility protein",
+        "gene": "BRCA1",
+        "organismScientificName": "Homo sapiens",
+        "taxId": 9606,
+    }
+
+
+def test_extract_uniprot_fields():
+    expected = uniprot.parse_uniprot_entry(ET.fromstring(UNIPROT_XML))
+    assert (
+        uniprot.extract_uniprot_fields(uniprot.iter_chunks(UNIPROT_XML, 7)) == expected
+    )
+
+    # parsing stops after the organism, the rest of the entry is never read
+    head = UNIPROT_XML[: UNIPROT_XML.index(b"</organism>") + len(b"</organism>")]
+    assert uniprot.extract_uniprot_fields([head, b"<feature><<not xml"]) == expected
+
+    with pytest.raises(uniprot.UniProtError):
+        uniprot.extract_uniprot_fields(
+            [b'<uniprot xmlns="http://uniprot.org/uniprot"/>']
+        )
+
+
+def test_cache_hits(uniprot_server, cache_path):
+    counters.drain()
+    cache = uniprot.UniProtCache(cache_path)
+    info = cache.get("P38398")
+    assert info["mappingId"] == "BRCA1_HUMAN"
+    assert cache.get("P38398") == info
+    cache.close()
+
+    # another process or run reads the cache file
+    cache = uniprot.UniProtCache(cache_path)
+    assert cache.get("P38398") == info
+    assert cache.get("P00000") == {}
+    assert cache.get("P00000") == {}
+    cache.close()
+
+    assert len(UniProtHandler.requests) == 2
+    assert counters.drain() == {uniprot.HITS: 3, uniprot.MISSES: 2}
+
+
+def test_cache_revalidation(uniprot_server, cache_path):
+    cache = uniprot.UniProtCache(cache_path)
+    info = cache.get("P38398")
+    cache.close()
+    counters.drain()
+
+    cache = uniprot.UniProtCache(cache_path, ttl=0)
+    assert cache.get("P38398") == info
+    cache.close()
+
+    assert UniProtHandler.requests[-1] == ("/P38398.xml", ETAG)
+    assert counters.drain() == {uniprot.REVALIDATED: 1}
+
+    # stale entries are served if UniProt can not be reached
+    uniprot_server.shutdown()
+    uniprot_server.server_close()
+    cache = uniprot.UniProtCache(cache_path, refresh=True)
+    assert cache.get("P38398") == info
+    assert cache.get("P11111") is None
+    cache.close()
+    assert counters.drain() == {uniprot.STALE: 1, uniprot.ERRORS: 1}
+
+
+def info(accession):
+    return {"info": uniprot.get_uniprot_info(accession)}
+
+
+def test_collect_accessions():
+    with tempfile.TemporaryDirectory() as d:
+        (Path(d) / "nested").mkdir()
+        for name, accession, accession_type in [
+            ("a.json", "P38398", "uniprot"),
+            ("nested/b.json.gz", "P00000", "uniprot"),
+            ("c.json", "P38398", "uniprot"),
+            ("d.json", "XYZ", "other"),
+        ]:
+            fileio.write_text(
+                (Path(d) / name).as_posix(),
+                json.dumps(
+                    {
+                        "mappingAccession": accession,
+                        "mappingAccessionType": accession_type,
+                    }
+                ),
+            )
+
+        assert uniprot.collect_accessions(d) == {"P38398", "P00000"}
+
+
+def test_prefetch(uniprot_server, cache_path, monkeypatch):
+    monkeypatch.setattr(uniprot, "BACKOFF_BASE", 0.01)
+    UniProtHandler.throttled.add("/P38398.xml")
+    cache = uniprot.UniProtCache(cache_path)
+
+    counts = uniprot.prefetch(["P38398", "P00000", "P38398"], cache)
+
+    assert counts == {uniprot.MISSES: 2}
+    assert cache.read("P38398")[0]["taxId"] == 9606
+    assert cache.read("P00000")[0] == {}
+    # the rate limited request was retried
+    assert len(UniProtHandler.requests) == 3
+
+    # fresh entries are not fetched again
+    assert uniprot.prefetch(["P38398", "P00000"], cache) == {}
+    assert len(UniProtHandler.requests) == 3
+    cache.close()
+
+
+def test_workers_read_prefetched_entries(uniprot_server):
+    with tempfile.TemporaryDirectory() as d:
+        with open(Path(d) / "a.json", "w") as fh:
+            json.dump(
+                {"mappingAccession": "P38398", "mappingAccessionType": "uniprot"}, fh
+            )
+
+        initargs = uniprot.prepare_cache(prefetch_from=d)
+        assert initargs[0] is not None
+        assert len(UniProtHandler.requests) == 1
+
+        results = []
+        summary = Scheduler(
+            jobs=2, initializer=uniprot.configure_cache, initargs=initargs
+        ).run(
+            info,
+            [("P38398",)] * 4,
+            on_result=lambda task, result: results.append(result["info"]),
+        )
+        uniprot.configure_cache()
+
+    assert [x["mappingId"] for x in results] == ["BRCA1_HUMAN"] * 4
+    assert summary.counters == {uniprot.HITS: 4}
+    assert len(UniProtHandler.requests) == 1
@@ -0,0 +1,142 @@
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from bio3dbeacons.cli import fileio, uniprot
+from bio3dbeacons.cli.uniprotindex import uniprotindex
+
+UNIPROT_XML_DUMP = """<?xml version="1.0" encoding="UTF-8"?>
+<uniprot xmlns="http://uniprot.org/uniprot">
+<entry dataset="Swiss-Prot">
+  <accession>P38398</accession>
+  <accession>O15129</accession>
+  <name>BRCA1_HUMAN</name>
+  <protein>
+    <recommendedName>
+      <fullName>Breast cancer type 1 susceptibility protein</fullName>
+    </recommendedName>
+  </protein>
+  <gene><name type="primary">BRCA1</name></gene>
+  <organism>
+    <name type="scientific">Homo sapiens</name>
+    <name type="common">Human</name>
+    <dbReference type="NCBI Taxonomy" id="9606"/>
+  </organism>
+</entry>
+<entry dataset="TrEMBL">
+  <accession>A0A024R1R8</accession>
+  <name>A0A024R1R8_HUMAN</name>
+  <protein>
+    <submittedName>
+      <fullName evidence="1">HCG2014768, isoform CRA_a</fullName>
+    </submittedName>
+  </protein>
+  <organism>
+    <name type="scientific">Homo sapiens</name>
+    <dbReference type="NCBI Taxonomy" id="9606"/>
+  </organism>
+</entry>
+</uniprot>
+"""
+
+UNIPROT_FLAT_DUMP = """ID   BRCA1_HUMAN             Reviewed;        1863 AA.
+AC   P38398; O15129;
+DT   01-FEB-1995, integrated into UniProtKB/Swiss-Prot.
+DE   RecName: Full=Breast cancer type 1 susceptibility protein;
+DE            EC=2.3.2.27 {ECO:0000269|PubMed:12890688};
+GN   Name=BRCA1; Synonyms=RNF53;
+OS   Homo sapiens (Human).
+OX   NCBI_TaxID=9606;
+SQ   SEQUENCE   1863 AA;  207721 MW;  C4B3A3F2F7C8C1A4 CRC64;
+     MDLSALRVEE VQNVINAMQK ILECPICLEL IKEPVSTKCD HIFCKFCMLK LLNQKKGPSQ
+//
+ID   A0A024R1R8_HUMAN        Unreviewed;       122 AA.
+AC   A0A024R1R8;
+DE   SubName: Full=HCG2014768, isoform CRA_a {ECO:0000313|EMBL:EAW89869.1};
+OS   Homo sapiens (Human).
+OX   NCBI_TaxID=9606 {ECO:0000313|EMBL:EAW89869.1};
+//
+"""
+
+BRCA1 = {
+    "mappingId": "BRCA1_HUMAN",
+    "mappingDescription": "Breast cancer type 1 susceptibility protein",
+    "gene": "BRCA1",
+    "organismScientificName": "Homo sapiens",
+    "taxId": 9606,
+}
+
+TREMBL = {
+    "mappingId": "A0A024R1R8_HUMAN",
+    "mappingDescription": "HCG2014768, isoform CRA_a",
+    "gene": None,
+    "organismScientificName": "Homo sapiens",
+    "taxId": 9606,
+}
+
+
+@pytest.mark.parametrize(
+    "name, text",
+    [
+        ("uniprot_sprot.xml.gz", UNIPROT_XML_DUMP),
+        ("uniprot_sprot.dat", UNIPROT_FLAT_DUMP),
+    ],
+)
+def test_build_uniprot_index(name, text):
+    with tempfile.TemporaryDirectory() as d:
+        dump_path = (Path(d) / name).as_posix()
+        index_path = (Path(d) / "index" / "uniprot.sqlite").as_posix()
+        fileio.write_text(dump_path, text)
+
+        assert uniprotindex.run(dump_path, index_path) == 0
+
+        index = uniprot.UniProtIndex(index_path)
+        assert index.get("P38398") == BRCA1
+        # secondary accessions and entry names are indexed as well
+        assert index.get("O15129") == BRCA1
+        assert index.get("brca1_human") == BRCA1
+        assert index.get("A0A024R1R8") == TREMBL
+        assert index.get("P00000") == {}
+        index.close()
+
+
+def test_build_uniprot_index_errors():
+    with tempfile.TemporaryDirectory() as d:
+        dump_path = Path(d) / "uniprot.fasta"
+        dump_path.write_text(">sp|P38398|BRCA1_HUMAN\n")
+
+        assert uniprotindex.run(dump_path.as_posix(), f"{d}/index.sqlite") == 1
+        assert uniprotindex.run(f"{d}/missing.xml", f"{d}/index.sqlite") == 1
+        assert not Path(f"{d}/index.sqlite").exists()
+
+
+@pytest.mark.parametrize(
+    "organism, name",
+    [
+        ("Homo sapiens (Human).", "Homo sapiens"),
+        ("Escherichia coli (strain K12).", "Escherichia coli (strain K12)"),
+        (
+            "Saccharomyces cerevisiae (strain ATCC 204508 / S288c) (Baker's yeast).",
+            "Saccharomyces cerevisiae (strain ATCC 204508 / S288c)",
+        ),
+    ],
+)
+def test_get_scientific_name(organism, name):
+    assert uniprotindex.get_scientific_name(organism) == name
+
+
+def test_get_uniprot_info_from_index():
+    with tempfile.TemporaryDirectory() as d:
+        dump_path = (Path(d) / "uniprot_sprot.xml").as_posix()
+        index_path = (Path(d) / "uniprot.sqlite").as_posix()
+        fileio.write_text(dump_path, UNIPROT_XML_DUMP)
+        uniprotindex.run(dump_path, index_path)
+
+        initargs = uniprot.prepare_cache(index_path=index_path)
+        try:
+            assert initargs[-1] == index_path
+            assert uniprot.get_uniprot_info("P38398") == BRCA1
+            assert uniprot.get_uniprot_info("P00000") == {}
+        finally:
+            uniprot.configure_cache()
@@ -1,11 +1,42 @@
 import json
 import tempfile
+from pathlib import Path
 
 import gemmi
-from bio3dbeacons.cli import utils
+from bio3dbeacons.cli import fileio, utils
+
+TEXT_FIELD_CIF = """data_test
+_struct.title
+;
+loop_
+_entity.id
+;
+_entry.id test
+loop_
+_atom_site.id
+1
+2
+loop_
+_entity.id
+_entity.type
+_entity.pdbx_description
+1 polymer
+;Multi-line
+description
+;
+#
+_exptl.method 'THEORETICAL MODEL'
+_struct_asym.id A
+_struct_asym.entity_id 1
+_ma_qa_metric_global.metric_value 80.0
+"""
 
 
 class TestUtils:
+    def test_chunked(self):
+        chunks = list(utils.chunked(iter(range(7)), 3))
+        assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
     def test_prepare_data_dictionary_from_json(self):
 
         tmp_file = tempfile.NamedTemporaryFile("w+")
@@ -37,3 +68,31 @@ class TestUtils:
         r = utils.prepare_data_dictionary(b, "cif_json_mapping")
 
         assert not r.get("entryId") and not r.get("experimentalMethod")
+
+    def test_read_cif_categories(self, cif_file, cif_doc):
+        text = utils.read_cif_categories(cif_file, utils.get_index_cif_categories())
+        block = gemmi.cif.read_string(text).sole_block()
+
+        assert block.name == cif_doc.sole_block().name
+        assert block.find_mmcif_category("_atom_site.").width() == 0
+        assert utils.prepare_data_dictionary_from_cif(
+            block
+        ) == utils.prepare_data_dictionary_from_cif(cif_doc.sole_block())
+
+    def test_read_cif_categories_text_fields(self):
+        with tempfile.TemporaryDirectory() as d:
+            cif_file = (Path(d) / "test.cif.gz").as_posix()
+            fileio.write_text(cif_file, TEXT_FIELD_CIF)
+            text = utils.read_cif_categories(cif_file, utils.INDEX_CIF_CATEGORIES)
+
+        block = gemmi.cif.read_string(text).sole_block()
+        full_block = gemmi.cif.read_string(TEXT_FIELD_CIF).sole_block()
+        assert utils.prepare_data_dictionary_from_cif(
+            block
+        ) == utils.prepare_data_dictionary_from_cif(full_block)
+        assert block.find_value("_entity.pdbx_description") == (
+            ";Multi-line\ndescription\n;"
+        )
+        # reading stops once all the categories have been read
+        assert "_ma_qa_metric_global" not in text
+        assert "_struct." not in text
@@ -1,8 +1,13 @@
 import json
 import os
 import tempfile
+from unittest.mock import patch
 
-from bio3dbeacons.cli.validatejson.validatejson import ValidateJSON
+from jsonschema import Draft202012Validator
+
+from bio3dbeacons.cli.scheduler import Scheduler
+from bio3dbeacons.cli.validatejson import validatejson
+from bio3dbeacons.cli.validatejson.validatejson import ValidateJSON, ValidationReport
 
 
 class TestValidateJson:
@@ -39,3 +44,98 @@ class TestValidateJson:
         os.unlink(temp_index_json)
 
         assert not ValidateJSON.validate(temp_index_json)
+
+    def test_validator_is_compiled_once(self):
+        assert ValidateJSON.get_validator() is ValidateJSON.get_validator()
+
+    def test_report(self):
+        report = ValidationReport(max_errors=2)
+        for i in range(3):
+            ValidateJSON.validate_document({"entryId": i}, f"doc{i}", report)
+
+        other = ValidationReport(max_errors=2)
+        ValidateJSON.validate_document({"entryId": "someId"}, "doc3", other)
+        report.merge(other)
+
+        assert report.documents == 4
+        assert report.invalid == 4
+        assert report.rules["properties/entryId/type"] == 3
+        assert report.errors["properties/entryId/type"] == [
+            "doc0: 0 is not of type 'string'",
+            "doc1: 1 is not of type 'string'",
+        ]
+        assert report.rules["required"] == 4
+        assert len(report.errors["required"]) == 2
+        assert report.exit_status == 1
+
+    def test_run_directory(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/valid.json", "w") as fh:
+                json.dump({"entryId": "someId"}, fh)
+            with open(f"{d}/invalid.json", "w") as fh:
+                json.dump({"entryId": 1}, fh)
+            report_path = f"{d}/report.txt"
+
+            with patch.object(
+                ValidateJSON,
+                "get_validator",
+                return_value=Draft202012Validator(
+                    {"properties": {"entryId": {"type": "string"}}}
+                ),
+            ):
+                assert (
+                    validatejson.run(
+                        d, scheduler=Scheduler(jobs=1), report_path=report_path
+                    )
+                    == 1
+                )
+                assert validatejson.run(f"{d}/valid.json") == 0
+
+            with open(report_path) as fh:
+                report = json.load(fh)
+
+        assert report["documents"] == 2
+        assert report["valid"] == 1
+        assert report["rules"] == {
+            "properties/entryId/type": {
+                "count": 1,
+                "errors": [f"{d}/invalid.json: 1 is not of type 'string'"],
+            }
+        }
+
+    def test_run_directory_malformed(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/valid.json", "w") as fh:
+                json.dump({"entryId": "someId"}, fh)
+            with open(f"{d}/broken.json", "w") as fh:
+                fh.write("{")
+            with open(f"{d}/index-000000.jsonl", "w") as fh:
+                fh.write('{"entryId": "a"}\n{\n{"entryId": "b"}\n')
+            report_path = f"{d}/report.txt"
+
+            with patch.object(
+                ValidateJSON,
+                "get_validator",
+                return_value=Draft202012Validator(
+                    {"properties": {"entryId": {"type": "string"}}}
+                ),
+            ):
+                assert (
+                    validatejson.run(
+                        d,
+                        scheduler=Scheduler(jobs=1, chunk_size=2),
+                        report_path=report_path,
+                    )
+                    == 1
+                )
+
+            with open(report_path) as fh:
+                report = json.load(fh)
+
+        # malformed documents are reported, the other lines of a shard are read
+        assert report["documents"] == 5
+        assert report["valid"] == 3
+        assert report["rules"]["(json)"]["count"] == 2
+        assert sorted(
+            error.split(": ")[0] for error in report["rules"]["(json)"]["errors"]
+        ) == [f"{d}/broken.json", f"{d}/index-000000.jsonl:2"]
@@ -41,3 +41,70 @@ def compare_files(*, got, expected):
             LOG.warning(diff_line.strip())
 
     return are_files_identical
+
+
+def get_structure_summary(path):
+    """Returns the entities, residues and atoms of a structure file, what stays
+    the same across gemmi releases whatever the CIF layout they write
+
+    Label sequence ids and subchain names are left out, older gemmi releases
+    did not write the former and named the latter differently.
+    """
+    import gemmi
+
+    structure = gemmi.read_structure(f"{path}")
+    entities = sorted((e.name, e.entity_type.name) for e in structure.entities)
+    residues = [
+        (
+            model_index,
+            chain.name,
+            str(residue.seqid),
+            residue.name,
+            residue.entity_type.name,
+            [
+                (
+                    atom.name,
+                    atom.element.name,
+                    atom.altloc,
+                    round(atom.pos.x, 3),
+                    round(atom.pos.y, 3),
+                    round(atom.pos.z, 3),
+                    round(atom.occ, 2),
+                    round(atom.b_iso, 2),
+                )
+                for atom in residue
+            ],
+        )
+        for model_index, model in enumerate(structure)
+        for chain in model
+        for residue in chain
+    ]
+
+    return entities, residues
+
+
+def compare_structures(*, got, expected):
+    """Compares the structure of a test file against expected: same entities,
+    residues, sequence ids, atoms and coordinates
+
+    Args:
+        got: file with temp data
+        expected: file with expected data
+    """
+    got_entities, got_residues = get_structure_summary(got)
+    expected_entities, expected_residues = get_structure_summary(expected)
+
+    if got_entities != expected_entities:
+        LOG.warning(f"Entities of {got}: {got_entities}, expected {expected_entities}")
+    if len(got_residues) != len(expected_residues):
+        LOG.warning(
+            f"{len(got_residues)} residues in {got}, "
+            f"expected {len(expected_residues)}"
+        )
+    for got_residue, expected_residue in zip(got_residues, expected_residues):
+        if got_residue != expected_residue:
+            LOG.warning(f"Residue of {got}: {got_residue}")
+            LOG.warning(f"Expected: {expected_residue}")
+            break
+
+    return got_entities == expected_entities and got_residues == expected_residues